@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Benchmarks of the VueISS decoding pipeline and the Wetter uploader
+
+Runs each benchmark over the same synthetic frames (see frames.py) and
+reports the operations per second, the time per operation, the Python
+objects still alive afterwards and the growth of the peak resident memory.
+Python 2 has no allocation tracer, the object and memory growth show
+retained allocations and leaks.
+
+The benchmarks use the driver of this working tree and need weewx on the
+PYTHONPATH, e.g.
+
+    PYTHONPATH=/home/weewx/bin python bench/bench_vueiss.py --save
+
+--save stores the results as baseline, --compare fails if a benchmark got
+slower than the baseline by more than --tolerance percent.
+"""
+
+import gc
+import imp
+import json
+import optparse
+import os
+import Queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import configobj
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BIN_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'bin')
+
+import frames
+
+def use_working_tree():
+    # makes user.drivers.vueiss, user.vueiss_store and user.wetter import
+    # from this tree
+    try:
+        import user
+    except ImportError:
+        user = sys.modules['user'] = imp.new_module('user')
+        user.__path__ = []
+    if not hasattr(user, '__path__'):
+        # the user module of the standard library
+        user = sys.modules['user'] = imp.new_module('user')
+        user.__path__ = []
+    user.__path__.insert(0, os.path.join(BIN_DIR, 'user'))
+    try:
+        import user.drivers
+    except ImportError:
+        user.drivers = sys.modules['user.drivers'] = imp.new_module('user.drivers')
+        user.drivers.__path__ = []
+    user.drivers.__path__.insert(0, os.path.join(BIN_DIR, 'user', 'drivers'))
+
+use_working_tree()
+
+import user.drivers.vueiss as vueiss
+import user.vueiss_store as vueiss_store
+
+class Result(object):
+
+    def __init__(self, name, operations, seconds, objects, memory):
+        self.name = name
+        self.operations = operations
+        self.seconds = seconds
+        self.objects = objects
+        self.memory = memory
+
+    @property
+    def rate(self):
+        return self.operations / self.seconds if self.seconds > 0 else 0.0
+
+    def as_dict(self):
+        return {'operations': self.operations, 'seconds': self.seconds, 'rate': self.rate,
+                'objects': self.objects, 'memory': self.memory}
+
+def measure(name, operations, setup, run, repeat):
+    """Runs run(setup()) repeat times and keeps the fastest run.
+
+    operations is the number of operations of one run. The objects alive
+    after a run are counted with the garbage collector disabled during the
+    run, so garbage is not collected in the timed code.
+    """
+    best = None
+    objects = 0
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for _ in range(repeat):
+        state = setup()
+        gc.collect()
+        before = len(gc.get_objects())
+        gc.disable()
+        try:
+            start = time.time()
+            result = run(state)
+            seconds = time.time() - start
+        finally:
+            gc.enable()
+        objects = max(objects, len(gc.get_objects()) - before)
+        del result, state
+        if best is None or seconds < best:
+            best = seconds
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory
+    return Result(name, operations, best, objects, memory)
+
+def bench_crc(rows, repeat):
+    data = [strdata.split() for (_, strdata) in rows if strdata.startswith('I')]
+    def run(data):
+        for frame in data:
+            vueiss.crc(frame)
+    return measure('crc', len(data), lambda: data, run, repeat)
+
+def bench_crc_frame(rows, repeat):
+    data = [vueiss.decode_hex(strdata.split()) for (_, strdata) in rows if strdata.startswith('I')]
+    def run(data):
+        for frame in data:
+            vueiss.crc_frame(frame)
+    return measure('crc_frame', len(data), lambda: data, run, repeat)
+
+def bench_parse(rows, repeat):
+    data = [(data_time / 1000, strdata.split()) for (data_time, strdata) in rows]
+    def run(parser):
+        for (data_time, frame) in data:
+            parser.parse(frame, data_time)
+    return measure('StationParser.parse', len(data), vueiss.StationParser, run, repeat)
+
+def bench_parse_batch(rows, repeat):
+    batches = [rows[idx:idx + 5000] for idx in range(0, len(rows), 5000)]
+    def run(parser):
+        for batch in batches:
+            parser.parse_batch(batch)
+    return measure('StationParser.parse_batch', len(rows), vueiss.StationParser, run, repeat)
+
+def bench_registry(rows, repeat, stations=4):
+    # the same frames heard by one receiver per station, parsed in this
+    # process and with a worker process per station but the first
+    receivers = [str(idx) for idx in range(stations)]
+    merged = sorted((data_time, strdata, receiver) for (data_time, strdata) in rows for receiver in receivers)
+    batches = [merged[idx:idx + 5000] for idx in range(0, len(merged), 5000)]
+    results = []
+    for workers in (0, stations - 1):
+        def setup():
+            return vueiss.StationRegistry([vueiss.Station(receiver, receivers=[receiver]) for receiver in receivers],
+                                          receivers=True, workers=workers)
+        def run(registry):
+            for batch in batches:
+                registry.parse_batch(batch)
+            registry.close()
+        results.append(measure('StationRegistry.parse_batch/%d' % workers, len(merged), setup, run, repeat))
+    return results
+
+def _sensor_frames(rows, sensor):
+    # the decoded I frames of a sensor, with a minute mark before every
+    # 24th frame
+    result = []
+    for (data_time, strdata) in rows:
+        data = strdata.split()
+        if data[0] == 'I':
+            frame = vueiss.decode_hex(data)
+            if sensor is None or frame[0] >> 4 == sensor:
+                result.append(frame)
+    return [(idx % 24 == 0, frame) for (idx, frame) in enumerate(result)]
+
+def bench_add(name, factory, rows, sensor, repeat):
+    data = _sensor_frames(rows, sensor)
+    def run(accumulator):
+        for (minute, frame) in data:
+            if minute:
+                accumulator.reset()
+            accumulator.add(frame)
+    return measure(name, len(data), factory, run, repeat)
+
+def bench_barometer_add(rows, repeat):
+    data = []
+    for (data_time, strdata) in rows:
+        values = strdata.split()
+        if values[0] in ('A', 'B'):
+            data.append((len(data) % 4 == 0, values[0], float(values[4])))
+    def run(accumulator):
+        for (minute, kind, pressure) in data:
+            if minute:
+                accumulator.reset()
+            accumulator.add(kind, pressure)
+    return measure('BarometerDataN.add', len(data), lambda: vueiss.BarometerDataN(310.8, 10), run, repeat)
+
+def bench_calc(rows, repeat):
+    parser = vueiss.StationParser()
+    packets = parser._parse_rows([(data_time, strdata.split()) for (data_time, strdata) in rows])
+    data = [(packet['outTemp'], packet['outHumidity']) for packet in packets
+            if packet['outTemp'] is not None and packet['outHumidity'] is not None] * 20
+    def run_svp(data):
+        for (temperature, humidity) in data:
+            vueiss.calc_svp(temperature)
+    def run_dewpoint(data):
+        for (temperature, humidity) in data:
+            vueiss.calc_dewpoint(temperature, humidity)
+    def run_dewpoints(data):
+        vueiss.calc_dewpoints(data)
+    return [measure('calc_svp', len(data), lambda: data, run_svp, repeat),
+            measure('calc_dewpoint', len(data), lambda: data, run_dewpoint, repeat),
+            measure('calc_dewpoints', len(data), lambda: data, run_dewpoints, repeat)]
+
+def bench_wetter(rows, repeat):
+    import weewx
+    import user.wetter
+    parser = vueiss.StationParser()
+    packets = parser._parse_rows([(data_time, strdata.split()) for (data_time, strdata) in rows])
+    records = []
+    for packet in packets * 20:
+        record = dict(packet)
+        record['usUnits'] = weewx.METRICWX
+        record['interval'] = 1
+        records.append(record)
+    thread = user.wetter.WetterThread(Queue.Queue(), 'bench', 'secret', manager_dict=None)
+    def run(records):
+        for record in records:
+            thread.get_data(record)
+    return measure('WetterThread.get_data', len(records), lambda: records, run, repeat)
+
+def sqlite_config(root):
+    # a weewx configuration with the sensor tables in a SQLite database
+    return configobj.ConfigObj({'WEEWX_ROOT': root,
+            'DataBindings': {'wx_binding': {'database': 'bench_sqlite',
+                                            'table_name': 'archive',
+                                            'manager': 'weewx.manager.Manager',
+                                            'schema': 'schemas.wview.schema'}},
+            'Databases': {'bench_sqlite': {'database_name': 'bench.sdb',
+                                           'database_type': 'SQLite'}},
+            'DatabaseTypes': {'SQLite': {'driver': 'weedb.sqlite',
+                                         'SQLITE_ROOT': root}},
+            'VueISS': {}})
+
+def bench_loop_packets(rows, repeat):
+    import sqlite3
+    root = tempfile.mkdtemp(prefix='bench_vueiss')
+    config_dict = sqlite_config(root)
+    expected = len(vueiss.StationParser()._parse_rows([(data_time, strdata.split())
+                                                       for (data_time, strdata) in rows]))
+    def setup():
+        path = os.path.join(root, 'bench.sdb')
+        if os.path.exists(path):
+            os.unlink(path)
+        connection = sqlite3.connect(path)
+        connection.executescript("CREATE TABLE sensor (dateTime BIGINT NOT NULL, data VARCHAR(80), "
+                                 "description VARCHAR(80));"
+                                 "CREATE INDEX sensor_dateTime ON sensor (dateTime);"
+                                 "CREATE TABLE last_sensor (dateTime BIGINT NOT NULL, state TEXT);"
+                                 "INSERT INTO last_sensor VALUES (0, NULL);")
+        connection.executemany("INSERT INTO sensor (dateTime, data) VALUES (?, ?)", rows)
+        connection.commit()
+        connection.close()
+        return vueiss.VueISS(config_dict)
+    def run(station):
+        packets = station.genLoopPackets()
+        for _ in range(expected):
+            packets.next()
+        packets.close()
+        station.closePort()
+    try:
+        result = measure('VueISS.genLoopPackets', len(rows), setup, run, repeat)
+    finally:
+        shutil.rmtree(root)
+    return result
+
+def run_benchmarks(rows, repeat, only=None):
+    benchmarks = [
+        ('crc', lambda: bench_crc(rows, repeat)),
+        ('crc_frame', lambda: bench_crc_frame(rows, repeat)),
+        ('StationParser.parse', lambda: bench_parse(rows, repeat)),
+        ('StationParser.parse_batch', lambda: bench_parse_batch(rows, repeat)),
+        ('StationRegistry.parse_batch', lambda: bench_registry(rows, repeat)),
+        ('WindDataN.add', lambda: bench_add('WindDataN.add', lambda: vueiss.WindDataN(10), rows, None, repeat)),
+        ('WindEngine.add', lambda: bench_add('WindEngine.add', lambda: vueiss.WindEngine(10), rows, None, repeat)),
+        ('TemperatureDataN.add', lambda: bench_add('TemperatureDataN.add', lambda: vueiss.TemperatureDataN(5),
+                                                   rows, 0x8, repeat)),
+        ('HumityDataN.add', lambda: bench_add('HumityDataN.add', lambda: vueiss.HumityDataN(5),
+                                              rows, 0xA, repeat)),
+        ('BarometerDataN.add', lambda: bench_barometer_add(rows, repeat)),
+        ('calc', lambda: bench_calc(rows, repeat)),
+        ('WetterThread.get_data', lambda: bench_wetter(rows, repeat)),
+        ('VueISS.genLoopPackets', lambda: bench_loop_packets(rows, repeat)),
+    ]
+    results = []
+    for (name, bench) in benchmarks:
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        try:
+            result = bench()
+        except ImportError, e:
+            print "%-28s skipped: %s" % (name, e)
+            continue
+        for result in (result if isinstance(result, list) else [result]):
+            print "%-28s %12.0f ops/s %10.2f us/op %8d objects %8d kB" % \
+                (result.name, result.rate, 1e6 / result.rate if result.rate else 0.0,
+                 result.objects, result.memory)
+            results.append(result)
+    return results
+
+def compare(results, baseline, tolerance):
+    # returns the names of the benchmarks slower than the baseline
+    slower = []
+    for result in results:
+        if result.name not in baseline:
+            continue
+        rate = baseline[result.name]['rate']
+        change = 100.0 * (result.rate - rate) / rate if rate else 0.0
+        print "%-28s %+7.1f%% against the baseline" % (result.name, change)
+        if change < -tolerance:
+            slower.append(result.name)
+    return slower
+
+def main():
+    parser = optparse.OptionParser(usage="bench_vueiss.py [--frames=N] [--repeat=N] [--only=NAME]... "
+                                         "[--save | --compare] [--baseline=FILE] [--tolerance=PERCENT]")
+    parser.add_option("--frames", dest="frames", type=int, default=20000,
+                      help="Number of synthetic frames. Default is 20000.")
+    parser.add_option("--repeat", dest="repeat", type=int, default=5,
+                      help="Runs per benchmark, the fastest one counts. Default is 5.")
+    parser.add_option("--seed", dest="seed", type=int, default=1,
+                      help="Seed of the synthetic frames. Default is 1.")
+    parser.add_option("--only", dest="only", action="append",
+                      help="Run only the benchmarks starting with NAME.")
+    parser.add_option("--baseline", dest="baseline", default=os.path.join(BENCH_DIR, 'baseline.json'),
+                      help="Baseline file. Default is bench/baseline.json.")
+    parser.add_option("--save", dest="save", action="store_true",
+                      help="Save the results as baseline.")
+    parser.add_option("--compare", dest="compare", action="store_true",
+                      help="Compare the results with the baseline.")
+    parser.add_option("--tolerance", dest="tolerance", type=float, default=10.0,
+                      help="Percent a benchmark may be slower than the baseline. Default is 10.")
+    (options, args) = parser.parse_args()
+
+    rows = frames.rows(options.frames, options.seed)
+    results = run_benchmarks(rows, options.repeat, options.only)
+
+    if options.save:
+        baseline = {'frames': options.frames, 'seed': options.seed, 'python': sys.version.split()[0],
+                    'results': dict((result.name, result.as_dict()) for result in results)}
+        with open(options.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print "Saved the baseline to %s" % options.baseline
+    elif options.compare:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('frames') != options.frames or baseline.get('seed') != options.seed:
+            print "The baseline was measured with other frames"
+            return 2
+        slower = compare(results, baseline['results'], options.tolerance)
+        if slower:
+            print "Slower than the baseline: %s" % ', '.join(slower)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
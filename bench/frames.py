@@ -0,0 +1,112 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Synthetic frames of a Davis Vue ISS and its datalogger
+
+The rows look like those of the sensor table: an I frame of the ISS about
+every 2.5 seconds, cycling through the sensor ids with slowly changing
+weather, and the B frame of the datalogger's pressure sensor every 15
+seconds, with an A frame (sea level pressure) now and then. All I frames
+carry a valid crc. The rows are the same for the same seed.
+"""
+
+import math
+import random
+
+POLYNOMIAL = 0x1021
+
+def crc16(values):
+    # the crc of the ISS radio packet, 0 over a whole frame
+    crc = 0
+    for value in values:
+        crc ^= value << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ POLYNOMIAL) if crc & 0x8000 else crc << 1
+            crc &= 0xffff
+    return crc
+
+# the sensor ids by the high nibble of the header byte, in the order the
+# ISS transmits them
+SENSOR_IDS = (0x8, 0xE, 0x5, 0xA, 0x9, 0x2, 0x7, 0x8, 0xE, 0x5, 0xA, 0x9, 0x7, 0x2)
+
+def iss_frame(sensor, speed, direction, byte3, byte4, transmitter=0):
+    # the 10 bytes of an I frame, the crc completes the 8 bytes of the
+    # radio packet, the last two bytes are filled like the receiver does
+    values = [(sensor << 4) | transmitter, speed, direction, byte3, byte4, 0]
+    crc = crc16(values)
+    return values + [crc >> 8, crc & 0xff, 0xff, 0xff]
+
+def text_frame(values):
+    return 'I 1 ' + ' '.join('%02X' % value for value in values)
+
+class Weather(object):
+    """Slowly changing weather with some noise"""
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.rain_ticks = 0
+
+    def sensor_bytes(self, sensor, t):
+        # byte3 and byte4 of a frame of sensor at t (in seconds)
+        day = 2.0 * math.pi * t / 86400.0
+        if sensor == 0x8:
+            temperature = 10.0 + 8.0 * math.sin(day) + self.random.gauss(0.0, 0.1)
+            raw = int(round((temperature * 9.0 / 5.0 + 32.0) * 160.0)) & 0xffff
+            return raw >> 8, raw & 0xff
+        if sensor == 0xA:
+            humidity = 70.0 - 20.0 * math.sin(day) + self.random.gauss(0.0, 0.5)
+            raw = int(round(min(max(humidity, 1.0), 100.0) * 10.0 / 1.01))
+            return raw & 0xff, (raw >> 8) << 4
+        if sensor == 0xE:
+            if self.random.random() < 0.02:
+                self.rain_ticks = (self.rain_ticks + 1) % 128
+            return self.rain_ticks, 0
+        if sensor == 0x9:
+            return self.random.randint(2, 25), 0
+        return self.random.randint(0, 255), self.random.randint(0, 255)
+
+    def wind(self, t):
+        speed = max(0, int(round(5.0 + 3.0 * math.sin(t / 3600.0) + self.random.gauss(0.0, 1.5))))
+        direction = int(round(64.0 + 20.0 * math.sin(t / 7200.0) + self.random.gauss(0.0, 4.0))) % 256
+        return speed, direction
+
+    def pressure(self, t):
+        # station pressure in hundredths of hPa
+        return int(round(97500.0 + 500.0 * math.sin(2.0 * math.pi * t / 345600.0)
+                         + self.random.gauss(0.0, 5.0)))
+
+def rows(count, seed=1, start=1500000000000):
+    """Returns count (dateTime, data) rows of the sensor table, dateTime in
+    ms from start on."""
+    weather = Weather(seed)
+    result = []
+    data_time = start
+    next_pressure = start
+    index = 0
+    while len(result) < count:
+        if next_pressure <= data_time:
+            pressure = weather.pressure(next_pressure / 1000.0)
+            if weather.random.random() < 0.1:
+                # sea level pressure of the datalogger's display
+                pressure = int(round(math.pow(math.pow(pressure / 100.0, 0.1902614)
+                                              + 8.417168e-05 * 310.8, 5.255927) * 100.0))
+                result.append((next_pressure, 'A 0 0 0 %d' % pressure))
+            else:
+                result.append((next_pressure, 'B 0 0 0 %d' % pressure))
+            next_pressure += 15000
+            continue
+        sensor = SENSOR_IDS[index % len(SENSOR_IDS)]
+        index += 1
+        t = data_time / 1000.0
+        speed, direction = weather.wind(t)
+        byte3, byte4 = weather.sensor_bytes(sensor, t)
+        result.append((data_time, text_frame(iss_frame(sensor, speed, direction, byte3, byte4))))
+        data_time += 2500 + weather.random.randint(-40, 40)
+    return result
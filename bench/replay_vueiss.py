@@ -0,0 +1,514 @@
+#!/usr/bin/env python
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Records the frames of the sensor table and replays them through the driver
+
+record exports the frames of a time range to a capture file, a gzipped text
+file with a header line and one frame per line, the time as the ms since
+the previous frame:
+
+    python bench/replay_vueiss.py record --config=/home/weewx/weewx.conf \\
+        --from=2017-07-01 --to=2017-08-01 july.capture
+
+or, without a database, --synthetic=N frames of frames.py.
+
+replay feeds the frames of a capture through the driver of this working
+tree and checks the packets against a golden file:
+
+    python bench/replay_vueiss.py replay --speedup=0 --golden=july.json july.capture
+
+With --mode=driver (the default) a VueISS with a temporary SQLite database
+runs under a fake engine, which takes the LOOP packets like the weewx
+engine: after the packet ending an archive interval (--archive-interval,
+60 breaks after every packet) it closes genLoopPackets, asks for the
+archive records and starts it again. The replay fails if a packet is not
+newer than the one before or the rain of the packets differs from that of
+a single pass of the parser over the frames. Whenever the driver waits for the
+datalogger, the frames up to the next A or B frame are stored, at
+--speedup times real time or, with 0, as fast as possible; --preload
+stores them all first, so the driver catches up. --mode=parser feeds them
+to a StationParser only. The [VueISS] options come from --config and
+--option NAME=VALUE, other stations of a registry are parsed but not
+archived.
+
+The latency of a packet is the time from storing (or parsing) the frame
+which completes it until the engine has it. --save-golden writes the
+packets of a known good version, --golden fails on any difference.
+"""
+
+import gzip
+import json
+import optparse
+import shutil
+import sys
+import tempfile
+import time
+
+import configobj
+
+import bench_vueiss
+import frames
+
+from bench_vueiss import vueiss, vueiss_store
+import weewx
+
+CAPTURE_VERSION = 1
+
+# options which would make a replay touch the files of the station
+LOCAL_OPTIONS = ('notify_socket', 'stats_file')
+
+class ReplayDone(Exception):
+    """The driver has read all frames of the capture"""
+
+def parse_time(value):
+    # a time given as unix epoch or as local date YYYY-MM-DD[THH:MM], in ms
+    if value.isdigit():
+        return 1000 * int(value)
+    for format in ('%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return 1000 * int(time.mktime(time.strptime(value, format)))
+        except ValueError:
+            pass
+    raise ValueError("Bad time %s" % value)
+
+def write_capture(path, rows, binary=False, receiver_column=None, start=0):
+    """Writes the rows of the sensor table (or of sensor_frame with binary)
+    to the capture file path, returns the number of frames"""
+    header = {'version': CAPTURE_VERSION, 'format': 'binary' if binary else 'text',
+              'receiver_column': receiver_column, 'start': start}
+    count = 0
+    last_time = start
+    with gzip.open(path, 'wb') as f:
+        f.write(json.dumps(header, sort_keys=True) + '\n')
+        for row in rows:
+            if binary:
+                values = [row[1], str(row[2]).encode('hex') if row[2] is not None else '',
+                          '%d' % row[3] if row[3] is not None else '']
+            else:
+                values = [row[1] or '']
+            if receiver_column:
+                values.append(row[-1] or '')
+            f.write('%d\t%s\n' % (row[0] - last_time, '\t'.join(values)))
+            last_time = row[0]
+            count += 1
+    return count
+
+def read_capture(path):
+    """Returns the header of the capture file and the list of its rows like
+    the driver reads them from the sensor table"""
+    with gzip.open(path, 'rb') as f:
+        header = json.loads(f.readline())
+        if header.get('version') != CAPTURE_VERSION:
+            raise ValueError("%s is no capture of version %d" % (path, CAPTURE_VERSION))
+        binary = header['format'] == 'binary'
+        receiver = bool(header.get('receiver_column'))
+        rows = []
+        data_time = header['start']
+        for line in f:
+            values = line.rstrip('\n').split('\t')
+            data_time += int(values[0])
+            if binary:
+                row = (data_time, values[1], values[2].decode('hex') if values[2] else None,
+                       int(values[3]) if values[3] else None)
+            else:
+                row = (data_time, values[1] or None)
+            if receiver:
+                row += (values[-1] or None,)
+            rows.append(row)
+    return header, rows
+
+def frame_kind(row, binary):
+    return row[1] if binary else (row[1] or '')[:1]
+
+def minute_chunks(rows, binary):
+    # the rows up to and including the next A or B frame, as the
+    # datalogger ingest stores them; the driver reads after the time of the
+    # last row, so the rows of the same ms stay together
+    chunk = []
+    complete = False
+    for row in rows:
+        if complete and row[0] != chunk[-1][0]:
+            yield chunk
+            chunk = []
+            complete = False
+        chunk.append(row)
+        if frame_kind(row, binary) in ('A', 'B'):
+            complete = True
+    if chunk:
+        yield chunk
+
+class Pacer(object):
+    """Sleeps until the wall clock reached the time of a frame at speedup
+    times real time, does not sleep with speedup 0"""
+
+    def __init__(self, speedup):
+        self.speedup = speedup
+        self.start = None
+
+    def wait(self, data_time):
+        if not self.speedup:
+            return
+        now = time.time()
+        if self.start is None:
+            self.start = (now, data_time)
+        delay = self.start[0] + (data_time - self.start[1]) / 1000.0 / self.speedup - now
+        if delay > 0:
+            time.sleep(delay)
+
+class Completions(object):
+    """The wall time the frame completing each packet was stored or parsed,
+    and the latencies of the packets"""
+
+    def __init__(self, binary):
+        self.binary = binary
+        self.times = {}
+        self.latencies = []
+
+    def add(self, rows, now):
+        for row in rows:
+            if frame_kind(row, self.binary) in ('A', 'B'):
+                seconds = row[0] / 1000
+                self.times.setdefault(seconds - seconds % 60, now)
+
+    def packet(self, packet, now):
+        completed = self.times.pop(packet['dateTime'], None)
+        if completed is not None:
+            self.latencies.append(now - completed)
+
+class ReplayNotifier(object):
+    """Takes the place of the SensorNotifier of the driver: instead of
+    waiting for the datalogger it stores the next minute of the capture,
+    raises ReplayDone once the capture is exhausted"""
+
+    def __init__(self, store, chunks, pacer, completions):
+        self.store = store
+        self.chunks = chunks
+        self.pacer = pacer
+        self.completions = completions
+
+    def wait(self, packet_time):
+        try:
+            chunk = self.chunks.next()
+        except StopIteration:
+            raise ReplayDone()
+        self.pacer.wait(chunk[-1][0])
+        insert_rows(self.store, chunk)
+        self.completions.add(chunk, time.time())
+        return True
+
+    def close(self):
+        pass
+
+def insert_rows(store, rows):
+    if store.binary:
+        rows = [row[:2] + (buffer(row[2]) if row[2] is not None else None,) + row[3:] for row in rows]
+    store.insert_rows(rows)
+
+class FakeEngine(object):
+    """The loop of the weewx engine with hardware record generation: takes
+    the LOOP packets and, like the BreakLoop of StdArchive, closes the
+    generator after the packet ending an archive interval, asks the driver
+    for the archive records and starts genLoopPackets again. Counts the
+    packets not newer than their predecessor and sums the rain."""
+
+    def __init__(self, driver, archive_interval=300):
+        self.driver = driver
+        self.archive_interval = archive_interval
+        self.end_period = None
+        self.last_record = None
+        self.last_packet = None
+        self.records = 0
+        self.restarts = 0
+        self.out_of_order = 0
+        self.rain = 0.0
+
+    def run(self, callback):
+        # calls callback with every packet until the replay is done
+        try:
+            while True:
+                packets = self.driver.genLoopPackets()
+                try:
+                    for packet in packets:
+                        self._check(packet)
+                        callback(packet)
+                        ts = packet['dateTime']
+                        if self.end_period is None:
+                            self.end_period = (ts // self.archive_interval + 1) * self.archive_interval
+                        elif ts >= self.end_period:
+                            break
+                finally:
+                    packets.close()
+                self.restarts += 1
+                for record in self.driver.genArchiveRecords(self.last_record):
+                    self.last_record = record['dateTime']
+                    self.records += 1
+                self.end_period = (ts // self.archive_interval + 1) * self.archive_interval
+        except ReplayDone:
+            pass
+        finally:
+            self.driver.closePort()
+
+    def _check(self, packet):
+        ts = packet['dateTime']
+        if self.last_packet is not None and ts <= self.last_packet:
+            self.out_of_order += 1
+        self.last_packet = ts
+        self.rain += packet.get('rain') or 0.0
+
+def station_options(config_path, options):
+    # the [VueISS] options of the replay
+    stn_dict = configobj.ConfigObj()
+    if config_path:
+        stn_dict.merge(configobj.ConfigObj(config_path, file_error=True).get(vueiss.DRIVER_NAME, {}))
+    for option in options or []:
+        (name, _, value) = option.partition('=')
+        stn_dict[name.strip()] = value.strip()
+    for name in LOCAL_OPTIONS:
+        stn_dict.pop(name, None)
+    for station in stn_dict.get('stations', {}).values():
+        station.pop('binding', None)
+    return stn_dict
+
+def replay_driver(header, rows, stn_dict, speedup, preload, archive_interval, callback):
+    """Runs the driver over the rows, returns the Completions and the
+    FakeEngine"""
+    binary = header['format'] == 'binary'
+    root = tempfile.mkdtemp(prefix='replay_vueiss')
+    try:
+        config_dict = bench_vueiss.sqlite_config(root)
+        config_dict[vueiss.DRIVER_NAME].merge(stn_dict)
+        config_dict[vueiss.DRIVER_NAME]['sensor_format'] = header['format']
+        if header.get('receiver_column'):
+            config_dict[vueiss.DRIVER_NAME]['receiver_column'] = header['receiver_column']
+        store = vueiss_store.SensorStore(config_dict, binary=binary, receiver_column=header.get('receiver_column'))
+        # creates the tables
+        store.get_checkpoint()
+        completions = Completions(binary)
+        chunks = iter(minute_chunks(rows, binary))
+        if preload:
+            chunks = iter([])
+            for idx in range(0, len(rows), 5000):
+                insert_rows(store, rows[idx:idx + 5000])
+            completions.add(rows, time.time())
+
+        driver = vueiss.VueISS(config_dict)
+        driver.notifier.close()
+        driver.notifier = ReplayNotifier(store, chunks, Pacer(speedup), completions)
+        engine = FakeEngine(driver, archive_interval)
+        def on_packet(packet):
+            completions.packet(packet, time.time())
+            callback(packet)
+        try:
+            engine.run(on_packet)
+        finally:
+            store.close()
+        return completions, engine
+    finally:
+        shutil.rmtree(root)
+
+def expected_rain(header, rows, stn_dict):
+    # the rain of all packets of the first station, parsed in one pass
+    binary = header['format'] == 'binary'
+    stations = vueiss.get_stations(stn_dict)
+    if stations:
+        registry = vueiss.StationRegistry(stations, binary, bool(header.get('receiver_column')))
+        packets = registry.parse_batch(rows)[0][1]
+    else:
+        windows = [int(stn_dict.get(option, default)) for (option, default) in vueiss.WINDOW_OPTIONS]
+        parser = vueiss.StationParser(*windows, altitude=float(stn_dict.get('altitude', vueiss.ALTITUDE)))
+        packets = parser.parse_batch_binary(rows) if binary else parser.parse_batch(rows)
+    return sum(packet.get('rain') or 0.0 for packet in packets)
+
+def replay_parser(header, rows, stn_dict, speedup, batch, callback):
+    """Feeds the rows of one receiver to a StationParser minute by minute,
+    returns the Completions"""
+    binary = header['format'] == 'binary'
+    windows = [int(stn_dict.get(option, default)) for (option, default) in vueiss.WINDOW_OPTIONS]
+    parser = vueiss.StationParser(*windows, altitude=float(stn_dict.get('altitude', vueiss.ALTITUDE)))
+    pacer = Pacer(speedup)
+    completions = Completions(binary)
+    for chunk in minute_chunks(rows, binary):
+        pacer.wait(chunk[-1][0])
+        completions.add(chunk, time.time())
+        if batch:
+            packets = parser.parse_batch_binary(chunk) if binary else parser.parse_batch(chunk)
+        else:
+            packets = []
+            for row in chunk:
+                if binary:
+                    values = parser.parse_binary(row[1], row[2], row[3], row[0]/1000, row[0])
+                else:
+                    values = parser.parse(row[1].split() if row[1] else None, row[0]/1000, row[0])
+                if values:
+                    packets.append(values)
+        for values in packets:
+            packet = {'usUnits': weewx.METRICWX}
+            packet.update(values)
+            completions.packet(packet, time.time())
+            callback(packet)
+    return completions
+
+def compare_packets(expected, packets, limit=5):
+    # returns the differences of the packets to the golden ones as text
+    differences = []
+    expected = dict((packet['dateTime'], packet) for packet in expected)
+    times = set()
+    for packet in packets:
+        ts = packet['dateTime']
+        times.add(ts)
+        golden = expected.get(ts)
+        if golden is None:
+            differences.append("%d: unexpected packet" % ts)
+        elif golden != packet:
+            keys = sorted(key for key in set(golden) | set(packet) if golden.get(key) != packet.get(key))
+            differences.append("%d: %s" % (ts, ', '.join('%s %r != %r' % (key, packet.get(key), golden.get(key))
+                                                         for key in keys[:limit])))
+    for ts in sorted(set(expected) - times):
+        differences.append("%d: missing packet" % ts)
+    return differences
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def report(rows, packets, seconds, completions, records):
+    span = (rows[-1][0] - rows[0][0]) / 1000.0 if rows else 0.0
+    latencies = sorted(completions.latencies)
+    print "%d frames over %.1f hours replayed in %.2f s, %.0f times real time" % \
+        (len(rows), span / 3600.0, seconds, span / seconds if seconds else 0.0)
+    print "%.0f frames/s, %.1f packets/s, %d packets, %d archive records" % \
+        (len(rows) / seconds if seconds else 0.0, len(packets) / seconds if seconds else 0.0,
+         len(packets), records)
+    if latencies:
+        print "latency ms: mean %.2f p50 %.2f p95 %.2f p99 %.2f max %.2f" % \
+            (1000.0 * sum(latencies) / len(latencies), 1000.0 * percentile(latencies, 0.5),
+             1000.0 * percentile(latencies, 0.95), 1000.0 * percentile(latencies, 0.99),
+             1000.0 * latencies[-1])
+
+def record(options, args):
+    if len(args) != 1:
+        print "record needs the capture file"
+        return 2
+    if options.synthetic:
+        rows = frames.rows(options.synthetic, options.seed)
+        count = write_capture(args[0], rows, start=rows[0][0] - 1 if rows else 0)
+    else:
+        import weecfg
+        (_, config_dict) = weecfg.read_config(options.config, [])
+        stn_dict = config_dict.get(vueiss.DRIVER_NAME, {})
+        binary = stn_dict.get('sensor_format', 'text') == 'binary'
+        receiver_column = stn_dict.get('receiver_column')
+        store = vueiss_store.SensorStore(config_dict, options.binding, binary, receiver_column=receiver_column)
+        start = parse_time(options.start) if options.start else 0
+        stop = parse_time(options.stop) if options.stop else int(time.time() * 1000)
+        try:
+            count = write_capture(args[0], store.stream_frames(start, stop), binary, receiver_column, start)
+        finally:
+            store.close()
+    print "Wrote %d frames to %s" % (count, args[0])
+    return 0
+
+def replay(options, args):
+    if len(args) != 1:
+        print "replay needs the capture file"
+        return 2
+    (header, rows) = read_capture(args[0])
+    stn_dict = station_options(options.config, options.option)
+    packets = []
+    def keep(packet):
+        # the packet as it reads from the golden file
+        packets.append(json.loads(json.dumps(packet)))
+    start = time.time()
+    if options.mode == 'parser':
+        if header.get('receiver_column'):
+            print "The frames of several receivers need --mode=driver"
+            return 2
+        completions = replay_parser(header, rows, stn_dict, options.speedup, options.batch, keep)
+        records = 0
+    else:
+        completions, engine = replay_driver(header, rows, stn_dict, options.speedup, options.preload,
+                                            options.archive_interval, keep)
+        records = engine.records
+    report(rows, packets, time.time() - start, completions, records)
+
+    if options.mode == 'driver':
+        # the packets of a restarted genLoopPackets continue where the
+        # engine closed it, without repeating or dropping any
+        rain = expected_rain(header, rows, stn_dict)
+        print "%d restarts of genLoopPackets, rain %.4f of %.4f" % (engine.restarts, engine.rain, rain)
+        if engine.out_of_order:
+            print "%d packets not newer than the one before" % engine.out_of_order
+            return 1
+        if abs(engine.rain - rain) > 1e-6:
+            print "The rain of the packets differs from the frames"
+            return 1
+
+    if options.save_golden:
+        with open(options.save_golden, 'w') as f:
+            json.dump(packets, f, sort_keys=True)
+        print "Saved %d packets to %s" % (len(packets), options.save_golden)
+    if options.golden:
+        with open(options.golden) as f:
+            differences = compare_packets(json.load(f), packets)
+        if differences:
+            for difference in differences[:20]:
+                print difference
+            print "%d packets differ from %s" % (len(differences), options.golden)
+            return 1
+        print "All packets match %s" % options.golden
+    return 0
+
+def main():
+    parser = optparse.OptionParser(usage="replay_vueiss.py record [--config=FILE] [--binding=BINDING] "
+                                         "[--from=TIME] [--to=TIME] [--synthetic=N] CAPTURE\n"
+                                         "       replay_vueiss.py replay [--mode=driver|parser] [--speedup=N] "
+                                         "[--preload] [--batch] [--config=FILE] [--option=NAME=VALUE]... "
+                                         "[--golden=FILE | --save-golden=FILE] CAPTURE")
+    parser.add_option("--config", dest="config",
+                      help="The weewx configuration with the database and the [VueISS] options.")
+    parser.add_option("--binding", dest="binding", default='wx_binding',
+                      help="The binding of the sensor tables. Default is wx_binding.")
+    parser.add_option("--from", dest="start",
+                      help="Record the frames after TIME, unix epoch or YYYY-MM-DD[THH:MM].")
+    parser.add_option("--to", dest="stop",
+                      help="Record the frames up to TIME. Default is now.")
+    parser.add_option("--synthetic", dest="synthetic", type=int,
+                      help="Record N synthetic frames instead of the database.")
+    parser.add_option("--seed", dest="seed", type=int, default=1,
+                      help="Seed of the synthetic frames. Default is 1.")
+    parser.add_option("--mode", dest="mode", type='choice', choices=['driver', 'parser'], default='driver',
+                      help="Replay through the driver or through a StationParser. Default is driver.")
+    parser.add_option("--speedup", dest="speedup", type=float, default=0.0,
+                      help="Replay at N times real time, 0 as fast as possible. Default is 0.")
+    parser.add_option("--preload", dest="preload", action="store_true",
+                      help="Store all frames before the driver starts.")
+    parser.add_option("--batch", dest="batch", action="store_true",
+                      help="Parse the frames of a minute in a batch (--mode=parser).")
+    parser.add_option("--archive-interval", dest="archive_interval", type=int, default=300,
+                      help="Archive interval of the fake engine in seconds. Default is 300.")
+    parser.add_option("--option", dest="option", action="append",
+                      help="Set the [VueISS] option NAME to VALUE.")
+    parser.add_option("--golden", dest="golden",
+                      help="Compare the packets with the golden file.")
+    parser.add_option("--save-golden", dest="save_golden",
+                      help="Save the packets as golden file.")
+    (options, args) = parser.parse_args()
+
+    if args and args[0] == 'record':
+        return record(options, args[1:])
+    if args and args[0] == 'replay':
+        return replay(options, args[1:])
+    parser.print_usage()
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
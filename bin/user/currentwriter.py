@@ -0,0 +1,261 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Writes the current conditions files of a skin with every LOOP packet
+
+The templates, e.g. wxdata.xml.tmpl and wxdata_inc.php.tmpl of the skin
+Standard, are compiled once and rendered in a thread of their own with the
+search list of the CheetahGenerator. $current comes from the newest LOOP
+packet, the aggregates of $day from a DayCache updated with every packet,
+the other tags from the database as in a report run. A file is replaced
+atomically and only if its content changed.
+
+[CurrentWriter]
+    # the report whose skin has the templates
+    report = StandardReport
+    templates = wxdata.xml.tmpl, wxdata_inc.php.tmpl
+    # the least seconds between two renderings
+    interval = 60
+    # counters of the day cache, logged every stats_interval seconds and
+    # written in the Prometheus text format to stats_file
+    stats_interval = 300
+    stats_file = /var/lib/prometheus/node-exporter/currentwriter.prom
+
+[Engine]
+    [[Services]]
+        report_services = ..., user.currentwriter.CurrentWriter
+
+Remove the templates from the [CheetahGenerator] of the skin, so the report
+run does not render them again.
+"""
+
+from __future__ import with_statement
+import os
+import syslog
+import tempfile
+import threading
+import time
+
+import Cheetah.Template
+import configobj
+
+import weewx
+import weewx.cheetahgenerator
+import weewx.engine
+import weewx.tags
+import weewx.units
+from weeutil.weeutil import TimeSpan, option_as_list
+
+import user.daycache
+import user.metrics
+
+def logmsg(level, msg):
+    syslog.syslog(level, 'currentwriter: %s' % msg)
+
+def logdbg(msg):
+    logmsg(syslog.LOG_DEBUG, msg)
+
+def loginf(msg):
+    logmsg(syslog.LOG_INFO, msg)
+
+def logerr(msg):
+    logmsg(syslog.LOG_ERR, msg)
+
+class CurrentWriter(weewx.engine.StdService):
+
+    def __init__(self, engine, config_dict):
+        super(CurrentWriter, self).__init__(engine, config_dict)
+        writer_dict = config_dict.get('CurrentWriter', {})
+        self.thread = CurrentThread(config_dict,
+                                    engine.stn_info,
+                                    writer_dict.get('report', 'StandardReport'),
+                                    option_as_list(writer_dict.get('templates',
+                                                                   ['wxdata.xml.tmpl', 'wxdata_inc.php.tmpl'])),
+                                    float(writer_dict.get('interval', 60)),
+                                    user.metrics.Metrics('currentwriter',
+                                                         interval=float(writer_dict.get('stats_interval', 300)),
+                                                         path=writer_dict.get('stats_file')))
+        self.thread.start()
+        self.bind(weewx.NEW_LOOP_PACKET, self.new_loop_packet)
+
+    def new_loop_packet(self, event):
+        self.thread.update(event.packet)
+
+    def shutDown(self):
+        self.thread.stop()
+
+class CurrentThread(threading.Thread):
+    """Renders the templates with the newest packet.
+
+    The database connections of the generator belong to this thread, so it
+    sets the generator up itself. Every packet is added to the day cache,
+    the templates are rendered with the newest one.
+    """
+
+    def __init__(self, config_dict, stn_info, report, templates, interval, metrics):
+        threading.Thread.__init__(self, name='CurrentWriter')
+        self.setDaemon(True)
+        self.config_dict = config_dict
+        self.stn_info = stn_info
+        self.report = report
+        self.templates = templates
+        self.interval = interval
+        self.metrics = metrics
+        self.packets = []
+        self.day_cache = user.daycache.DayCache()
+        self.running = True
+        self.condition = threading.Condition()
+        # the last content of each output file
+        self.contents = {}
+
+    def update(self, packet):
+        with self.condition:
+            self.packets.append(packet)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.join(10)
+
+    def run(self):
+        try:
+            self.setup()
+        except Exception, e:
+            logerr("Cannot set up report %s: %s" % (self.report, e))
+            return
+        try:
+            last_time = 0
+            while True:
+                with self.condition:
+                    while self.running and not self.packets:
+                        self.condition.wait()
+                    if not self.running:
+                        return
+                    (packets, self.packets) = (self.packets, [])
+                manager = self.generator.db_binder.get_manager(self.binding)
+                for packet in packets:
+                    self.day_cache.add_packet(packet, manager)
+                if packet['dateTime'] - last_time < self.interval:
+                    continue
+                last_time = packet['dateTime']
+                try:
+                    self.render(packet)
+                except Exception, e:
+                    logerr("Cannot render the current conditions: %s" % e)
+                self.metrics.set('day_cache_hits', self.day_cache.hits)
+                self.metrics.set('day_cache_misses', self.day_cache.misses)
+                self.metrics.report(time.time(), loginf)
+        finally:
+            self.generator.teardown()
+
+    def setup(self):
+        # the skin of the report, the generator with its search list
+        # extensions and the compiled templates
+        std_report = self.config_dict['StdReport']
+        skin_root = os.path.join(self.config_dict['WEEWX_ROOT'], std_report['SKIN_ROOT'],
+                                 std_report[self.report]['skin'])
+        skin_dict = configobj.ConfigObj(os.path.join(skin_root, 'skin.conf'), file_error=True)
+        skin_dict['REPORT_NAME'] = self.report
+        for scalar in std_report.scalars:
+            skin_dict[scalar] = std_report[scalar]
+        skin_dict.merge(std_report[self.report])
+
+        self.generator = weewx.cheetahgenerator.CheetahGenerator(self.config_dict, skin_dict,
+                                                                 None, True, self.stn_info)
+        self.generator.setup()
+        gen_dict = skin_dict.get('CheetahGenerator', {})
+        self.generator.initExtensions(gen_dict)
+        self.encoding = gen_dict.get('encoding', 'html_entities')
+        self.binding = gen_dict.get('data_binding', 'wx_binding')
+
+        html_root = os.path.join(self.config_dict['WEEWX_ROOT'], skin_dict['HTML_ROOT'])
+        self.compiled = []
+        for template in self.templates:
+            path = os.path.join(skin_root, template)
+            output = os.path.join(html_root, template[:-5] if template.endswith('.tmpl') else template)
+            self.compiled.append((output, Cheetah.Template.Template.compile(file=path)))
+        loginf("Writing %s" % ', '.join(output for (output, _) in self.compiled))
+
+    def render(self, packet):
+        start = time.time()
+        manager = self.generator.db_binder.get_manager(self.binding)
+        timespan = TimeSpan(manager.firstGoodStamp() or packet['dateTime'], packet['dateTime'])
+        current = PacketCurrent(packet, self.generator.formatter, self.generator.converter)
+        search_list = self.generator._getSearchList(self.encoding, timespan, self.binding)
+        # the $day of the database, for the aggregates the cache does not keep,
+        # from the search list or, if no extension provides it, of its own
+        binders = [obj for obj in search_list if not isinstance(obj, dict) and hasattr(obj, 'day')]
+        if binders:
+            binder = binders[0]
+        else:
+            binder = weewx.tags.TimeBinder(self.generator.db_binder.bind_default(self.binding),
+                                           packet['dateTime'], formatter=self.generator.formatter,
+                                           converter=self.generator.converter)
+        day = user.daycache.DayTag(self.day_cache, binder.day,
+                                   self.generator.formatter, self.generator.converter)
+        search_list = [{'current': current, 'day': day}] + search_list
+        written = 0
+        for (output, template_class) in self.compiled:
+            template = template_class(searchList=search_list, filter=self.encoding,
+                                      filtersLib=weewx.cheetahgenerator)
+            if self.write(output, encode(template.respond(), self.encoding)):
+                written += 1
+        logdbg("Rendered %d files, wrote %d in %.2f seconds" %
+               (len(self.compiled), written, time.time() - start))
+
+    def write(self, path, data):
+        # replaces the file path with data unless it has the content already,
+        # returns True if it did
+        if path not in self.contents:
+            try:
+                with open(path, 'rb') as f:
+                    self.contents[path] = f.read()
+            except IOError:
+                self.contents[path] = None
+        if self.contents[path] == data:
+            return False
+        directory = os.path.dirname(path) or '.'
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        (fd, tmp_path) = tempfile.mkstemp(prefix='.%s' % os.path.basename(path), dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, path)
+        except:
+            os.unlink(tmp_path)
+            raise
+        self.contents[path] = data
+        return True
+
+# the bytes of the rendered text, like the CheetahGenerator writes them
+def encode(text, encoding):
+    if encoding == 'html_entities':
+        return text.encode('ascii', 'xmlcharrefreplace')
+    if encoding == 'strict_ascii':
+        return text.encode('ascii', 'ignore')
+    return text.encode('utf8')
+
+class PacketCurrent(object):
+    """$current of a LOOP packet instead of the archive record"""
+
+    def __init__(self, packet, formatter, converter):
+        self.packet = packet
+        self.formatter = formatter
+        self.converter = converter
+
+    def __getattr__(self, obs_type):
+        if obs_type.startswith('__'):
+            raise AttributeError(obs_type)
+        return weewx.units.ValueHelper(weewx.units.as_value_tuple(self.packet, obs_type), 'current',
+                                       self.formatter, self.converter)
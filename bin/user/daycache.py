@@ -0,0 +1,211 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Aggregates of the current day, kept in memory
+
+The cache is primed from the daily summaries of the archive when a day
+starts or at startup, after that every packet is added. It serves the
+aggregates of $day.<obs>.<aggregate> without a query; the aggregates it
+does not keep are taken from the $day of the database.
+"""
+
+import math
+
+import weewx.units
+from weeutil.weeutil import startOfArchiveDay
+
+# the aggregates served from the cache
+AGGREGATES = ('min', 'mintime', 'max', 'maxtime', 'sum', 'count', 'avg', 'vecavg', 'vecdir')
+
+class DayStats(object):
+    """The statistics of one observation type like a daily summary row"""
+
+    __slots__ = ('min', 'mintime', 'max', 'maxtime', 'sum', 'count', 'wsum', 'sumtime',
+                 'xsum', 'ysum', 'dirsumtime')
+
+    def __init__(self):
+        self.min = None
+        self.mintime = None
+        self.max = None
+        self.maxtime = None
+        self.sum = 0.0
+        self.count = 0
+        self.wsum = 0.0
+        self.sumtime = 0
+        self.xsum = 0.0
+        self.ysum = 0.0
+        self.dirsumtime = 0
+
+    def set_row(self, row):
+        # the columns min, mintime, max, maxtime, sum, count, wsum, sumtime
+        # and for wind xsum, ysum, dirsumtime of a summary row
+        (self.min, self.mintime, self.max, self.maxtime) = row[:4]
+        (self.sum, self.count, self.wsum, self.sumtime) = [value or 0 for value in row[4:8]]
+        if len(row) > 8:
+            (self.xsum, self.ysum, self.dirsumtime) = [value or 0 for value in row[8:11]]
+
+    def add_hilo(self, value, ts):
+        if value is None:
+            return
+        if self.min is None or value < self.min:
+            self.min = value
+            self.mintime = ts
+        if self.max is None or value > self.max:
+            self.max = value
+            self.maxtime = ts
+
+    def add_sum(self, value, weight):
+        if value is None:
+            return
+        self.sum += value
+        self.count += 1
+        self.wsum += value * weight
+        self.sumtime += weight
+
+    def add_vector(self, speed, direction, weight):
+        if speed is None or direction is None:
+            return
+        self.xsum += speed * math.cos(math.radians(90.0 - direction)) * weight
+        self.ysum += speed * math.sin(math.radians(90.0 - direction)) * weight
+        self.dirsumtime += weight
+
+    def get(self, aggregate):
+        if aggregate in ('min', 'mintime', 'max', 'maxtime', 'sum', 'count'):
+            return getattr(self, aggregate)
+        if aggregate == 'avg':
+            return self.wsum / self.sumtime if self.sumtime else None
+        if aggregate == 'vecavg':
+            return math.sqrt(self.xsum ** 2 + self.ysum ** 2) / self.dirsumtime if self.dirsumtime else None
+        if self.dirsumtime == 0 or (self.xsum == 0 and self.ysum == 0):
+            return None
+        direction = 90.0 - math.degrees(math.atan2(self.ysum, self.xsum))
+        return direction + 360.0 if direction < 0 else direction
+
+class DayCache(object):
+    """The DayStats of the day of the last packet by observation type.
+
+    weight is the archive interval in seconds, the weight of a packet in the
+    daily summaries. hits and misses count the aggregates served from the
+    cache and those left to the database.
+    """
+
+    def __init__(self, weight=60):
+        self.weight = weight
+        self.day = None
+        self.stats = {}
+        # the time of the newest record or packet in the stats
+        self.last_time = None
+        self.unit_system = None
+        self.hits = 0
+        self.misses = 0
+
+    def add_packet(self, packet, manager):
+        # adds the packet, the first one of a day primes the cache from the
+        # daily summaries of manager. As in the daily summaries a packet at
+        # midnight belongs to the day before
+        ts = packet['dateTime']
+        day = startOfArchiveDay(ts)
+        if day != self.day:
+            self.prime(manager, day)
+        if self.last_time is not None and ts <= self.last_time:
+            return
+        self.last_time = ts
+        if packet.get('usUnits') != self.unit_system:
+            packet = weewx.units.to_std_system(packet, self.unit_system)
+
+        for (obs_type, value) in packet.iteritems():
+            if obs_type in ('dateTime', 'usUnits', 'interval') or not isinstance(value, (int, long, float)):
+                continue
+            stats = self._stats(obs_type)
+            stats.add_hilo(value, ts)
+            stats.add_sum(value, self.weight)
+        if 'windSpeed' in packet:
+            stats = self._stats('wind')
+            stats.add_hilo(packet.get('windGust'), ts)
+            stats.add_hilo(packet['windSpeed'], ts)
+            stats.add_sum(packet['windSpeed'], self.weight)
+            stats.add_vector(packet['windSpeed'], packet.get('windDir'), self.weight)
+
+    def prime(self, manager, day):
+        # reads the daily summaries of the day starting at day
+        self.day = day
+        self.stats = {}
+        self.last_time = None
+        self.unit_system = manager.std_unit_system
+        table = manager.table_name
+        for obs_type in getattr(manager, 'daykeys', []):
+            columns = 'min,mintime,max,maxtime,sum,count,wsum,sumtime'
+            if obs_type == 'wind':
+                columns += ',xsum,ysum,dirsumtime'
+            row = manager.getSql("SELECT %s FROM %s_day_%s WHERE dateTime=?" % (columns, table, obs_type), (day,))
+            if row is not None:
+                self._stats(obs_type).set_row(row)
+        row = manager.getSql("SELECT value FROM %s_day__metadata WHERE name='lastUpdate'" % table)
+        if row is not None and row[0] is not None and int(row[0]) >= day:
+            self.last_time = int(row[0])
+
+    def _stats(self, obs_type):
+        stats = self.stats.get(obs_type)
+        if stats is None:
+            stats = self.stats[obs_type] = DayStats()
+        return stats
+
+    def get(self, obs_type, aggregate):
+        # the value of the aggregate, raises KeyError if it is not kept
+        stats = self.stats.get(obs_type)
+        if stats is None or aggregate not in AGGREGATES or \
+           (aggregate in ('vecavg', 'vecdir') and obs_type != 'wind'):
+            raise KeyError(aggregate)
+        return stats.get(aggregate)
+
+class DayTag(object):
+    """$day of the cache, the other aggregates come from day_binder, the $day
+    of the database, which is only called for them. Without a day_binder
+    they raise a ValueError.
+    """
+
+    def __init__(self, cache, day_binder, formatter, converter):
+        self.cache = cache
+        self.day_binder = day_binder
+        self.formatter = formatter
+        self.converter = converter
+
+    def __getattr__(self, obs_type):
+        if obs_type.startswith('__'):
+            raise AttributeError(obs_type)
+        return ObsTag(self, obs_type)
+
+class ObsTag(object):
+
+    def __init__(self, day, obs_type):
+        self.day = day
+        self.obs_type = obs_type
+
+    def __getattr__(self, aggregate):
+        if aggregate.startswith('__'):
+            raise AttributeError(aggregate)
+        day = self.day
+        try:
+            value = day.cache.get(self.obs_type, aggregate)
+        except KeyError:
+            day.cache.misses += 1
+            if day.day_binder is None:
+                raise ValueError("$day.%s.%s is not kept by the day cache and there is no $day "
+                                 "of the database" % (self.obs_type, aggregate))
+            return getattr(getattr(day.day_binder(), self.obs_type), aggregate)
+        day.cache.hits += 1
+        if aggregate in ('mintime', 'maxtime'):
+            (unit, group) = ('unix_epoch', 'group_time')
+        elif aggregate == 'count':
+            (unit, group) = ('count', 'group_count')
+        else:
+            (unit, group) = weewx.units.getStandardUnitType(day.cache.unit_system, self.obs_type, aggregate)
+        return weewx.units.ValueHelper(weewx.units.ValueTuple(value, unit, group), 'day',
+                                       day.formatter, day.converter)
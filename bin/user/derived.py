@@ -0,0 +1,129 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Derived quantities of the weather data
+
+The saturation vapour pressure and the dewpoint follow the Magnus formula
+with the constants of the DWD, the wind chill the JAG/TI formula of 2001
+and the heat index the regression of Rothfusz used by the NWS, in degree C.
+
+Temperatures are in degree C, humidities in percent and wind speeds in m/s.
+Each quantity has a scalar function, which returns None for missing values,
+and an _array function for numpy arrays, which returns NaN for them. Both
+use the same formulas, their results agree up to the rounding of floats.
+"""
+
+import numpy
+from numpy import exp, log, power
+
+# Magnus constants over water (t >= 0) and over ice (t < 0)
+C1   = 6.10780
+C2_P = 17.08085
+C2_N = 17.84362
+C3_P = 234.175
+C3_N = 245.425
+
+# 10^5 * mw / R* of the absolute humidity, in g K / (m^3 hPa)
+AH = 216.687
+
+def svp(temperature):
+    # the saturation vapour pressure in hPa
+    if temperature is None:
+        return None
+    C2 = C2_P if temperature >= 0 else C2_N
+    C3 = C3_P if temperature >= 0 else C3_N
+    return float(C1 * exp(C2 * temperature / (C3 + temperature)))
+
+def svp_array(temperature):
+    temperature = numpy.asarray(temperature, dtype=numpy.float64)
+    with numpy.errstate(invalid='ignore'):
+        C2 = numpy.where(temperature >= 0, C2_P, C2_N)
+        C3 = numpy.where(temperature >= 0, C3_P, C3_N)
+    return C1 * exp(C2 * temperature / (C3 + temperature))
+
+def dewpoint(temperature, humidity):
+    # the dewpoint, at most the temperature
+    if temperature is None or humidity is None or humidity <= 0:
+        return None
+    C2 = C2_P if temperature >= 0 else C2_N
+    C3 = C3_P if temperature >= 0 else C3_N
+
+    tmp = log(0.01 * humidity * svp(temperature) / C1)
+    dt = C3 * tmp / (C2 - tmp)
+
+    if temperature >= 0 and dt < 0.0:
+        dt = C3_N * tmp / (C2_N - tmp)
+    return float(min(dt, temperature))
+
+def dewpoint_array(temperature, humidity):
+    temperature = numpy.asarray(temperature, dtype=numpy.float64)
+    humidity = numpy.asarray(humidity, dtype=numpy.float64)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        C2 = numpy.where(temperature >= 0, C2_P, C2_N)
+        C3 = numpy.where(temperature >= 0, C3_P, C3_N)
+        tmp = log(0.01 * numpy.where(humidity > 0, humidity, numpy.nan) * svp_array(temperature) / C1)
+        dt = C3 * tmp / (C2 - tmp)
+        dt = numpy.where((temperature >= 0) & (dt < 0.0), C3_N * tmp / (C2_N - tmp), dt)
+        return numpy.where(dt > temperature, temperature, dt)
+
+def absolute_humidity(temperature, humidity):
+    # the water vapour density in g/m^3
+    if temperature is None or humidity is None:
+        return None
+    return float(AH * (0.01 * humidity * svp(temperature)) / (temperature + 273.15))
+
+def absolute_humidity_array(temperature, humidity):
+    temperature = numpy.asarray(temperature, dtype=numpy.float64)
+    humidity = numpy.asarray(humidity, dtype=numpy.float64)
+    return AH * (0.01 * humidity * svp_array(temperature)) / (temperature + 273.15)
+
+def wind_chill(temperature, wind_speed):
+    # the wind chill temperature of JAG/TI for temperatures up to 10 C and
+    # winds from 5 km/h, else the temperature
+    if temperature is None or wind_speed is None:
+        return None
+    speed = 3.6 * wind_speed
+    if temperature > 10.0 or speed < 5.0:
+        return float(temperature)
+    p = power(speed, 0.16)
+    return float(13.12 + 0.6215 * temperature - 11.37 * p + 0.3965 * temperature * p)
+
+def wind_chill_array(temperature, wind_speed):
+    temperature = numpy.asarray(temperature, dtype=numpy.float64)
+    speed = 3.6 * numpy.asarray(wind_speed, dtype=numpy.float64)
+    with numpy.errstate(invalid='ignore'):
+        p = power(speed, 0.16)
+        chill = 13.12 + 0.6215 * temperature - 11.37 * p + 0.3965 * temperature * p
+        chill = numpy.where((temperature > 10.0) | (speed < 5.0), temperature, chill)
+    return numpy.where(numpy.isnan(speed), numpy.nan, chill)
+
+def heat_index(temperature, humidity):
+    # the heat index of Rothfusz for temperatures from 26.7 C and
+    # humidities from 40 percent, else the temperature
+    if temperature is None or humidity is None:
+        return None
+    if temperature < 26.7 or humidity < 40.0:
+        return float(temperature)
+    return float(_heat_index(temperature, humidity))
+
+def heat_index_array(temperature, humidity):
+    temperature = numpy.asarray(temperature, dtype=numpy.float64)
+    humidity = numpy.asarray(humidity, dtype=numpy.float64)
+    with numpy.errstate(invalid='ignore'):
+        index = numpy.where((temperature < 26.7) | (humidity < 40.0), temperature,
+                            _heat_index(temperature, humidity))
+    return numpy.where(numpy.isnan(humidity), numpy.nan, index)
+
+def _heat_index(t, rh):
+    # the regression of Rothfusz with its coefficients for degree C
+    return (-8.784695 + 1.61139411 * t + 2.338549 * rh - 0.14611605 * t * rh
+            - 0.012308094 * t * t - 0.016424828 * rh * rh + 0.002211732 * t * t * rh
+            + 0.00072546 * t * rh * rh - 0.000003582 * t * t * rh * rh)
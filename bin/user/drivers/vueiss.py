@@ -11,14 +11,20 @@
 """Driver for Vantage Vue @ DIY datalogger"""
 
 from __future__ import with_statement
+import collections
+import json
+import multiprocessing
+import os
+import select
+import socket
+import struct
 import time
 import syslog
-import MySQLdb
-import Queue
 
-from math import sin, cos, pi, acos, pow, exp, log
+from array import array as typed_array
+from math import sin, cos, pi, acos, asin, pow, exp, log, sqrt
+import numpy
 from numpy import array
-from numpy.linalg import norm
 
 import weecfg
 import weedb
@@ -26,6 +32,11 @@ import weeutil.weeutil
 import weewx.drivers
 import weewx.manager
 
+import user.derived
+import user.metrics
+import user.rollup
+import user.vueiss_store
+
 def logmsg(msg):
     syslog.syslog(syslog.LOG_INFO, 'vueiss: %s' % msg)
 
@@ -64,48 +75,187 @@ def crc(data):
         pass
     return crc
 
-# Calculates the saturation vapour pressure (see dwd)
-def calc_svp(temperature):
-    if not temperature:
-        return None
-    
-    C1   = 6.10780
-    C2_P = 17.08085
-    C2_N = 17.84362
-    C3_P = 234.175
-    C3_N = 245.425
-
-    C2 = C2_P if temperature >= 0 else C2_N
-    C3 = C3_P if temperature >= 0 else C3_N
+# Calculates the crc of the radio packet bytes
+def crc_frame(frame):
+    crc = PRESET
+    for value in frame:
+        crc = ((crc << 8) ^ _tab[(crc >> 8) ^ value]) & 0xffff
+    return crc
 
-    return C1 * exp(C2 * temperature / (C3 + temperature))
+# the radio packet bytes of the binary sensor_frame table
+_FRAME_BYTES = struct.Struct('8B')
 
-# Calculates the dewpoint (see dwd)
-def calc_dewpoint(temperature, humidity):
-    if not temperature or not humidity:
+# Returns the 8 radio packet bytes of a split I frame, None if it is malformed
+def decode_hex(data):
+    if len(data) < 10:
         return None
+    try:
+        frame = [int(x, 16) for x in data[2:10]]
+    except ValueError:
+        return None
+    for value in frame:
+        if value < 0 or value > 0xff:
+            return None
+    return frame
 
-    C1   = 6.10780
-    C2_P = 17.08085
-    C2_N = 17.84362
-    C3_P = 234.175
-    C3_N = 245.425
-
-    C2 = C2_P if temperature >= 0 else C2_N
-    C3 = C3_P if temperature >= 0 else C3_N
-
-    svp = calc_svp(temperature)
-
-    tmp = log(0.01 * humidity * svp / C1)
-    dt = C3 * tmp / (C2 - tmp)
+# Calculates the saturation vapour pressure (see dwd)
+def calc_svp(temperature):
+    return user.derived.svp(temperature)
 
-    if temperature >= 0 and dt < 0.0:
-        dt = C3_N * tmp / (C2_N - tmp)
+# Calculates the dewpoint (see dwd)
+def calc_dewpoint(temperature, humidity):
+    dt = user.derived.dewpoint(temperature, humidity)
+    return round(dt, 1) if dt is not None else None
+
+# Calculates the dewpoints of the raw (temperature, humidity) pairs with
+# one call, rounded like calc_dewpoint
+def calc_dewpoints(values):
+    if not values:
+        return []
+    (temperature, humidity) = zip(*[(numpy.nan if t is None else t, numpy.nan if h is None else h)
+                                    for (t, h) in values])
+    return [round(dt, 1) if dt == dt else None
+            for dt in user.derived.dewpoint_array(temperature, humidity).tolist()]
+
+# floating N-min sums kept as a ring of per-minute partial sums
+class MinuteRing(object):
+
+    __slots__ = ('width', 'size', 'pos', 'sums', 'counts', 'total', 'count')
+
+    def __init__(self, N, width=1):
+        # the window covers the current minute and the N-1 minutes before it
+        self.width = width
+        self.size = max(N, 1)
+        self.pos = 0
+        # per-minute partial sums and counts, slot pos is the current minute
+        self.sums = typed_array('d', [0.0] * (self.size * width))
+        self.counts = typed_array('l', [0] * self.size)
+        # running total of the closed minutes in the window
+        self.total = typed_array('d', [0.0] * width)
+        self.count = 0
 
-    if dt > temperature:
-        dt = temperature
+    def reset(self):
+        width = self.width
+
+        # close the current minute
+        base = self.pos * width
+        for i in range(width):
+            self.total[i] += self.sums[base + i]
+        self.count += self.counts[self.pos]
+
+        # expire the oldest minute, its slot becomes the current one
+        self.pos = (self.pos + 1) % self.size
+        base = self.pos * width
+        for i in range(width):
+            self.total[i] -= self.sums[base + i]
+            self.sums[base + i] = 0.0
+        self.count -= self.counts[self.pos]
+        self.counts[self.pos] = 0
+
+        # resync the running total once per cycle, so that rounding errors
+        # of the subtractions cannot pile up
+        if self.pos == 0:
+            for i in range(width):
+                self.total[i] = sum(self.sums[i::width])
+
+    def add(self, *values):
+        base = self.pos * self.width
+        for i, value in enumerate(values):
+            self.sums[base + i] += value
+        self.counts[self.pos] += 1
+
+    def get_count(self):
+        return self.count + self.counts[self.pos]
+
+    def get_sum(self, i=0):
+        return self.total[i] + self.sums[self.pos * self.width + i]
+
+    def get_average(self):
+        count = self.get_count()
+        return self.get_sum() / count if count > 0 else None
+
+    def get_recent(self, minutes, i=0):
+        # the count and the sum of the current minute and the minutes-1
+        # minutes before it
+        count = 0
+        total = 0.0
+        for k in range(minutes):
+            pos = (self.pos - k) % self.size
+            count += self.counts[pos]
+            total += self.sums[pos * self.width + i]
+        return count, total
+
+    def get_state(self):
+        return {'pos': self.pos, 'sums': self.sums.tolist(), 'counts': self.counts.tolist(),
+                'total': self.total.tolist(), 'count': self.count}
+
+    def set_state(self, state):
+        if len(state['sums']) != self.size * self.width:
+            raise ValueError("window length changed")
+        self.pos = state['pos']
+        self.sums = typed_array('d', state['sums'])
+        self.counts = typed_array('l', state['counts'])
+        self.total = typed_array('d', state['total'])
+        self.count = state['count']
+
+    def extend(self, *columns):
+        # adds columns of values in order, with the same rounding as
+        # repeated add() calls
+        base = self.pos * self.width
+        for i, column in enumerate(columns):
+            self.sums[base + i] = sequential_sum(self.sums[base + i], column)
+        self.counts[self.pos] += len(columns[0])
+
+# sums the values strictly from left to right, starting at start
+def sequential_sum(start, values):
+    if len(values) == 0:
+        return start
+    return float(numpy.cumsum(numpy.concatenate(([start], values)))[-1])
+
+# returns [speed, direction] from the summed speed and wind vector
+def wind_average(speed_sum, vx, vy, count):
+    if count == 0:
+        return None
 
-    return round(dt, 1)
+    direction = None
+    length = sqrt(vx * vx + vy * vy)
+    speed = speed_sum / count
+    if speed > 0 and length > 0.01:
+        direction = wind_direction(vx, vy, length)
+
+    return [speed, direction]
+
+# returns the direction in degrees of the wind vector of length > 0
+def wind_direction(vx, vy, length):
+    rad = acos(vx / length)
+    if vy < 0:
+        rad = 2*pi - rad
+
+    direction = 90.0 - 180.0 * rad / pi
+    if direction < 0:
+        direction += 360.0
+    return direction
+
+# returns the standard deviation of the wind direction in degrees from the
+# mean unit vector (Yamartino)
+def yamartino(ux, uy):
+    epsilon = 1.0 - (ux * ux + uy * uy)
+    epsilon = sqrt(epsilon) if epsilon > 0.0 else 0.0
+    if epsilon > 1.0:
+        epsilon = 1.0
+    return 180.0 / pi * asin(epsilon) * (1.0 + (2.0 / sqrt(3.0) - 1.0) * epsilon ** 3)
+
+# wind direction in degrees for the raw 10 bit direction value
+def _wind_direction(raw):
+    return 360 if raw > 1024 or raw <= 0 else int(round(raw * 360.0 / 1024.0))
+
+# components of the unit wind vector for every raw direction value
+_wind_cos = [cos(pi * (90.0 - _wind_direction(raw)) / 180.0) for raw in range(1024)]
+_wind_sin = [sin(pi * (90.0 - _wind_direction(raw)) / 180.0) for raw in range(1024)]
+
+# numpy copies of the wind vector tables for the batch decoder
+_wind_cos_table = numpy.array(_wind_cos)
+_wind_sin_table = numpy.array(_wind_sin)
 
 # wind data 1-min-average
 class WindData(object):
@@ -120,52 +270,221 @@ class WindData(object):
         self.windSpeed = 0
         self.windCount = 0
 
-    def add(self, data):
-        speed = int(data[3], 16) * 0.44704
-        direction = (int(data[4], 16) << 2) | (int(data[6], 16) & 0x02)
-        direction = 360 if direction > 1024 or direction <= 0 else int(round(direction * 360.0 / 1024.0))  
-        rad = pi * (90.0 - direction) / 180.0
+    @staticmethod
+    def decode(frame):
+        # returns wind speed and the raw direction value
+        speed = frame[1] * 0.44704
+        direction = (frame[2] << 2) | (frame[4] & 0x02)
+        return speed, direction
+
+    def add(self, frame):
+        speed, direction = WindData.decode(frame)
 
         self.windSpeed += speed
-        self.windVektor += (speed * array([cos(rad), sin(rad)]))
+        self.windVektor += (speed * array([_wind_cos[direction], _wind_sin[direction]]))
         self.windCount += 1
 
     def get(self):
-        if self.windCount == 0:
-            return None
-
-        direction = None
-        length = norm(self.windVektor)
-        speed = self.windSpeed / self.windCount
-        if speed > 0 and length > 0.01:
-            rad = acos(self.windVektor[0] / length)
-            if self.windVektor[1] < 0:
-                rad = 2*pi - rad
-
-            direction = 90.0 - 180.0 * rad / pi
-            if direction < 0:
-                direction += 360.0
-
-        return [speed, direction]
+        return wind_average(self.windSpeed, self.windVektor[0], self.windVektor[1], self.windCount)
 
 # wind data floating N-min-average
 class WindDataN(object):
 
+    __slots__ = ('ring',)
+
     def __init__(self, N):
-        self.N = N
-        self.pos = 0
-        self.array = [WindData() for _ in range(self.N)]
+        # speed and both components of the wind vector
+        self.ring = MinuteRing(N, 3)
 
     def reset(self):
-        self.pos = (self.pos + 1) % self.N
-        self.array[self.pos].reset()
+        self.ring.reset()
+
+    def add(self, frame):
+        speed, direction = WindData.decode(frame)
+        self.ring.add(speed, speed * _wind_cos[direction], speed * _wind_sin[direction])
 
-    def add(self, data):
-        for i in range(self.N):
-            self.array[i].add(data)
+    def get(self):
+        ring = self.ring
+        return wind_average(ring.get_sum(0), ring.get_sum(1), ring.get_sum(2), ring.get_count())
+
+    def get_state(self):
+        return self.ring.get_state()
+
+    def set_state(self, state):
+        self.ring.set_state(state)
+
+# samples of the 3 s gust, the samples of the last 3 s but at most GUST_SIZE
+GUST_SECONDS = 3
+GUST_SIZE = 8
+
+# wind data floating N-min-average, 2 and 10 min vector means, direction
+# variability and 3 s gusts, updated in O(1) per frame without allocations
+class WindEngine(object):
+
+    __slots__ = ('ring', 'stats', 'gust_times', 'gust_speeds', 'gust_head', 'gust_len',
+                 'gust_sum', 'gust_max')
+
+    def __init__(self, N):
+        # speed and both components of the wind vector, like WindDataN
+        self.ring = MinuteRing(N, 3)
+        # the wind vector, the unit vector of the direction and the count of
+        # the frames with wind over 10 minutes
+        self.stats = MinuteRing(10, 5)
+        # the times in ms and the raw speeds of the last samples in a circle
+        self.gust_times = typed_array('l', [0] * GUST_SIZE)
+        self.gust_speeds = typed_array('l', [0] * GUST_SIZE)
+        self.gust_head = 0
+        self.gust_len = 0
+        self.gust_sum = 0
+        # the highest 3 s mean of the current minute
+        self.gust_max = None
+
+    def reset(self):
+        self.ring.reset()
+        self.stats.reset()
+        self.gust_max = None
+
+    def add(self, frame, frame_time=None):
+        # adds a frame received at frame_time (in ms), without frame_time no
+        # gust is computed
+        raw = frame[1]
+        speed = raw * 0.44704
+        direction = (frame[2] << 2) | (frame[4] & 0x02)
+        dx = _wind_cos[direction]
+        dy = _wind_sin[direction]
+        vx = speed * dx
+        vy = speed * dy
+
+        ring = self.ring
+        pos = ring.pos
+        base = pos * 3
+        sums = ring.sums
+        sums[base] += speed
+        sums[base + 1] += vx
+        sums[base + 2] += vy
+        ring.counts[pos] += 1
+
+        stats = self.stats
+        pos = stats.pos
+        base = pos * 5
+        sums = stats.sums
+        sums[base] += vx
+        sums[base + 1] += vy
+        if raw:
+            sums[base + 2] += dx
+            sums[base + 3] += dy
+            sums[base + 4] += 1.0
+        stats.counts[pos] += 1
+
+        if frame_time is not None:
+            self.add_gust(frame_time, raw)
+
+    def add_gust(self, frame_time, raw):
+        times = self.gust_times
+        speeds = self.gust_speeds
+        head = self.gust_head
+        length = self.gust_len
+        start = frame_time - 1000 * GUST_SECONDS
+        while length and (times[head] <= start or length == GUST_SIZE):
+            self.gust_sum -= speeds[head]
+            head = (head + 1) % GUST_SIZE
+            length -= 1
+        tail = (head + length) % GUST_SIZE
+        times[tail] = frame_time
+        speeds[tail] = raw
+        self.gust_sum += raw
+        self.gust_head = head
+        self.gust_len = length + 1
+
+        gust = self.gust_sum * 0.44704 / self.gust_len
+        if self.gust_max is None or gust > self.gust_max:
+            self.gust_max = gust
+
+    def gust_means(self, times, raw):
+        # the 3 s means of the samples at times (in ms) with the raw speeds,
+        # continuing the samples of add(), as repeated add_gust() calls
+        count = self.gust_len
+        previous = [(self.gust_head + k) % GUST_SIZE for k in range(count)]
+        times = numpy.concatenate(([self.gust_times[k] for k in previous], times)).astype(numpy.int64)
+        raw = numpy.concatenate(([self.gust_speeds[k] for k in previous], raw)).astype(numpy.int64)
+        idx = numpy.arange(count, len(times))
+        if not len(idx):
+            return numpy.zeros(0)
+        start = numpy.searchsorted(times, times[idx] - 1000 * GUST_SECONDS, side='right')
+        start = numpy.maximum(start, idx - (GUST_SIZE - 1))
+        sums = numpy.concatenate(([0], numpy.cumsum(raw)))
+        means = (sums[idx + 1] - sums[start]) * 0.44704 / (idx + 1 - start)
+
+        # the samples of the window of the last one
+        last = int(start[-1])
+        self.gust_head = 0
+        self.gust_len = len(times) - last
+        for k in range(self.gust_len):
+            self.gust_times[k] = int(times[last + k])
+            self.gust_speeds[k] = int(raw[last + k])
+        self.gust_sum = int(raw[last:].sum())
+        return means
+
+    def extend(self, speed, vx, vy, dx, dy, moving, gusts):
+        # adds columns of frames with the same rounding as repeated add()
+        # calls, gusts are the means of gust_means()
+        self.ring.extend(speed, vx, vy)
+        self.stats.extend(vx, vy, dx, dy, moving)
+        if len(gusts):
+            gust = float(gusts.max())
+            if self.gust_max is None or gust > self.gust_max:
+                self.gust_max = gust
 
     def get(self):
-        return self.array[(self.pos + 1) % self.N].get()
+        ring = self.ring
+        return wind_average(ring.get_sum(0), ring.get_sum(1), ring.get_sum(2), ring.get_count())
+
+    def get_vector(self, minutes):
+        # returns [speed, direction] of the vector mean of the last minutes
+        # and the standard deviation of the direction, or None
+        stats = self.stats
+        if minutes >= stats.size:
+            count = stats.get_count()
+            (vx, vy, dx, dy, moving) = [stats.get_sum(i) for i in range(5)]
+        else:
+            recent = [stats.get_recent(minutes, i) for i in range(5)]
+            count = recent[0][0]
+            (vx, vy, dx, dy, moving) = [total for (_, total) in recent]
+        if count == 0:
+            return None
+
+        direction = None
+        length = sqrt(vx * vx + vy * vy)
+        if length > 0.01:
+            direction = wind_direction(vx, vy, length)
+        deviation = yamartino(dx / moving, dy / moving) if moving > 0 else None
+        return [length / count, direction, deviation]
+
+    def get_gust(self):
+        return self.gust_max
+
+    def get_state(self):
+        return self.ring.get_state()
+
+    def set_state(self, state):
+        self.ring.set_state(state)
+
+    def get_stats_state(self):
+        previous = [(self.gust_head + k) % GUST_SIZE for k in range(self.gust_len)]
+        return {'stats': self.stats.get_state(),
+                'gust_times': [self.gust_times[k] for k in previous],
+                'gust_speeds': [self.gust_speeds[k] for k in previous],
+                'gust_max': self.gust_max}
+
+    def set_stats_state(self, state):
+        self.stats.set_state(state['stats'])
+        self.gust_head = 0
+        self.gust_len = len(state['gust_times'])
+        for k in range(self.gust_len):
+            self.gust_times[k] = state['gust_times'][k]
+            self.gust_speeds[k] = state['gust_speeds'][k]
+        self.gust_sum = sum(state['gust_speeds'])
+        self.gust_max = state['gust_max']
 
 # rain data
 class RainData(object):
@@ -177,8 +496,8 @@ class RainData(object):
     def reset(self):
         self.rainSum = 0
 
-    def add(self, data):
-        ticks = int(data[5], 16) & 0x7f
+    def add(self, frame):
+        ticks = frame[3] & 0x7f
         if self.rainTicks != None and ticks > self.rainTicks:
             self.rainSum += (ticks - self.rainTicks) * 0.2001
             self.rainTicks = ticks
@@ -187,9 +506,141 @@ class RainData(object):
             self.rainTicks = ticks
         self.rainTicks = ticks
 
+    def get_state(self):
+        return {'rainSum': self.rainSum, 'rainTicks': self.rainTicks}
+
+    def set_state(self, state):
+        self.rainSum = state['rainSum']
+        self.rainTicks = state['rainTicks']
+
+    def add_ticks(self, ticks):
+        # adds an array of tick counter values, like repeated add() calls
+        previous = numpy.concatenate(([ticks[0] if self.rainTicks is None else self.rainTicks], ticks[:-1]))
+        delta = (ticks - previous) % 128
+        if delta.any():
+            self.rainSum = sequential_sum(self.rainSum, delta * 0.2001)
+        self.rainTicks = int(ticks[-1])
+
     def get(self):
         return self.rainSum
 
+class RainEngine(RainData):
+    """RainData with the rain rates from the times of the tips.
+
+    The rain frames with new tips are kept as (time, tips) in a ring of SIZE
+    entries, the tips of the last 5, 15 and 60 minutes are summed up as the
+    frames come and expire, so the rates of a packet take constant time.
+    The rain rate is that of the interval between the last two frames with
+    tips; without a tip for longer it decays like one tip over the time
+    since the last one, after 15 minutes without a tip it is 0. The tips
+    after more than GAP ms without a rain frame, e.g. after a restart, or
+    more than MAX_TIPS at once, e.g. a counter reset, only count for rain.
+    """
+
+    SIZE = 256
+    # the minutes of rainRate5, rainRate15 and hourRain
+    WINDOWS = (5, 15, 60)
+    GAP = 300000
+    MAX_TIPS = 32
+    TIP = 0.2001
+
+    def __init__(self):
+        RainData.__init__(self)
+        self.times = [0] * self.SIZE
+        self.tips = [0] * self.SIZE
+        # the number of the next entry and of the oldest one in each window
+        self.seq = 0
+        self.tails = [0] * len(self.WINDOWS)
+        self.sums = [0] * len(self.WINDOWS)
+        # the time of the last rain frame (in ms)
+        self.frame_time = None
+
+    def add(self, frame, frame_time=None):
+        previous = self.rainTicks
+        RainData.add(self, frame)
+        if frame_time is not None:
+            self._tick(frame_time, (self.rainTicks - previous) % 128 if previous is not None else 0)
+
+    def add_ticks(self, ticks, times):
+        # adds arrays of tick counter values and frame times, like repeated
+        # add() calls; with a few frames per minute a loop beats numpy
+        previous = self.rainTicks
+        for (tick, frame_time) in zip(ticks.tolist(), times.tolist()):
+            tips = (tick - previous) % 128 if previous is not None else 0
+            if tips:
+                self.rainSum += tips * 0.2001
+            self._tick(frame_time, tips)
+            previous = tick
+        self.rainTicks = previous
+
+    def _tick(self, frame_time, tips):
+        # the tips of the rain frame at frame_time
+        if tips and self.frame_time is not None and frame_time - self.frame_time <= self.GAP \
+           and tips <= self.MAX_TIPS:
+            self._push(frame_time, tips)
+        self.frame_time = frame_time
+
+    def _push(self, frame_time, tips):
+        # the oldest entry is overwritten, it leaves the windows first
+        old = self.seq - self.SIZE
+        for i in range(len(self.WINDOWS)):
+            if self.tails[i] == old:
+                self.sums[i] -= self.tips[old % self.SIZE]
+                self.tails[i] += 1
+        slot = self.seq % self.SIZE
+        self.times[slot] = frame_time
+        self.tips[slot] = tips
+        self.seq += 1
+        for i in range(len(self.WINDOWS)):
+            self.sums[i] += tips
+
+    def _expire(self, now):
+        for (i, minutes) in enumerate(self.WINDOWS):
+            start = now - 60000 * minutes
+            tail = self.tails[i]
+            while tail < self.seq and self.times[tail % self.SIZE] <= start:
+                self.sums[i] -= self.tips[tail % self.SIZE]
+                tail += 1
+            self.tails[i] = tail
+
+    def get_rates(self, now):
+        # the rain rate, the rates of the last 5 and 15 minutes (in mm/h)
+        # and the rain of the last hour (in mm) at now (in ms)
+        self._expire(now)
+        rate = 0.0
+        if self.sums[1]:
+            last = self.seq - 1
+            interval = 60000 * self.WINDOWS[1]
+            if last - 1 >= self.tails[1]:
+                interval = max(self.times[last % self.SIZE] - self.times[(last - 1) % self.SIZE], 1000)
+            rate = self.tips[last % self.SIZE] * self.TIP * 3600000.0 / interval
+            since = now - self.times[last % self.SIZE]
+            if since > interval:
+                rate = min(rate, self.TIP * 3600000.0 / since)
+        return (rate, self.sums[0] * self.TIP * 60.0 / self.WINDOWS[0],
+                self.sums[1] * self.TIP * 60.0 / self.WINDOWS[1], self.sums[2] * self.TIP)
+
+    def get_state(self):
+        state = RainData.get_state(self)
+        # the entries of the longest window
+        oldest = self.tails[-1]
+        state['frame_time'] = self.frame_time
+        state['tips'] = [[self.times[seq % self.SIZE], self.tips[seq % self.SIZE]]
+                         for seq in range(oldest, self.seq)]
+        state['tails'] = [tail - oldest for tail in self.tails]
+        return state
+
+    def set_state(self, state):
+        self.__init__()
+        RainData.set_state(self, state)
+        # snapshots of older versions have no tips
+        self.frame_time = state.get('frame_time')
+        for (frame_time, tips) in state.get('tips', []):
+            self._push(frame_time, tips)
+        self.tails = state.get('tails', self.tails)
+        for i in range(len(self.WINDOWS)):
+            self.sums[i] = sum(self.tips[seq % self.SIZE] for seq in range(self.tails[i], self.seq))
+
 # temperatur data 1-min-average
 class TemperatureData(object):
 
@@ -201,11 +652,14 @@ class TemperatureData(object):
         self.temp = 0
         self.tempCount = 0
 
-    def add(self, data):
-        value = int(data[5], 16) * 256 + int(data[6], 16)
+    @staticmethod
+    def decode(frame):
+        value = frame[3] * 256 + frame[4]
         value = value - 65536 if value > 32767 else value
-        tempAkt = (value/160.0 - 32.0)*5.0/9.0
-        self.temp += tempAkt
+        return (value/160.0 - 32.0)*5.0/9.0
+
+    def add(self, frame):
+        self.temp += TemperatureData.decode(frame)
         self.tempCount += 1
 
     def get(self):
@@ -214,21 +668,25 @@ class TemperatureData(object):
 # temperatur data floating N-min-average
 class TemperatureDataN(object):
 
+    __slots__ = ('ring',)
+
     def __init__(self, N):
-        self.N = N
-        self.pos = 0
-        self.array = [TemperatureData() for _ in range(self.N)]
+        self.ring = MinuteRing(N)
 
     def reset(self):
-        self.pos = (self.pos + 1) % self.N
-        self.array[self.pos].reset()
+        self.ring.reset()
 
-    def add(self, data):
-        for i in range(self.N):
-            self.array[i].add(data)
+    def add(self, frame):
+        self.ring.add(TemperatureData.decode(frame))
 
     def get(self):
-        return self.array[(self.pos + 1) % self.N].get()
+        return self.ring.get_average()
+
+    def get_state(self):
+        return self.ring.get_state()
+
+    def set_state(self, state):
+        self.ring.set_state(state)
 
 # humity data 1-min-average
 class HumityData(object):
@@ -241,11 +699,14 @@ class HumityData(object):
         self.humidity = 0
         self.humidityCount = 0
 
-    def add(self, data):
-        value = ((int(data[6], 16) >> 4) << 8) + int(data[5], 16)
+    @staticmethod
+    def decode(frame):
+        value = ((frame[4] >> 4) << 8) + frame[3]
         humidityAkt = value * 1.01 / 10.0
-        humidityAkt = 100 if humidityAkt > 100 else humidityAkt
-        self.humidity += humidityAkt
+        return 100 if humidityAkt > 100 else humidityAkt
+
+    def add(self, frame):
+        self.humidity += HumityData.decode(frame)
         self.humidityCount += 1
 
     def get(self):
@@ -254,21 +715,25 @@ class HumityData(object):
 # humity data floating N-min-average
 class HumityDataN(object):
 
+    __slots__ = ('ring',)
+
     def __init__(self, N):
-        self.N = N
-        self.pos = 0
-        self.array = [HumityData() for _ in range(self.N)]
+        self.ring = MinuteRing(N)
 
     def reset(self):
-        self.pos = (self.pos + 1) % self.N
-        self.array[self.pos].reset()
+        self.ring.reset()
 
-    def add(self, data):
-        for i in range(self.N):
-            self.array[i].add(data)
+    def add(self, frame):
+        self.ring.add(HumityData.decode(frame))
 
     def get(self):
-        return self.array[(self.pos + 1) % self.N].get()
+        return self.ring.get_average()
+
+    def get_state(self):
+        return self.ring.get_state()
+
+    def set_state(self, state):
+        self.ring.set_state(state)
 
 # wind gust data
 class WindGustData(object):
@@ -281,12 +746,26 @@ class WindGustData(object):
         self.windGust = 0
         self.windGustCount = 0
 
-    def add(self, data):
-        _windGust = int(data[5], 16) * 0.44704
+    def add(self, frame):
+        _windGust = frame[3] * 0.44704
         if _windGust > self.windGust:
             self.windGust = _windGust
         self.windGustCount += 1
 
+    def get_state(self):
+        return {'windGust': self.windGust, 'windGustCount': self.windGustCount}
+
+    def set_state(self, state):
+        self.windGust = state['windGust']
+        self.windGustCount = state['windGustCount']
+
+    def add_values(self, values):
+        # adds an array of gust values, like repeated add() calls
+        _windGust = float(values.max())
+        if _windGust > self.windGust:
+            self.windGust = _windGust
+        self.windGustCount += len(values)
+
     def get(self):
         return self.windGust if self.windGustCount > 0 or self.windGust > 0 else None
 
@@ -302,11 +781,15 @@ class BarometerData(object):
         self.barometer = 0
         self.barometerCount = 0
 
-    def add(self, data):
-        if data[0] == 'A':
-            self.barometer += float(data[4])/100.0
-        else:
-            self.barometer += pow(pow(float(data[4])/100.0, 0.1902614) + 8.417168e-05 * self.height, 5.255927)
+    @staticmethod
+    def decode(kind, pressure, height):
+        # pressure in hundredths of hPa, A frames report sea level pressure
+        if kind == 'A':
+            return pressure/100.0
+        return pow(pow(pressure/100.0, 0.1902614) + 8.417168e-05 * height, 5.255927)
+
+    def add(self, kind, pressure):
+        self.barometer += BarometerData.decode(kind, pressure, self.height)
         self.barometerCount += 1
 
     def get(self):
@@ -315,121 +798,847 @@ class BarometerData(object):
 # barometer floating N-min-average
 class BarometerDataN(object):
 
+    __slots__ = ('height', 'ring')
+
     def __init__(self, height, N):
-        self.N = N
-        self.pos = 0
-        self.array = [BarometerData(height) for _ in range(self.N)]
+        self.height = height
+        self.ring = MinuteRing(N)
 
     def reset(self):
-        self.pos = (self.pos + 1) % self.N
-        self.array[self.pos].reset()
+        self.ring.reset()
 
-    def add(self, data):
-        for i in range(self.N):
-            self.array[i].add(data)
+    def add(self, kind, pressure):
+        self.ring.add(BarometerData.decode(kind, pressure, self.height))
 
     def get(self):
-        return self.array[(self.pos + 1) % self.N].get()
+        return self.ring.get_average()
+
+    def get_state(self):
+        return self.ring.get_state()
+
+    def set_state(self, state):
+        self.ring.set_state(state)
+
+# sensor ids by the high nibble of the header byte
+_SENSOR_IDS = {0x2: 'V', 0x5: 'R', 0x7: 'S', 0x8: 'T', 0x9: 'G', 0xA: 'H', 0xE: 'N'}
+
+# lookup tables of the batch decoder
+_hex_table = numpy.full(256, -1, dtype=numpy.int64)
+for _ch in '0123456789abcdefABCDEF':
+    _hex_table[ord(_ch)] = int(_ch, 16)
+_sensor_table = numpy.zeros(16, dtype='S1')
+_sensor_table[:] = 'I'
+for _nibble, _id in _SENSOR_IDS.items():
+    _sensor_table[_nibble] = _id
+_crc_table = numpy.array(_tab, dtype=numpy.int64)
+
+# decodes the hex columns 2..9 of I frames into a (frames x 8) array of
+# byte values, returns None unless every column has one or two hex digits
+def _decode_hex_columns(frames):
+    chars = numpy.array([data[2:10] for data in frames], dtype='S3')
+    chars = chars.view(numpy.uint8).reshape(len(frames), 8, 3)
+    high = _hex_table[chars[:, :, 0]]
+    low = _hex_table[chars[:, :, 1]]
+    single = chars[:, :, 1] == 0
+    if (high < 0).any() or (chars[:, :, 2] != 0).any() or ((low < 0) & ~single).any():
+        return None
+    return numpy.where(single, high, high * 16 + low)
+
+# vectorized crc over the byte columns
+def _crc_columns(values):
+    crc_values = numpy.zeros(len(values), dtype=numpy.int64)
+    for idx in range(values.shape[1]):
+        tmp = (crc_values >> 8) ^ values[:, idx]
+        crc_values = ((crc_values << 8) ^ _crc_table[tmp & 0xff]) & 0xffff
+    return crc_values
+
+# the altitude of the barometer (in m)
+ALTITUDE = 310.8
+
+# the options of the floating averages with their defaults, in the order of
+# the StationParser arguments
+WINDOW_OPTIONS = (('barometer_window', 10), ('wind_window', 10),
+                  ('temperature_window', 5), ('humidity_window', 5))
 
 class StationParser(object):
 
-    def __init__(self):
+    def __init__(self, barometer_window=10, wind_window=10, temperature_window=5, humidity_window=5,
+                 altitude=ALTITUDE):
         # initialize data objects
-        self.barometer_data = BarometerDataN(310.8, 10)
-        self.wind_data = WindDataN(10)
-        self.rain_data = RainData()
-        self.temp_data = TemperatureDataN(5)
-        self.humidy_data = HumityDataN(5)
+        self.windows = (barometer_window, wind_window, temperature_window, humidity_window)
+        self.altitude = altitude
+        self.barometer_data = BarometerDataN(altitude, barometer_window)
+        self.wind_data = WindEngine(wind_window)
+        self.rain_data = RainEngine()
+        self.temp_data = TemperatureDataN(temperature_window)
+        self.humidy_data = HumityDataN(humidity_window)
         self.gust_data = WindGustData()
         self.packet_time = None
 
-    def parse(self, data, data_time):
-        if not data or (data[0] != 'A' and data[0] != 'B' and data[0] != 'I'):
-            return None
-
-        if data[0] == 'A' or data[0] == 'B':
-            self.barometer_data.add(data)
-            new_packet_time = data_time - data_time % 60
-            if self.packet_time != new_packet_time:
-                self.packet_time = new_packet_time
+        # frames with a bad crc by header nibble
+        self.crc_failures = {}
 
-                packet = {}
-                packet['dateTime'] = self.packet_time
+        # accumulators of the sensor specific values by header nibble
+        self.sensor_data = {0xE: self.rain_data, 0x8: self.temp_data,
+                            0x9: self.gust_data, 0xA: self.humidy_data}
 
-                _barometer = self.barometer_data.get()
-                packet['barometer'] = round(_barometer, 1) if _barometer else None
+    def parse(self, data, data_time, frame_time=None):
+        # parses a split text frame, frame_time is the time in ms for the
+        # gusts
+        if not data:
+            return None
 
-                wind_info = self.wind_data.get()
-                _windSpeed = wind_info[0] if wind_info else None
-                packet['windSpeed'] = round(_windSpeed, 2) if _windSpeed else None
-                _windSpeed = wind_info[1] if wind_info else None
-                packet['windDir'] = round(_windSpeed, 0) if _windSpeed else None
+        if data[0] == 'A' or data[0] == 'B':
+            return self.parse_pressure(data[0], float(data[4]), data_time)
 
-                _windGust = self.gust_data.get()
-                packet['windGust'] = round(_windGust, 2) if _windGust else None
+        if data[0] == 'I':
+            frame = decode_hex(data)
+            if frame is not None:
+                self.parse_frame(frame, frame_time)
 
-                packet['rain'] = self.rain_data.get()
+        return None
 
-                _outTemp = self.temp_data.get()
-                packet['outTemp'] = round(_outTemp, 1) if _outTemp else None
+    def parse_binary(self, kind, frame, pressure, data_time, frame_time=None):
+        # parses a frame of the binary sensor_frame table
+        if kind == 'A' or kind == 'B':
+            return self.parse_pressure(kind, float(pressure), data_time)
 
-                _outHumidity = self.humidy_data.get()
-                packet['outHumidity'] = round(_outHumidity, 0) if _outHumidity else None
+        if kind == 'I' and frame is not None and len(frame) >= 8:
+            self.parse_frame(_FRAME_BYTES.unpack_from(frame), frame_time)
 
-                packet['dewpoint'] = calc_dewpoint(_outTemp, _outHumidity)
+        return None
 
-                # reset data
-                self.barometer_data.reset()
-                self.wind_data.reset()
-                self.rain_data.reset()
-                self.temp_data.reset()
-                self.gust_data.reset()
-                self.humidy_data.reset()
+    def parse_pressure(self, kind, pressure, data_time):
+        # an A or B frame, the first one of a minute completes the packet
+        self.barometer_data.add(kind, pressure)
+        new_packet_time = data_time - data_time % 60
+        if self.packet_time != new_packet_time:
+            self.packet_time = new_packet_time
+            return self._packet()
+        return None
 
-                return packet
-            return None
+    def parse_frame(self, frame, frame_time=None):
+        # the 8 bytes of an ISS radio packet, including the crc
+        if crc_frame(frame) == 0:
+            self.wind_data.add(frame, frame_time)
 
-        if crc(data) == 0:
-            self.wind_data.add(data)
+            sensor_data = self.sensor_data.get(frame[0] >> 4)
+            if sensor_data is self.rain_data:
+                self.rain_data.add(frame, frame_time)
+            elif sensor_data is not None:
+                sensor_data.add(frame)
+        else:
+            sensor = frame[0] >> 4
+            self.crc_failures[sensor] = self.crc_failures.get(sensor, 0) + 1
 
-            sensor_id = StationParser.sensor(data)
-            if sensor_id == 'N':
-                self.rain_data.add(data)
+    def parse_batch(self, rows):
+        """Parses a batch of (dateTime, data) rows from the sensor table.
 
-            elif sensor_id == 'T' :
-                self.temp_data.add(data)
+        The hex columns, crcs and sensor ids of the whole batch are decoded
+        with numpy and the per-minute sums are added to the accumulators in
+        one step per minute. The packets and the parser state are exactly
+        the same as from calling parse() for every row; batches with
+        malformed frames are handled by parse().
 
-            elif sensor_id == 'G' :
-                self.gust_data.add(data)
+        Returns the list of packets.
+        """
+        frames = [(data_time, strdata.split() if strdata else None) for (data_time, strdata) in rows]
+
+        pressures = []
+        frame_rows = []
+        for idx, (data_time, data) in enumerate(frames):
+            if not data:
+                continue
+            if data[0] == 'A' or data[0] == 'B':
+                pressures.append((idx, data_time, data[0], float(data[4])))
+            elif data[0] == 'I':
+                if len(data) < 10:
+                    return self._parse_rows(frames)
+                frame_rows.append(idx)
+
+        values = _decode_hex_columns([frames[idx][1] for idx in frame_rows]) if frame_rows else None
+        if frame_rows and values is None:
+            return self._parse_rows(frames)
+
+        return self._parse_columns(pressures, frame_rows, [frames[idx][0] for idx in frame_rows], values)
+
+    def parse_batch_binary(self, rows):
+        """Parses a batch of (dateTime, type, frame, pressure) rows from the
+        sensor_frame table like parse_batch().
+        """
+        pressures = []
+        frame_rows = []
+        frames = []
+        for idx, (data_time, kind, frame, pressure) in enumerate(rows):
+            if kind == 'A' or kind == 'B':
+                pressures.append((idx, data_time, kind, float(pressure)))
+            elif kind == 'I' and frame is not None and len(frame) >= 8:
+                frame_rows.append(idx)
+                frames.append(str(frame[:8]))
+
+        values = None
+        if frames:
+            values = numpy.frombuffer(''.join(frames), dtype=numpy.uint8).reshape(len(frames), 8)
+            values = values.astype(numpy.int64)
+
+        return self._parse_columns(pressures, frame_rows, [rows[idx][0] for idx in frame_rows], values)
+
+    def _parse_columns(self, pressures, frame_rows, frame_times, values):
+        # pressures are (row, dateTime, kind, pressure) of the A and B frames,
+        # values the (frames x 8) bytes of the I frames in the rows frame_rows
+        # received at frame_times
+
+        # barometer values and the frames which start a new minute
+        pressure_rows = []
+        pressure_values = []
+        boundaries = []
+        packet_times = []
+        packet_time = self.packet_time
+        height = self.barometer_data.height
+        for (idx, data_time, kind, pressure) in pressures:
+            pressure_rows.append(idx)
+            pressure_values.append(BarometerData.decode(kind, pressure, height))
+            data_time = data_time / 1000
+            new_packet_time = data_time - data_time % 60
+            if packet_time != new_packet_time:
+                packet_time = new_packet_time
+                boundaries.append(idx)
+                packet_times.append(packet_time)
+
+        # the values of all valid I frames, grouped by sensor id
+        pressure_rows = numpy.array(pressure_rows, dtype=numpy.int64)
+        pressure_values = numpy.array(pressure_values, dtype=numpy.float64)
+        if frame_rows:
+            valid = _crc_columns(values) == 0
+            if not valid.all():
+                for sensor, count in zip(*numpy.unique(values[~valid, 0] >> 4, return_counts=True)):
+                    self.crc_failures[int(sensor)] = self.crc_failures.get(int(sensor), 0) + int(count)
+            rows_idx = numpy.array(frame_rows, dtype=numpy.int64)[valid]
+            frame_times = numpy.array(frame_times, dtype=numpy.int64)[valid]
+            values = values[valid]
+            sensors = _sensor_table[values[:, 0] >> 4]
+        else:
+            rows_idx = numpy.zeros(0, dtype=numpy.int64)
+            frame_times = numpy.zeros(0, dtype=numpy.int64)
+            values = numpy.zeros((0, 8), dtype=numpy.int64)
+            sensors = numpy.zeros(0, dtype='S1')
+
+        wind_speed = values[:, 1] * 0.44704
+        wind_direction = (values[:, 2] << 2) | (values[:, 4] & 0x02)
+        wind_dx = _wind_cos_table[wind_direction]
+        wind_dy = _wind_sin_table[wind_direction]
+        moving = values[:, 1] > 0
+        wind = (rows_idx, wind_speed, wind_speed * wind_dx, wind_speed * wind_dy,
+                numpy.where(moving, wind_dx, 0.0), numpy.where(moving, wind_dy, 0.0),
+                moving.astype(numpy.float64), self.wind_data.gust_means(frame_times, values[:, 1]))
+
+        mask = sensors == 'N'
+        rain = (rows_idx[mask], values[mask, 3] & 0x7f, frame_times[mask])
+
+        mask = sensors == 'T'
+        temp_values = values[mask, 3] * 256 + values[mask, 4]
+        temp_values = numpy.where(temp_values > 32767, temp_values - 65536, temp_values)
+        temp = (rows_idx[mask], (temp_values / 160.0 - 32.0) * 5.0 / 9.0)
+
+        mask = sensors == 'G'
+        gust = (rows_idx[mask], values[mask, 3] * 0.44704)
+
+        mask = sensors == 'H'
+        humidity_values = ((values[mask, 4] >> 4) << 8) + values[mask, 3]
+        humidity_values = humidity_values * 1.01 / 10.0
+        humidity = (rows_idx[mask], numpy.where(humidity_values > 100, 100, humidity_values))
+
+        barometer = (pressure_rows, pressure_values)
+
+        # feed the accumulators minute by minute, the dewpoints of all
+        # packets are calculated at the end
+        packets = []
+        raw = []
+        columns = (barometer, wind, rain, temp, gust, humidity)
+        starts = [0] * len(columns)
+        ends = [numpy.searchsorted(column[0], boundaries, side='right') for column in columns]
+        for k in range(len(boundaries) + 1):
+            segments = []
+            for i, column in enumerate(columns):
+                end = ends[i][k] if k < len(boundaries) else len(column[0])
+                segments.append([col[starts[i]:end] for col in column[1:]])
+                starts[i] = end
+
+            (barometer_values,), wind_values, (rain_ticks, rain_times), (temp_values,), (gust_values,), (humidity_values,) = segments
+            if len(barometer_values):
+                self.barometer_data.ring.extend(barometer_values)
+            if len(wind_values[0]):
+                self.wind_data.extend(*wind_values)
+            if len(rain_ticks):
+                self.rain_data.add_ticks(rain_ticks, rain_times)
+            if len(temp_values):
+                self.temp_data.ring.extend(temp_values)
+            if len(gust_values):
+                self.gust_data.add_values(gust_values)
+            if len(humidity_values):
+                self.humidy_data.ring.extend(humidity_values)
+
+            if k < len(boundaries):
+                self.packet_time = packet_times[k]
+                packets.append(self._packet(raw))
+
+        for (packet, dewpoint) in zip(packets, calc_dewpoints(raw)):
+            packet['dewpoint'] = dewpoint
+        return packets
+
+    # version of the state snapshots
+    STATE_VERSION = 1
+
+    def get_state(self):
+        # returns the parser state as a json compatible dict
+        return {'version': StationParser.STATE_VERSION,
+                'barometer': self.barometer_data.get_state(),
+                'wind': self.wind_data.get_state(),
+                'wind_stats': self.wind_data.get_stats_state(),
+                'rain': self.rain_data.get_state(),
+                'temp': self.temp_data.get_state(),
+                'humidity': self.humidy_data.get_state(),
+                'gust': self.gust_data.get_state(),
+                'packet_time': self.packet_time}
+
+    def set_state(self, state):
+        # restores a state from get_state(), raises ValueError if it does
+        # not fit this parser
+        if state.get('version') != StationParser.STATE_VERSION:
+            raise ValueError("unknown state version %s" % state.get('version'))
+        try:
+            self.barometer_data.set_state(state['barometer'])
+            self.wind_data.set_state(state['wind'])
+            if 'wind_stats' in state:
+                self.wind_data.set_stats_state(state['wind_stats'])
+            self.rain_data.set_state(state['rain'])
+            self.temp_data.set_state(state['temp'])
+            self.humidy_data.set_state(state['humidity'])
+            self.gust_data.set_state(state['gust'])
+            self.packet_time = state['packet_time']
+        except (KeyError, TypeError), e:
+            raise ValueError("bad state: %s" % e)
+
+    def _parse_rows(self, frames):
+        packets = []
+        for (data_time, data) in frames:
+            packet = self.parse(data, data_time / 1000, data_time)
+            if packet:
+                packets.append(packet)
+        return packets
+
+    def _packet(self, raw=None):
+        # returns the packet of the elapsed minute and starts the next one;
+        # with the list raw the dewpoint is left to the caller and the
+        # unrounded temperature and humidity are appended to raw
+        packet = {}
+        packet['dateTime'] = self.packet_time
+
+        _barometer = self.barometer_data.get()
+        packet['barometer'] = round(_barometer, 1) if _barometer else None
+
+        wind_info = self.wind_data.get()
+        _windSpeed = wind_info[0] if wind_info else None
+        packet['windSpeed'] = round(_windSpeed, 2) if _windSpeed else None
+        _windSpeed = wind_info[1] if wind_info else None
+        packet['windDir'] = round(_windSpeed, 0) if _windSpeed else None
+
+        _windGust = self.gust_data.get()
+        packet['windGust'] = round(_windGust, 2) if _windGust else None
+
+        # the 3 s gust of the minute, the 2 and 10 min vector means and the
+        # variability of the direction
+        _windGust = self.wind_data.get_gust()
+        packet['windGust3s'] = round(_windGust, 2) if _windGust is not None else None
+        for minutes in (2, 10):
+            vector = self.wind_data.get_vector(minutes)
+            packet['windSpeed%d' % minutes] = round(vector[0], 2) if vector else None
+            packet['windDir%d' % minutes] = round(vector[1], 0) if vector and vector[1] is not None else None
+        # the variability of the direction over the last 10 min
+        vector = self.wind_data.get_vector(10)
+        packet['windDirStdDev'] = round(vector[2], 1) if vector and vector[2] is not None else None
+
+        packet['rain'] = self.rain_data.get()
+        # the rates at the time of the packet or of a later rain frame
+        rates = self.rain_data.get_rates(max(1000 * self.packet_time, self.rain_data.frame_time or 0))
+        packet['rainRate'] = round(rates[0], 2)
+        packet['rainRate5'] = round(rates[1], 2)
+        packet['rainRate15'] = round(rates[2], 2)
+        packet['hourRain'] = rates[3]
+
+        _outTemp = self.temp_data.get()
+        packet['outTemp'] = round(_outTemp, 1) if _outTemp is not None else None
+
+        _outHumidity = self.humidy_data.get()
+        packet['outHumidity'] = round(_outHumidity, 0) if _outHumidity else None
+
+        if raw is None:
+            packet['dewpoint'] = calc_dewpoint(_outTemp, _outHumidity)
+        else:
+            packet['dewpoint'] = None
+            raw.append((_outTemp, _outHumidity))
 
-            elif sensor_id == 'H':
-                self.humidy_data.add(data)
+        # reset data
+        self.barometer_data.reset()
+        self.wind_data.reset()
+        self.rain_data.reset()
+        self.temp_data.reset()
+        self.gust_data.reset()
+        self.humidy_data.reset()
 
-        return None
+        return packet
 
     @staticmethod
     def sensor(data):
         # returns the sensor id
-        if not data or len(data) < 10 or len(data[2]) < 1:
+        frame = decode_hex(data) if data else None
+        if frame is None:
             return None
 
-        ch = data[2][0]
-        if ch == '2':
-            return 'V'
-        if ch == '5':
-            return 'R'
-        if ch == '7':
-            return 'S'
-        if ch == '8':
-            return 'T'
-        if ch == '9':
-            return 'G'
-        if ch == 'A':
-            return 'H'
-        if ch == 'E':
-            return 'N'
-
-        return 'I'
+        return _SENSOR_IDS.get(frame[0] >> 4, 'I')
+
+# the minutes of frames which fill the floating averages of windows and the
+# rain windows
+def warm_up_minutes(windows):
+    return max(max(windows), RainEngine.WINDOWS[-1])
+
+class Station(object):
+    """An ISS of the station registry.
+
+    transmitter is the id set on the ISS (1-8), receivers are the receivers
+    hearing it, the first one supplies its barometer. altitude and windows
+    configure its parser. The packets of a station with a binding are
+    archived by the driver to that binding.
+    """
+
+    def __init__(self, name, transmitter=1, receivers=('0',), altitude=ALTITUDE,
+                 windows=(10, 10, 5, 5), binding=None):
+        self.name = name
+        self.transmitter = transmitter
+        self.receivers = tuple(str(receiver) for receiver in receivers)
+        self.altitude = altitude
+        self.windows = tuple(windows)
+        self.binding = binding
+
+    def new_parser(self):
+        return StationParser(*self.windows, altitude=self.altitude)
+
+def get_stations(stn_dict):
+    # the stations of the section [[stations]] of the driver, None without
+    # it; the windows and the altitude default to those of the driver
+    stations_dict = stn_dict.get('stations')
+    if not stations_dict or not stations_dict.sections:
+        return None
+    stations = []
+    for name in stations_dict.sections:
+        station_dict = stations_dict[name]
+        windows = [int(station_dict.get(option, stn_dict.get(option, default)))
+                   for (option, default) in WINDOW_OPTIONS]
+        stations.append(Station(name,
+                                transmitter=int(station_dict.get('transmitter', 1)),
+                                receivers=weeutil.weeutil.option_as_list(station_dict.get('receivers', '0')),
+                                altitude=float(station_dict.get('altitude', stn_dict.get('altitude', ALTITUDE))),
+                                windows=windows,
+                                binding=station_dict.get('binding')))
+    return stations
+
+def get_rollups(stn_dict):
+    # the rollups of the section [[rollups]] of the driver
+    rollups_dict = stn_dict.get('rollups')
+    rollups = []
+    for name in rollups_dict.sections if rollups_dict else []:
+        rollup_dict = rollups_dict[name]
+        if not rollup_dict.get('binding'):
+            logmsg("Ignoring rollup %s without binding" % name)
+            continue
+        rollups.append(user.rollup.Rollup(name, int(rollup_dict.get('interval', 300)), rollup_dict['binding']))
+    return rollups
+
+def _parse_station(parser, rows, binary):
+    if not rows:
+        return []
+    if binary:
+        return parser.parse_batch_binary(rows)
+    return parser.parse_batch(rows)
+
+def _station_worker(connection, stations, binary):
+    # a worker process of the StationRegistry, keeps the parsers of its
+    # stations and runs the requests of the registry until it gets None
+    parsers = dict((station.name, station.new_parser()) for station in stations)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        (command, argument) = request
+        try:
+            result = None
+            if command == 'parse':
+                result = dict((name, _parse_station(parsers[name], rows, binary))
+                              for (name, rows) in argument.items())
+            elif command == 'get_state':
+                result = dict((name, parser.get_state()) for (name, parser) in parsers.items())
+            elif command == 'set_state':
+                for (name, parser) in parsers.items():
+                    parser.set_state(argument[name])
+            elif command == 'reset':
+                parsers = dict((station.name, station.new_parser()) for station in stations)
+            elif command == 'crc_failures':
+                result = [parser.crc_failures for parser in parsers.values()]
+                for parser in parsers.values():
+                    parser.crc_failures = {}
+            connection.send((True, result))
+        except Exception, e:
+            connection.send((False, e))
+    connection.close()
+
+class StationRegistry(object):
+    """The parsers of several stations sharing the sensor table.
+
+    The I frames are routed by the receiver and the transmitter id in the
+    header byte, the A and B frames by the receiver to the stations whose
+    barometer it is. With receivers the rows end with the receiver column,
+    else all frames are from receiver 0. A frame heard by several receivers
+    is parsed once: frames of a station with the same bytes within
+    dedupe_window ms are dropped, by a hash index of the recent frames.
+
+    The first station is parsed in this process, the others are spread
+    over workers processes, which keep their parsers and parse their
+    stations while this process parses the first one. Without workers
+    all stations are parsed here.
+    """
+
+    def __init__(self, stations, binary=False, receivers=False, dedupe_window=2000, workers=0):
+        self.stations = stations
+        self.binary = binary
+        self.receivers = receivers
+        self.dedupe_window = dedupe_window
+        self.routes = {}
+        self.barometers = {}
+        for station in stations:
+            for receiver in station.receivers:
+                key = (receiver, station.transmitter - 1)
+                if key in self.routes:
+                    raise ValueError("stations %s and %s share transmitter %d at receiver %s" %
+                                     (self.routes[key].name, station.name, station.transmitter, receiver))
+                self.routes[key] = station
+            self.barometers.setdefault(station.receivers[0], []).append(station)
+        # the time of the recent frames by (station, frame) and in order
+        self.recent = {}
+        self.recent_times = collections.deque()
+        self.duplicates = 0
+        self.unrouted = 0
+
+        # the worker processes as (connection, process, station names)
+        self.workers = []
+        local = stations
+        count = min(max(int(workers), 0), len(stations) - 1)
+        for idx in range(count):
+            shard = stations[1 + idx::count]
+            (connection, child) = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_station_worker, args=(child, shard, binary),
+                                              name='VueISS-%d' % idx)
+            process.daemon = True
+            process.start()
+            child.close()
+            self.workers.append((connection, process, [station.name for station in shard]))
+            local = stations[:1]
+        self.local = local
+        self.parsers = dict((station.name, station.new_parser()) for station in local)
+
+    @property
+    def parser(self):
+        # the parser of the first station
+        return self.parsers[self.stations[0].name]
+
+    def _request(self, command, arguments=None):
+        # sends the command to all workers, with the argument of each one,
+        # and returns their results
+        for (idx, (connection, process, names)) in enumerate(self.workers):
+            connection.send((command, arguments[idx] if arguments is not None else None))
+        return [self._result(connection) for (connection, process, names) in self.workers]
+
+    @staticmethod
+    def _result(connection):
+        (ok, result) = connection.recv()
+        if not ok:
+            raise result
+        return result
+
+    def reset(self):
+        self.parsers = dict((station.name, station.new_parser()) for station in self.local)
+        self._request('reset')
+
+    def route(self, rows):
+        # the rows of each station without the receiver column, by name
+        routed = dict((station.name, []) for station in self.stations)
+        recent = self.recent
+        recent_times = self.recent_times
+        for row in rows:
+            data_time = row[0]
+            receiver = str(row[-1]) if self.receivers else '0'
+            if self.receivers:
+                row = row[:-1]
+            if self.binary:
+                kind = row[1]
+                frame = str(row[2][:8]) if kind == 'I' and row[2] is not None and len(row[2]) >= 8 else None
+                transmitter = ord(frame[0]) & 0x07 if frame is not None else None
+            else:
+                data = row[1].split() if row[1] else None
+                kind = data[0] if data else None
+                frame = tuple(data[2:10]) if kind == 'I' and len(data) >= 10 else None
+                try:
+                    transmitter = int(frame[0], 16) & 0x07 if frame is not None else None
+                except ValueError:
+                    transmitter = None
+
+            if kind == 'A' or kind == 'B':
+                for station in self.barometers.get(receiver, ()):
+                    routed[station.name].append(row)
+                continue
+            station = self.routes.get((receiver, transmitter))
+            if station is None:
+                self.unrouted += 1
+                continue
+
+            key = (station.name, frame)
+            seen = recent.get(key)
+            if seen is not None and data_time - seen <= self.dedupe_window:
+                self.duplicates += 1
+                continue
+            recent[key] = data_time
+            recent_times.append((data_time, key))
+            while recent_times[0][0] < data_time - self.dedupe_window:
+                (seen, key) = recent_times.popleft()
+                if recent.get(key) == seen:
+                    del recent[key]
+            routed[station.name].append(row)
+        return routed
+
+    def parse_batch(self, rows):
+        # parses the rows of the sensor table and returns the (station,
+        # packets) of all stations
+        routed = self.route(rows)
+        for (connection, process, names) in self.workers:
+            connection.send(('parse', dict((name, routed[name]) for name in names if routed[name])))
+        packets = dict((name, _parse_station(parser, routed[name], self.binary))
+                       for (name, parser) in self.parsers.items())
+        for (connection, process, names) in self.workers:
+            packets.update(self._result(connection))
+        return [(station, packets.get(station.name, [])) for station in self.stations]
+
+    def pop_crc_failures(self):
+        # the crc failures by header nibble since the last call
+        failures = {}
+        counts = [parser.crc_failures for parser in self.parsers.values()]
+        for worker_counts in self._request('crc_failures'):
+            counts.extend(worker_counts)
+        for sensor_counts in counts:
+            for (sensor, count) in sensor_counts.items():
+                failures[sensor] = failures.get(sensor, 0) + count
+        for parser in self.parsers.values():
+            parser.crc_failures = {}
+        return failures
+
+    def get_state(self):
+        # the states of all parsers as a json compatible dict
+        states = dict((name, parser.get_state()) for (name, parser) in self.parsers.items())
+        for worker_states in self._request('get_state'):
+            states.update(worker_states)
+        return {'version': StationParser.STATE_VERSION, 'stations': states}
+
+    def set_state(self, state):
+        # restores a state from get_state(), raises ValueError if it does
+        # not fit the stations
+        if state.get('version') != StationParser.STATE_VERSION:
+            raise ValueError("unknown state version %s" % state.get('version'))
+        states = state.get('stations')
+        if not isinstance(states, dict):
+            raise ValueError("no station states")
+        for station in self.stations:
+            if station.name not in states:
+                raise ValueError("no state of station %s" % station.name)
+        for (name, parser) in self.parsers.items():
+            parser.set_state(states[name])
+        self._request('set_state', [dict((name, states[name]) for name in names)
+                                    for (connection, process, names) in self.workers])
+
+    def close(self):
+        for (connection, process, names) in self.workers:
+            connection.send(None)
+            connection.close()
+            process.join(10)
+        self.workers = []
+
+class SensorNotifier(object):
+    """Decides when the driver queries the sensor table again.
+
+    A packet is complete with the first A or B frame of the next minute. If
+    the datalogger ingest signals its inserts on the unix datagram socket
+    at path (see user.vueiss_store.notify_sensor), the driver wakes up as
+    soon as such a frame arrives. Without notifications, or if they stop,
+    it polls shortly after each minute boundary and then every poll_delay
+    seconds, backing off to poll_interval, until the packet of the new
+    minute has been emitted.
+    """
+
+    def __init__(self, path=None, poll_interval=15.0, poll_delay=2.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.poll_delay = poll_delay
+        self.retry = poll_delay
+        self.sock = None
+        if path:
+            if os.path.exists(path):
+                os.unlink(path)
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.bind(path)
+            os.chmod(path, 0666)
+            self.sock.setblocking(0)
+            logmsg("Waiting for notifications on %s" % path)
+
+    def next_poll(self, packet_time, now):
+        # returns the time of the next poll, packet_time is the minute of the
+        # last emitted packet
+        minute = now - now % 60
+        if packet_time is not None and packet_time >= minute:
+            self.retry = self.poll_delay
+            return minute + 60 + self.poll_delay
+        retry = self.retry
+        self.retry = min(2 * self.retry, self.poll_interval)
+        return now + retry
+
+    def wait(self, packet_time):
+        # waits for a notification of an A or B frame or until the next poll
+        deadline = self.next_poll(packet_time, time.time())
+        while True:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                return False
+            if self.sock is None:
+                time.sleep(timeout)
+                return False
+            readable, _, _ = select.select([self.sock], [], [], timeout)
+            if readable and self._drain():
+                return True
+
+    def _drain(self):
+        # reads all pending notifications, returns True if a frame which
+        # completes a packet was stored
+        complete = False
+        while True:
+            try:
+                data = self.sock.recv(128)
+            except socket.error:
+                return complete
+            if data[:1] in ('A', 'B'):
+                complete = True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+class PacketReplay(object):
+    """Regenerates the packets of a time range from the sensor frames.
+
+    The frames are parsed by a new StationParser, starting with a warm-up
+    before the range. The floating averages span packets, not minutes, so
+    the warm-up is doubled until it holds enough packets to fill them. The
+    packets are then the same as the driver produced. frames counts the
+    parsed frames. With a station of the registry only its frames are
+    parsed, with its windows and altitude.
+
+    rollup is the store of the table sensor_rollup, into which wee_vueiss
+    --prune rolls up the expired months. Its frames are parsed before the
+    oldest frame of store, so the pruned months still give their packets,
+    with the means of each minute. The rollups mix all receivers, they are
+    not used for a station of the registry.
+    """
+
+    def __init__(self, store, windows, altitude=ALTITUDE, station=None, rollup=None):
+        self.store = store
+        self.windows = station.windows if station is not None else windows
+        self.altitude = station.altitude if station is not None else altitude
+        self.station = station
+        self.rollup = rollup if station is None else None
+        self.frames = 0
+
+    def get_first(self):
+        # the timestamp of the oldest frame (in ms), rolled up or not
+        first = self.store.get_first()
+        if self.rollup is not None:
+            rolled_up = self.rollup.get_first()
+            if rolled_up is not None and (first is None or rolled_up < first):
+                return rolled_up
+        return first
+
+    def packets(self, start, stop, oldest=None):
+        # yields the packets with dateTime in start..stop (in ms, stop
+        # excluded), oldest is the timestamp of the oldest frame
+        if oldest is None:
+            oldest = self.get_first()
+            if oldest is None:
+                return
+        warm_up = 60000 * (warm_up_minutes(self.windows) + 1)
+        while True:
+            warm_up_packets = 0
+            restart = False
+            for packet in self._parse(max(start - warm_up, oldest) - 1, stop - 1):
+                if packet['dateTime'] * 1000 < start:
+                    warm_up_packets += 1
+                    continue
+                if warm_up_packets <= max(self.windows) and start - warm_up > oldest:
+                    restart = True
+                    break
+                # checked once, before the first packet of the range
+                warm_up_packets = max(self.windows) + 1
+                if packet['dateTime'] * 1000 < stop:
+                    yield packet
+            if not restart:
+                return
+            warm_up *= 2
+
+    def _streams(self, after, stop):
+        # the (binary, rows) of the frames after..stop, the rolled up ones
+        # up to the oldest frame of the store first
+        if self.rollup is not None:
+            first = self.store.get_first()
+            split = min(stop, first - 1) if first is not None else stop
+            if after < split:
+                yield False, self.rollup.stream_frames(after, split)
+                after = split
+        yield self.store.binary, self.store.stream_frames(after, stop)
+
+    def _parse(self, after, stop):
+        # yields the packets of the frames after..stop in batches
+        if self.station is not None:
+            parser = StationRegistry([self.station], self.store.binary, bool(self.store.receiver_column))
+        else:
+            parser = StationParser(*self.windows, altitude=self.altitude)
+        for (binary, rows) in self._streams(after, stop):
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == 5000:
+                    for packet in self._parse_batch(parser, batch, binary):
+                        yield packet
+                    batch = []
+            for packet in self._parse_batch(parser, batch, binary):
+                yield packet
+
+    def _parse_batch(self, parser, rows, binary):
+        self.frames += len(rows)
+        if not rows:
+            return []
+        if self.station is not None:
+            return parser.parse_batch(rows)[0][1]
+        if binary:
+            return parser.parse_batch_binary(rows)
+        return parser.parse_batch(rows)
 
 DRIVER_NAME = 'VueISS'
 DRIVER_VERSION = "2.3"
@@ -446,59 +1655,402 @@ class VueISS(weewx.drivers.AbstractDevice):
         """Initialize the station        
         """
 
-        self.parser = StationParser()
+        stn_dict = config_dict.get(DRIVER_NAME, {})
+        binary = stn_dict.get('sensor_format', 'text') == 'binary'
+        receiver_column = stn_dict.get('receiver_column')
+
+        # with several stations the first one is this driver's, the packets
+        # of the others are archived to their bindings
+        stations = get_stations(stn_dict)
+        if stations:
+            self.registry = StationRegistry(stations, binary, bool(receiver_column),
+                                            dedupe_window=1000 * float(stn_dict.get('dedupe_window', 2)),
+                                            workers=int(stn_dict.get('workers', 0)))
+            self.parser = self.registry.parser
+            logmsg("Parsing stations %s" % ', '.join(station.name for station in stations))
+        else:
+            self.registry = None
+            windows = [int(stn_dict.get(option, default)) for (option, default) in WINDOW_OPTIONS]
+            self.parser = StationParser(*windows, altitude=float(stn_dict.get('altitude', ALTITUDE)))
+        # the records of several minutes rolled up from the packets
+        self.rollups = get_rollups(stn_dict)
+        # the archive managers of the other stations and the rollups by
+        # binding
+        self.managers = {}
+        self.batch_parsing = weeutil.weeutil.to_bool(stn_dict.get('batch_parsing', False))
+        self.catchup_span = 1000 * int(stn_dict.get('catchup_span', 3600))
+        self.checkpoint_interval = float(stn_dict.get('checkpoint_interval', 60))
+        self.checkpoint_packets = int(stn_dict.get('checkpoint_packets', 10))
+        self.checkpoint_time = time.time()
+        self.pending_packets = 0
+        self.pending_frames = 0
+        self.parse_time = 0.0
+        self.parse_frames = 0
+        self.notifier = SensorNotifier(stn_dict.get('notify_socket'),
+                                       poll_interval=float(stn_dict.get('poll_interval', 15.0)),
+                                       poll_delay=float(stn_dict.get('poll_delay', 2.0)))
 
         self.config_dict = config_dict
 
         self.the_time = 0
         self.old_time = 0
 
-        self.packets = Queue.Queue()
-
-        with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as dbmanager:
-            with weedb.Transaction(dbmanager.connection) as cursor:
-                cursor.execute("SELECT dateTime FROM last_sensor") 
-                for row in cursor:
-                   self.the_time = int(row[0])
-
-                DELTA = 600000
-                if self.the_time - DELTA >= 0:
-                    cursor.execute("SELECT dateTime,data FROM sensor WHERE dateTime>=%d AND dateTime<=%d ORDER BY dateTime ASC LIMIT 500" % (self.the_time - DELTA, self.the_time))
-                    for (data_time, strdata) in cursor:
-                        data = strdata.split()
-                        self.parser.parse(data, data_time/1000)
-
-                logmsg("Starting with %d" % (self.the_time/1000))
+        # the newest packets for genArchiveRecords, older ones are replayed
+        # from the frames; dropped_time is the newest packet not kept
+        self.packets = collections.deque(maxlen=int(stn_dict.get('archive_buffer', 60)))
+
+        # the parsed packets of a batch not yet taken by the engine, the
+        # parser state and the_time are already at the end of the batch
+        self.queue = collections.deque()
+
+        # timers and counters, logged and exported every stats_interval
+        self.metrics = user.metrics.Metrics('vueiss', interval=float(stn_dict.get('stats_interval', 300)),
+                                            path=stn_dict.get('stats_file'))
+
+        self.store = user.vueiss_store.SensorStore(self.config_dict, binary=binary, metrics=self.metrics,
+                                                   receiver_column=receiver_column)
+        self.archive_store = user.vueiss_store.SensorStore(self.config_dict, binary=binary,
+                                                           receiver_column=receiver_column)
+        # the frames of the expired months, for archive records older than
+        # the sensor table
+        self.expired_store = user.vueiss_store.SensorStore(self.config_dict, table='sensor_rollup')
+        self.the_time, state = self.store.get_checkpoint()
+        self.old_time = self.the_time
+        self.dropped_time = self.the_time/1000
+
+        if not self._restore(state):
+            # replay the frames of the longest window, before the open
+            # interval of the longest rollup
+            minutes = warm_up_minutes(self.parser.windows) + max([0] + [rollup.interval // 60
+                                                                        for rollup in self.rollups])
+            DELTA = 60000 * (minutes + 1)
+            if self.the_time - DELTA >= 0:
+                rows = self.store.stream_frames(self.the_time - DELTA, self.the_time)
+                if self.registry is not None:
+                    packets = self.registry.parse_batch(list(rows))[0][1]
+                else:
+                    packets = []
+                    for row in rows:
+                        values = self._parse_row(row)
+                        if values:
+                            packets.append(values)
+                # the rollups get the open interval again, the records
+                # completed up to the checkpoint were written with it
+                for values in packets:
+                    packet = {'usUnits' : weewx.METRICWX }
+                    packet.update(values)
+                    for rollup in self.rollups:
+                        rollup.add(packet)
+                for rollup in self.rollups:
+                    rollup.pop_records()
+
+        logmsg("Starting with %d" % (self.the_time/1000))
+
+    def _restore(self, state):
+        # restores the parser from the snapshot of the checkpoint
+        if not state:
+            logmsg("No parser snapshot, replaying frames")
+            return False
+        try:
+            state = json.loads(state)
+            if state.get('checkpoint') != self.the_time:
+                raise ValueError("snapshot of %s is stale" % state.get('checkpoint'))
+            (self.registry or self.parser).set_state(state)
+            rollups = state.get('rollups', {})
+            for rollup in self.rollups:
+                if rollup.name in rollups:
+                    rollup.set_state(rollups[rollup.name])
+        except ValueError, e:
+            logmsg("Ignoring parser snapshot (%s), replaying frames" % e)
+            for rollup in self.rollups:
+                rollup.reset()
+            if self.registry is not None:
+                self.registry.reset()
+                self.parser = self.registry.parser
+            else:
+                self.parser = self.parser.__class__(*self.parser.windows, altitude=self.parser.altitude)
+            return False
+        logmsg("Restored parser snapshot")
+        return True
 
     def genLoopPackets(self):
 
         while True:
-            with weewx.manager.open_manager_with_config(self.config_dict, 'wx_binding') as dbmanager:
-                with weedb.Transaction(dbmanager.connection) as cursor:
-                    cursor.execute("SELECT dateTime,data FROM sensor WHERE dateTime>%d ORDER BY dateTime ASC LIMIT 5000" % (self.the_time))
-                    for (self.the_time, strdata) in cursor:
-                        data = strdata.split()
-                        values = self.parser.parse(data, self.the_time/1000)
-                        if values:
-                            packet = {'usUnits' : weewx.METRICWX }
-                            packet.update(values)
-                            self.packets.put(packet)
-                            logmsg("Yield packet (%d)" % (self.the_time/1000))
-                            yield packet
-
-                    if self.old_time != self.the_time:
-                        self.old_time = self.the_time
-                        logmsg("Remember last timestamp %d" % (self.old_time))
-                        cursor.execute("UPDATE last_sensor SET dateTime=%d" % (self.old_time))
-
-            time.sleep(15.0)
+            # the packets of a batch left when the engine closed the
+            # generator, the frames after the_time are not parsed yet
+            if self.queue:
+                for packet in self._drain():
+                    yield packet
+                self._checkpoint(time.time())
+            rows = self.store.get_frames(self.the_time, 5000)
+            self.metrics.observe('rows_per_cycle', len(rows))
+            for packet in self._parse_rows(rows):
+                yield packet
+            self._checkpoint(time.time())
+            self._report(time.time())
+
+            # a full batch means there is a backlog
+            if len(rows) < 5000:
+                self.notifier.wait(self.parser.packet_time)
+            else:
+                for packet in self._catch_up():
+                    yield packet
+
+    def _catch_up(self):
+        # streams the backlog in windows of catchup_span without sleeping,
+        # until the driver is less than a minute behind the newest frame
+        head = self.store.get_head()
+        logmsg("Catching up from %d to %d" % (self.the_time/1000, head/1000))
+        retried = False
+        while head - self.the_time > 60000:
+            stop = min(self.the_time + self.catchup_span, head)
+            try:
+                # no checkpoints while the window is streamed on the connection
+                for packet in self._parse_rows(self.store.stream_frames(self.the_time, stop), False):
+                    yield packet
+            except weedb.OperationalError, e:
+                # reconnect once and continue after the last parsed frame,
+                # the packet of that frame was queued by _parse_rows
+                self.store.close()
+                if retried:
+                    raise
+                logmsg("Reconnecting to sensor database: %s" % e)
+                retried = True
+                for packet in self._drain():
+                    yield packet
+                continue
+            retried = False
+            self.the_time = stop
+            self._checkpoint(time.time())
+            self._report(time.time())
+            if self.the_time >= head:
+                head = self.store.get_head()
+        logmsg("Caught up at %d" % (self.the_time/1000))
+
+    def _parse_rows(self, rows, checkpoints=True):
+        # parses the (dateTime, data) rows and yields the packets, the rows
+        # of several stations always in batches
+        if self.batch_parsing or self.registry is not None:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == 5000:
+                    for packet in self._parse_batch(batch, checkpoints):
+                        yield packet
+                    batch = []
+            for packet in self._parse_batch(batch, checkpoints):
+                yield packet
+        else:
+            packet = None
+            try:
+                for row in rows:
+                    # a packet is yielded once the rows of the ms of its
+                    # frame are parsed, the next query starts after that ms
+                    if packet and row[0] != self.the_time:
+                        yield self._emit(packet)
+                        packet = None
+                        # the packet is processed when the engine asks for
+                        # the next one, the parser state still ends at its
+                        # frame
+                        if checkpoints:
+                            self._checkpoint(time.time())
+                    self.the_time = row[0]
+                    self.pending_frames += 1
+                    start = time.time()
+                    values = self._parse_row(row)
+                    self.parse_time += time.time() - start
+                    self.parse_frames += 1
+                    if values:
+                        packet = values
+            except weedb.OperationalError:
+                # the parser state is at the_time already, the packet is
+                # queued for the next query after the_time
+                if packet:
+                    self.queue.append(packet)
+                raise
+            if packet:
+                yield self._emit(packet)
+                if checkpoints:
+                    self._checkpoint(time.time())
+
+    def _parse_row(self, row):
+        if self.store.binary:
+            return self.parser.parse_binary(row[1], row[2], row[3], row[0]/1000, row[0])
+        return self.parser.parse(row[1].split() if row[1] else None, row[0]/1000, row[0])
+
+    def _parse_batch(self, rows, checkpoints):
+        self.pending_frames += len(rows)
+        start = time.time()
+        if self.registry is not None:
+            station_packets = self.registry.parse_batch(rows)
+            packets = station_packets[0][1]
+        elif self.store.binary:
+            packets = self.parser.parse_batch_binary(rows)
+        else:
+            packets = self.parser.parse_batch(rows)
+        self.parse_time += time.time() - start
+        self.parse_frames += len(rows)
+        if self.registry is not None:
+            for (station, other_packets) in station_packets[1:]:
+                self._archive(station, other_packets)
+        # the parser has taken all rows; the engine may close the generator
+        # after any packet, the rest is yielded by the next genLoopPackets
+        if rows:
+            self.the_time = rows[-1][0]
+        self.queue.extend(packets)
+        for packet in self._drain():
+            yield packet
+        if rows and checkpoints:
+            self._checkpoint(time.time())
+
+    def _checkpoint(self, now):
+        # group commit of the checkpoint and the parser snapshot, once
+        # checkpoint_packets packets were processed or checkpoint_interval
+        # seconds passed; only called where the parser state ends exactly
+        # at the_time, so a restart neither skips nor repeats rain ticks
+        if self.old_time == self.the_time:
+            return
+        # the snapshot is at the end of the batch, the queued packets would
+        # be lost by a restart from it
+        if self.queue:
+            return
+        if self.pending_packets < self.checkpoint_packets and now - self.checkpoint_time < self.checkpoint_interval:
+            return
+        logmsg("Remember last timestamp %d (%d packets, %d frames)" %
+               (self.the_time, self.pending_packets, self.pending_frames))
+        # the completed rollup records go first, after a crash they are
+        # added again and rejected as duplicates
+        self._write_rollups()
+        state = (self.registry or self.parser).get_state()
+        state['checkpoint'] = self.the_time
+        if self.rollups:
+            state['rollups'] = dict((rollup.name, rollup.get_state()) for rollup in self.rollups)
+        self.store.set_checkpoint(self.the_time, json.dumps(state, separators=(',', ':')))
+        self.old_time = self.the_time
+        self.checkpoint_time = now
+        self.pending_packets = 0
+        self.pending_frames = 0
+
+    def _report(self, now):
+        # moves the parser's counters into the metrics, reports them once
+        # per stats_interval
+        metrics = self.metrics
+        if self.parse_frames:
+            metrics.add('frames_total', self.parse_frames)
+            metrics.add('parse_seconds_total', self.parse_time)
+            metrics.set('parse_seconds_per_frame', self.parse_time / self.parse_frames)
+            self.parse_time = 0.0
+            self.parse_frames = 0
+        if self.registry is not None:
+            crc_failures = self.registry.pop_crc_failures()
+        else:
+            crc_failures = dict(self.parser.crc_failures)
+            self.parser.crc_failures.clear()
+        for sensor, count in crc_failures.items():
+            metrics.add('crc_failures_total', count, sensor=_SENSOR_IDS.get(sensor, '%X' % sensor))
+        if self.registry is not None:
+            metrics.set('duplicate_frames', self.registry.duplicates)
+            metrics.set('unrouted_frames', self.registry.unrouted)
+        metrics.set('lag_seconds', now - self.the_time / 1000.0)
+        metrics.set('queue_depth', len(self.packets))
+        metrics.set('db_connects', self.store.connects)
+        metrics.set('db_queries', self.store.queries)
+        metrics.report(now, logmsg)
+
+    # work a crash would replay: packets and frames after the checkpoint and
+    # the seconds of frames they span
+    @property
+    def replay_exposure(self):
+        return {'packets': self.pending_packets, 'frames': self.pending_frames,
+                'seconds': (self.the_time - self.old_time) / 1000.0}
+
+    def _drain(self):
+        # yields the queued packets, each one leaves the queue before the
+        # engine gets it
+        while self.queue:
+            yield self._emit(self.queue.popleft())
+
+    def _emit(self, values):
+        packet = {'usUnits' : weewx.METRICWX }
+        packet.update(values)
+        self.pending_packets += 1
+        self.metrics.add('packets_total')
+        for rollup in self.rollups:
+            rollup.add(packet)
+        if len(self.packets) == self.packets.maxlen:
+            self.dropped_time = self.packets[0]['dateTime']
+        self.packets.append(packet)
+        logmsg("Yield packet (%d)" % (packet['dateTime']))
+        return packet
+
+    def _archive(self, station, packets):
+        # adds the packets of another station to the archive of its binding
+        if not packets or station.binding is None:
+            return
+        manager = self._manager(station.binding)
+        records = []
+        for values in packets:
+            record = {'usUnits' : weewx.METRICWX, 'interval': 1}
+            record.update(values)
+            records.append(record)
+        manager.addRecord(records)
+        self.metrics.add('station_packets_total', len(records), station=station.name)
+
+    def _write_rollups(self):
+        # adds the completed records of the rollups to their bindings, in
+        # one call per binding
+        for rollup in self.rollups:
+            records = rollup.pop_records()
+            if records:
+                self._manager(rollup.binding).addRecord(records)
+                self.metrics.add('rollup_records_total', len(records), rollup=rollup.name)
+
+    def _manager(self, binding):
+        manager = self.managers.get(binding)
+        if manager is None:
+            manager = weewx.manager.open_manager_with_config(self.config_dict, binding, initialize=True)
+            self.managers[binding] = manager
+        return manager
+
+    def closePort(self):
+        self._write_rollups()
+        self.notifier.close()
+        self.store.close()
+        self.archive_store.close()
+        self.expired_store.close()
+        if self.registry is not None:
+            self.registry.close()
+        for manager in self.managers.values():
+            manager.close()
+        self.managers = {}
+
+    # connection setups and query round trips of the sensor store
+    @property
+    def db_stats(self):
+        return {'connects': self.store.connects, 'queries': self.store.queries}
 
     def genArchiveRecords(self, lastgood_ts):
-        while not self.packets.empty():
-            packet = self.packets.get()
-            if packet['dateTime'] > lastgood_ts:
-                packet['interval'] = 1
-                yield packet
+        packets = list(self.packets)
+        if lastgood_ts is not None and lastgood_ts < self.dropped_time:
+            # the packets after lastgood_ts are no longer buffered, they are
+            # regenerated from the frames up to the oldest buffered one
+            stop = 1000 * packets[0]['dateTime'] if packets else self.the_time + 1
+            logmsg("Replaying archive records from %d to %d" % (lastgood_ts, stop/1000))
+            replay = PacketReplay(self.archive_store, self.parser.windows, self.parser.altitude,
+                                  self.registry.stations[0] if self.registry is not None else None,
+                                  self.expired_store)
+            for values in replay.packets(1000 * (lastgood_ts + 1), stop):
+                record = {'usUnits' : weewx.METRICWX, 'interval': 1}
+                record.update(values)
+                yield record
+            self.archive_store.close()
+            self.expired_store.close()
+
+        for packet in packets:
+            if lastgood_ts is None or packet['dateTime'] > lastgood_ts:
+                record = dict(packet)
+                record['interval'] = 1
+                yield record
 
     @property
     def hardware_name(self):
@@ -524,6 +2076,92 @@ class VueISSConfEditor(weewx.drivers.AbstractConfEditor):
 
     # The driver to use:
     driver = user.drivers.vueiss
+
+    # Length of the floating averages (in minutes)
+    barometer_window = 10
+    wind_window = 10
+    temperature_window = 5
+    humidity_window = 5
+
+    # Altitude of the barometer (in m)
+    altitude = 310.8
+
+    # Decode the frames of a query in one vectorized batch
+    batch_parsing = false
+
+    # Read the frames from the text table sensor (text) or from the packed
+    # table sensor_frame (binary), see wee_vueiss --migrate-binary
+    sensor_format = text
+
+    # The sensor tables are in the database of wx_binding: in MySQL created
+    # by db/init.sql, in SQLite (archive_sqlite) created by the driver in
+    # WAL mode. wee_vueiss --ingest stores the frames of the datalogger.
+
+    # Unix datagram socket on which the datalogger signals new frames,
+    # without it the driver polls after each minute boundary
+    #notify_socket = /var/run/weewx-vueiss.sock
+
+    # Polling after a minute boundary (in seconds)
+    poll_delay = 2
+    poll_interval = 15
+
+    # Seconds of frames per query while catching up a backlog
+    catchup_span = 3600
+
+    # Write the checkpoint at most every checkpoint_interval seconds or
+    # after checkpoint_packets packets, whichever comes first
+    checkpoint_interval = 60
+    checkpoint_packets = 10
+
+    # Newest packets kept for the archive records, older records are
+    # regenerated from the frames
+    archive_buffer = 60
+
+    # Log the timers and counters every stats_interval seconds and write
+    # them to stats_file in the Prometheus text format
+    stats_interval = 300
+    #stats_file = /var/lib/prometheus/node-exporter/vueiss.prom
+
+    # Months of frames kept by wee_vueiss --prune in the partitioned sensor
+    # table, expired months are rolled up into sensor_rollup first
+    retention_months = 12
+    rollup_expired = true
+
+    # Several ISS in one driver: the stations by name with the id set on
+    # their transmitter (1-8) and the receivers hearing them, the first
+    # receiver supplies the barometer. The receiver of a frame is read from
+    # receiver_column of the sensor tables, without it all frames are from
+    # receiver 0. The first station feeds weewx, the packets of the others
+    # are archived to their binding. Frames of a station heard again within
+    # dedupe_window seconds are dropped. The stations after the first one
+    # can be parsed by workers processes, e.g. one less than the cpus, by
+    # default they are parsed in this process.
+    #receiver_column = receiver
+    #dedupe_window = 2
+    #workers = 3
+    #[[stations]]
+    #    [[[home]]]
+    #        transmitter = 1
+    #        receivers = 0, 1
+    #    [[[field]]]
+    #        transmitter = 2
+    #        receivers = 1
+    #        altitude = 452.0
+    #        wind_window = 2
+    #        binding = field_binding
+
+    # Records of several minutes rolled up from the packets, with the
+    # averages, the minimum and maximum, the sum of rain, the vector mean of
+    # the wind and the number of packets, e.g. for the charts. They are
+    # written in bulk with the checkpoints to bindings of their own, whose
+    # schema is user.rollup.schema.
+    #[[rollups]]
+    #    [[[five_minutes]]]
+    #        interval = 300
+    #        binding = wx5_binding
+    #    [[[hour]]]
+    #        interval = 3600
+    #        binding = wx60_binding
 """
 
 if __name__ == "__main__":
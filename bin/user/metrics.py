@@ -0,0 +1,143 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Counters, gauges and summaries of the VueISS driver and the uploaders
+
+The metrics are kept in memory, logged as one summary line and exported in
+the Prometheus text format, e.g. into the directory of the textfile
+collector of the node exporter. Each process part writes a file of its
+own, the file is replaced atomically.
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+class Metrics(object):
+    """Metrics with a common name prefix.
+
+    Counters only grow. Gauges hold the last value. Summaries hold the
+    count, the sum and the maximum of observed values, the maximum starts
+    over with every report. Labels are given as keyword arguments. The
+    metrics may be updated from several threads.
+    """
+
+    def __init__(self, prefix, interval=300, path=None):
+        self.prefix = prefix
+        self.interval = interval
+        self.path = path
+        self.counters = {}
+        self.gauges = {}
+        self.summaries = {}
+        self.report_time = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            summary = self.summaries.get(key)
+            if summary is None:
+                self.summaries[key] = [1, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                if value > summary[2]:
+                    summary[2] = value
+
+    def summary(self):
+        # one line with all metrics, summaries as mean/max
+        values = []
+        for (name, labels), value in sorted(self.counters.items()):
+            values.append('%s=%s' % (_key(name, labels), _number(value)))
+        for (name, labels), value in sorted(self.gauges.items()):
+            values.append('%s=%s' % (_key(name, labels), _number(value)))
+        for (name, labels), (count, total, maximum) in sorted(self.summaries.items()):
+            values.append('%s=%s/%s' % (_key(name, labels), _number(total / count), _number(maximum)))
+        return ' '.join(values)
+
+    def prometheus(self):
+        # the metrics in the Prometheus text format
+        lines = []
+        for (kind, metrics) in (('counter', self.counters), ('gauge', self.gauges)):
+            for name in sorted(set(name for (name, labels) in metrics)):
+                lines.append('# TYPE %s_%s %s' % (self.prefix, name, kind))
+                for (key, value) in sorted(metrics.items()):
+                    if key[0] == name:
+                        lines.append('%s_%s%s %s' % (self.prefix, name, _labels(key[1]), _number(value)))
+        for name in sorted(set(name for (name, labels) in self.summaries)):
+            lines.append('# TYPE %s_%s summary' % (self.prefix, name))
+            for (key, (count, total, maximum)) in sorted(self.summaries.items()):
+                if key[0] == name:
+                    labels = _labels(key[1])
+                    lines.append('%s_%s_count%s %d' % (self.prefix, name, labels, count))
+                    lines.append('%s_%s_sum%s %s' % (self.prefix, name, labels, _number(total)))
+            lines.append('# TYPE %s_%s_max gauge' % (self.prefix, name))
+            for (key, (count, total, maximum)) in sorted(self.summaries.items()):
+                if key[0] == name:
+                    lines.append('%s_%s_max%s %s' % (self.prefix, name, _labels(key[1]), _number(maximum)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, text=None):
+        # replaces the file path with the Prometheus text
+        if text is None:
+            text = self.prometheus()
+        (fd, tmp_path) = tempfile.mkstemp(prefix='.%s' % os.path.basename(path), dir=os.path.dirname(path) or '.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(text)
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    def report(self, now, log):
+        # logs the summary line and writes the file once per interval,
+        # returns True if it did
+        if now - self.report_time < self.interval:
+            return False
+        self.report_time = now
+        with self.lock:
+            line = self.summary()
+            text = self.prometheus()
+            for summary in self.summaries.values():
+                summary[2] = 0
+        log(line)
+        if self.path:
+            try:
+                self.write(self.path, text)
+            except (IOError, OSError), e:
+                log("Cannot write metrics to %s: %s" % (self.path, e))
+        return True
+
+def _key(name, labels):
+    if not labels:
+        return name
+    return '%s[%s]' % (name, ','.join(str(value) for (label, value) in labels))
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for (label, value) in labels)
+
+def _number(value):
+    if isinstance(value, float):
+        return '%.6g' % value
+    return str(value)
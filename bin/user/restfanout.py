@@ -0,0 +1,262 @@
+"""
+Post the archive records to several REST uploaders from one thread pool
+
+Each archive record is enriched from the database and converted to the
+unit system of an uploader once, the result is cached by dateTime and
+shared by all uploaders. The uploaders only format their fields with a
+precompiled FieldEncoder and post; the posts of all of them run in one
+pool of worker threads.
+
+The uploaders keep their own sections, enable them here instead of as
+restful_services of their own:
+
+[StdRESTful]
+    [[FanOut]]
+        enable = true | false
+        # the uploaders, each configured in its section of StdRESTful
+        targets = Wetter,
+        # the threads posting the records of all uploaders
+        workers = 4
+        # cache counters, logged every stats_interval seconds and written in
+        # the Prometheus text format to stats_file
+        stats_interval = 300
+        stats_file = /var/lib/prometheus/node-exporter/fanout.prom
+
+An uploader is a RESTThread with the methods select, enqueue, post_item,
+backing_off, commit and close, see WetterThread; its class is registered in
+TARGETS.
+"""
+
+import collections
+import Queue
+import syslog
+import threading
+import time
+
+import weewx.manager
+import weewx.restx
+import weewx.units
+from weeutil.weeutil import option_as_list
+
+import user.metrics
+
+# the uploader classes by the name of their section
+TARGETS = {'Wetter': 'user.wetter.WetterThread'}
+
+def logmsg(level, msg):
+    syslog.syslog(level, 'restx: FanOut: %s' % msg)
+
+def loginf(msg):
+    logmsg(syslog.LOG_INFO, msg)
+
+def logerr(msg):
+    logmsg(syslog.LOG_ERR, msg)
+
+def get_backlog(queue):
+    # waits for a record and returns it with all records already queued,
+    # None ends the list
+    records = [queue.get()]
+    while records[-1] is not None:
+        try:
+            records.append(queue.get_nowait())
+        except Queue.Empty:
+            break
+    return records
+
+class FieldEncoder(object):
+    """Formats the fields of a record.
+
+    data_map maps the name of each value to a tuple of the record field and
+    its format. The map is compiled into a tuple once, encode looks each
+    field up once and skips the missing ones.
+    """
+
+    def __init__(self, data_map):
+        self.fields = tuple(sorted((field, name, fmt) for (name, (field, fmt)) in data_map.items()))
+
+    def encode(self, record, values=None):
+        # adds the formatted fields of the record to values
+        if values is None:
+            values = {}
+        get = record.get
+        for (field, name, fmt) in self.fields:
+            value = get(field)
+            if value is not None:
+                values[name] = fmt % value
+        return values
+
+class RecordCache(object):
+    """The last size values by key, the oldest one is evicted first"""
+
+    def __init__(self, size=32):
+        self.size = size
+        self.values = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, make):
+        # the value of key, made by make() if it is not cached
+        try:
+            value = self.values[key]
+            self.hits += 1
+            return value
+        except KeyError:
+            self.misses += 1
+        value = self.values[key] = make()
+        if len(self.values) > self.size:
+            self.values.popitem(last=False)
+        return value
+
+def load_target(name):
+    module_name, class_name = TARGETS[name].rsplit('.', 1)
+    module = __import__(module_name, fromlist=[class_name])
+    return getattr(module, class_name)
+
+class FanOut(weewx.restx.StdRESTful):
+    def __init__(self, engine, config_dict):
+        super(FanOut, self).__init__(engine, config_dict)
+        site_dict = weewx.restx.check_enable(config_dict, 'FanOut')
+        if site_dict is None:
+            return
+
+        manager_dict = weewx.manager.get_manager_dict_from_config(config_dict, 'wx_binding')
+        targets = []
+        for name in option_as_list(site_dict.pop('targets', [])):
+            if name not in TARGETS:
+                logerr("Unknown target %s" % name)
+                continue
+            target_dict = weewx.restx.check_enable(config_dict, name)
+            if target_dict is None:
+                continue
+            target_dict['manager_dict'] = manager_dict
+            targets.append(load_target(name)(None, **target_dict))
+            loginf("Data will be uploaded to %s" % name)
+        if not targets:
+            return
+
+        self.archive_queue = Queue.Queue()
+        self.archive_thread = FanOutThread(self.archive_queue, targets, manager_dict,
+                                           workers=site_dict.get('workers', 4),
+                                           stats_interval=site_dict.get('stats_interval', 300),
+                                           stats_file=site_dict.get('stats_file'))
+        self.archive_thread.start()
+        self.bind(weewx.NEW_ARCHIVE_RECORD, self.new_archive_record)
+
+    def new_archive_record(self, event):
+        self.archive_queue.put(event.record)
+
+class FanOutThread(weewx.restx.RESTThread):
+    """Enriches and converts the records once and posts them to the
+    targets in a pool of workers threads.
+
+    A target that failed to log in is skipped for an hour, the records of
+    its spool are posted after that. A target pausing after a failed post
+    keeps the records in its spool until the pause is over, its entries
+    still queued are skipped. The records are not held back by a slow
+    target: each target is committed by the worker that posted its last
+    entry, an entry still being posted is not queued again.
+    """
+
+    def __init__(self, queue, targets, manager_dict, workers=4,
+                 stats_interval=300, stats_file=None):
+        super(FanOutThread, self).__init__(queue,
+                                           protocol_name='FanOut',
+                                           manager_dict=manager_dict)
+        self.targets = targets
+        self.workers = max(int(workers), 1)
+        self.work = Queue.Queue()
+        # the time until which a target is skipped after a bad login
+        self.suspended = {}
+        # the keys of the queued entries by target; enqueue, the end of an
+        # entry and commit of a target hold the lock, so the keys of a
+        # spool are not renumbered while its entries are posted
+        self.posting = {}
+        self.lock = threading.Lock()
+        self.records = RecordCache()
+        self.converted = RecordCache()
+        self.metrics = user.metrics.Metrics('fanout', interval=float(stats_interval), path=stats_file)
+
+    def run_loop(self, dbmanager=None):
+        threads = [threading.Thread(target=self.post_work, name='FanOut-%d' % i)
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        records = []
+        try:
+            while True:
+                done = records and records[-1] is None
+                self.dispatch([record for record in records if record is not None], dbmanager)
+                if done:
+                    return
+                records = get_backlog(self.queue)
+        finally:
+            for thread in threads:
+                self.work.put(None)
+            for thread in threads:
+                thread.join()
+            for target in self.targets:
+                target.close()
+
+    def dispatch(self, records, dbmanager):
+        # queues the posts of the records to all targets
+        now = time.time()
+        targets = [target for target in self.targets if self.suspended.get(target, 0) <= now]
+        for target in targets:
+            converted = [self.get_converted(record, dbmanager, target.unit_system)
+                         for record in target.select(records)]
+            with self.lock:
+                posting = self.posting.setdefault(target, set())
+                entries = target.enqueue(converted)
+                if not target.backing_off(now):
+                    entries = [(key, entry) for (key, entry) in entries if key not in posting]
+                    posting.update(key for (key, entry) in entries)
+                    for (key, entry) in entries:
+                        self.work.put((target, key, entry))
+                if not posting:
+                    target.commit()
+        self.metrics.add('records_total', len(records))
+        self.metrics.set('cache_hits', self.records.hits + self.converted.hits)
+        self.metrics.set('cache_misses', self.records.misses + self.converted.misses)
+        self.metrics.report(time.time(), loginf)
+
+    def get_converted(self, record, dbmanager, unit_system):
+        # the record enriched from the database and converted to unit_system,
+        # each step is done once for all targets
+        def convert():
+            enriched = self.records.get(record['dateTime'], lambda: self.get_record(record, dbmanager))
+            return weewx.units.to_std_system(enriched, unit_system)
+        return self.converted.get((record['dateTime'], unit_system), convert)
+
+    def post_work(self):
+        # a worker thread, posts the items of work until it gets None
+        while True:
+            item = self.work.get()
+            if item is None:
+                break
+            (target, key, entry) = item
+            try:
+                now = time.time()
+                if self.suspended.get(target, 0) <= now and not target.backing_off(now):
+                    target.post_item(key, entry)
+            except weewx.restx.BadLogin, e:
+                logerr("Bad login for %s: %s; waiting 60 minutes then retrying" %
+                       (target.protocol_name, e))
+                self.suspended[target] = time.time() + 3600
+            except weewx.restx.FailedPost:
+                # logged by the target, which pauses its uploads
+                pass
+            except Exception, e:
+                logerr("Failed to post to %s: %s" % (target.protocol_name, e))
+            finally:
+                self.end_item(target, key)
+        for target in self.targets:
+            target.close_connection()
+
+    def end_item(self, target, key):
+        # commits the target once all its queued entries are done
+        with self.lock:
+            posting = self.posting[target]
+            posting.discard(key)
+            if not posting:
+                target.commit()
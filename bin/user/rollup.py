@@ -0,0 +1,173 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Records of several minutes rolled up from the packets of the driver
+
+A Rollup adds the one minute packets as they come and completes the record
+of an interval, e.g. of 5 minutes or an hour, with its last packet. The
+record has the average of an observation type, the sum of rain, the
+maximum of the gusts, the last hourRain and the direction of the vector
+mean of the wind, further the minimum and maximum of the types of
+HILO_TYPES as <type>Min and <type>Max, the speed of the vector mean as
+windVecAvg and the number of packets as packetCount. windDirStdDev, the
+deviation over the 10 minutes before a packet, is left out. Like an
+archive record of weewx it has the time of the end of its interval.
+
+The bindings of the records need the columns of schema, e.g.
+
+[DataBindings]
+    [[wx5_binding]]
+        database = archive_mysql
+        table_name = archive5
+        manager = weewx.manager.Manager
+        schema = user.rollup.schema
+"""
+
+import schemas.wview
+
+from user.daycache import DayStats
+
+# the types whose record has the sum, the maximum, the last value or the
+# vector direction, the other types have the average
+SUM_TYPES = ('rain',)
+MAX_TYPES = ('windGust', 'windGust3s')
+LAST_TYPES = ('hourRain',)
+# the types of the packets left out of the records
+OMIT_TYPES = ('windDirStdDev',)
+# the speed and direction types of the wind vectors
+VECTOR_TYPES = (('windSpeed', 'windDir'), ('windSpeed2', 'windDir2'), ('windSpeed10', 'windDir10'))
+# the types with a minimum and maximum in the record
+HILO_TYPES = ('barometer', 'outTemp', 'outHumidity', 'dewpoint', 'windSpeed', 'windGust')
+
+# the wview schema with the columns of the packets and the rollups
+_columns = set(name for (name, _) in schemas.wview.schema)
+schema = schemas.wview.schema + \
+    [(name, 'REAL') for name in ('windGust3s', 'windSpeed2', 'windDir2', 'windSpeed10', 'windDir10',
+                                 'windVecAvg', 'hourRain', 'rainRate5', 'rainRate15')
+     if name not in _columns] + \
+    [(name + suffix, 'REAL') for name in HILO_TYPES for suffix in ('Min', 'Max')] + \
+    [('packetCount', 'INTEGER')]
+
+class Rollup(object):
+    """The record of the current interval of interval seconds.
+
+    The completed records are kept in records until the driver writes them
+    to binding. get_state and set_state snapshot the record of the current
+    interval with the parser state of a checkpoint.
+    """
+
+    def __init__(self, name, interval, binding=None):
+        self.name = name
+        self.interval = interval
+        self.binding = binding
+        self.records = []
+        self.reset()
+
+    def reset(self):
+        self.last_time = None
+        self._clear()
+
+    def _clear(self):
+        # starts the record of the next interval
+        self.end = None
+        self.count = 0
+        self.unit_system = None
+        self.stats = {}
+        # the last values of LAST_TYPES
+        self.last = {}
+
+    def add(self, packet):
+        # adds the packet, a packet after the interval completes the record
+        # of a gap first
+        ts = packet['dateTime']
+        if self.last_time is not None and ts <= self.last_time:
+            return
+        end = ts - ts % self.interval
+        if end < ts:
+            end += self.interval
+        if self.end is not None and end != self.end:
+            self.complete()
+        self.end = end
+        self.last_time = ts
+        self.count += 1
+        self.unit_system = packet.get('usUnits')
+
+        for (obs_type, value) in packet.iteritems():
+            if obs_type in ('dateTime', 'usUnits', 'interval') or obs_type in OMIT_TYPES or \
+               not isinstance(value, (int, long, float)):
+                continue
+            if obs_type in LAST_TYPES:
+                self.last[obs_type] = value
+            stats = self._stats(obs_type)
+            stats.add_hilo(value, ts)
+            stats.add_sum(value, 1)
+        for (speed, direction) in VECTOR_TYPES:
+            if packet.get(speed) is not None and packet.get(direction) is not None:
+                self._stats(direction).add_vector(packet[speed], packet[direction], 1)
+        if ts == end:
+            self.complete()
+
+    def _stats(self, obs_type):
+        stats = self.stats.get(obs_type)
+        if stats is None:
+            stats = self.stats[obs_type] = DayStats()
+        return stats
+
+    def complete(self):
+        # completes the record of the current interval
+        if self.end is None:
+            return
+        record = {'dateTime': self.end, 'usUnits': self.unit_system, 'interval': self.interval // 60,
+                  'packetCount': self.count}
+        directions = [direction for (_, direction) in VECTOR_TYPES]
+        for (obs_type, stats) in self.stats.iteritems():
+            if obs_type in SUM_TYPES:
+                record[obs_type] = stats.sum
+            elif obs_type in MAX_TYPES:
+                record[obs_type] = stats.max
+            elif obs_type in LAST_TYPES:
+                record[obs_type] = self.last.get(obs_type)
+            elif obs_type in directions:
+                record[obs_type] = stats.get('vecdir')
+            else:
+                record[obs_type] = stats.get('avg')
+            if obs_type in HILO_TYPES:
+                record[obs_type + 'Min'] = stats.min
+                record[obs_type + 'Max'] = stats.max
+        if 'windDir' in self.stats:
+            record['windVecAvg'] = self.stats['windDir'].get('vecavg')
+        self.records.append(record)
+        self._clear()
+
+    def pop_records(self):
+        (records, self.records) = (self.records, [])
+        return records
+
+    def get_state(self):
+        return {'end': self.end, 'last_time': self.last_time, 'count': self.count,
+                'unit_system': self.unit_system, 'last': dict(self.last),
+                'stats': dict((obs_type, [getattr(stats, slot) for slot in DayStats.__slots__])
+                              for (obs_type, stats) in self.stats.iteritems())}
+
+    def set_state(self, state):
+        # restores a state from get_state(), raises ValueError if it is bad
+        self.reset()
+        try:
+            self.end = state['end']
+            self.last_time = state['last_time']
+            self.count = state['count']
+            self.unit_system = state['unit_system']
+            self.last = dict((str(obs_type), value) for (obs_type, value) in state.get('last', {}).iteritems())
+            for (obs_type, values) in state['stats'].iteritems():
+                stats = self._stats(str(obs_type))
+                for (slot, value) in zip(DayStats.__slots__, values):
+                    setattr(stats, slot, value)
+        except (KeyError, TypeError, AttributeError), e:
+            raise ValueError("bad rollup state: %s" % e)
@@ -0,0 +1,174 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Durable queue of the uploads of a REST service
+
+The entries are appended as json lines to the spool file, a batch of
+entries is written with one fsync. The file <spool>.ack holds the offset
+up to which all entries are acknowledged and the entries acknowledged out
+of order after it. After a restart the entries not acknowledged are pending
+again, so every entry is delivered at least once. Once all entries are
+acknowledged the spool file is truncated, a large spool file that is
+mostly acknowledged is rewritten with the pending entries only.
+"""
+
+import bisect
+import json
+import os
+import threading
+
+# the size of a spool file that is rewritten when most of it is acknowledged
+COMPACT_SIZE = 1 << 20
+
+class Spool(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.ack_path = path + '.ack'
+        self.lock = threading.Lock()
+        # the entries after the offset as [end offset, acknowledged, entry],
+        # ends holds their end offsets in the same ascending order, count
+        # the number of entries not acknowledged
+        self.entries = []
+        self.ends = []
+        self.count = 0
+
+        self.file = open(path, 'a+b')
+        (self.offset, acked) = self._read_ack(os.fstat(self.file.fileno()).st_ino)
+        self.file.seek(0, os.SEEK_END)
+        size = self.file.tell()
+        if self.offset > size:
+            # the spool was truncated after the offset was written
+            (self.offset, acked) = (0, set())
+        self.file.seek(self.offset)
+        end = self.offset
+        for line in self.file:
+            if not line.endswith('\n'):
+                break
+            end += len(line)
+            try:
+                self.entries.append([end, end in acked, json.loads(line)])
+            except ValueError:
+                self.entries.append([end, True, None])
+            self.ends.append(end)
+            self.count += not self.entries[-1][1]
+        if end < size:
+            # a torn write of the last entry
+            self.file.truncate(end)
+        self.file.seek(0, os.SEEK_END)
+
+    def _read_ack(self, inode):
+        # the offset and the keys acknowledged after it, of the spool file
+        # with the inode
+        try:
+            with open(self.ack_path) as f:
+                values = [int(value) for value in f.read().split()]
+        except (IOError, ValueError):
+            return 0, set()
+        if len(values) < 2 or values[0] != inode:
+            return 0, set()
+        return values[1], set(values[2:])
+
+    def _write_ack(self):
+        values = [os.fstat(self.file.fileno()).st_ino, self.offset]
+        values.extend(item[0] for item in self.entries if item[1])
+        tmp_path = self.ack_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(' '.join(str(value) for value in values) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.ack_path)
+
+    def append(self, entries):
+        # appends the json compatible entries with one fsync
+        if not entries:
+            return
+        lines = [json.dumps(entry, separators=(',', ':'), sort_keys=True) + '\n' for entry in entries]
+        # under the lock, so a concurrent commit does not truncate or
+        # rewrite the file in between
+        with self.lock:
+            self.file.seek(0, os.SEEK_END)
+            end = self.file.tell()
+            self.file.write(''.join(lines))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            for (line, entry) in zip(lines, entries):
+                end += len(line)
+                self.entries.append([end, False, entry])
+                self.ends.append(end)
+            self.count += len(entries)
+
+    def pending(self):
+        # the entries not acknowledged yet, as (key, entry) tuples
+        with self.lock:
+            return [(item[0], item[2]) for item in self.entries if not item[1]]
+
+    def ack(self, key):
+        # acknowledges the entry with the key from pending(), found by a
+        # binary search of the end offsets
+        with self.lock:
+            i = bisect.bisect_left(self.ends, key)
+            if i < len(self.ends) and self.ends[i] == key and not self.entries[i][1]:
+                self.entries[i][1] = True
+                self.count -= 1
+
+    def __len__(self):
+        # the number of entries not acknowledged yet
+        return self.count
+
+    def commit(self):
+        # writes the acknowledgements, moves the offset over the
+        # acknowledged head and truncates or rewrites the spool file
+        with self.lock:
+            done = 0
+            while done < len(self.entries) and self.entries[done][1]:
+                done += 1
+            if done:
+                self.offset = self.entries[done - 1][0]
+                del self.entries[:done]
+                del self.ends[:done]
+            if not self.entries and self.offset:
+                self.file.truncate(0)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.offset = 0
+            elif self.entries and self.entries[-1][0] >= COMPACT_SIZE:
+                pending = 0
+                start = self.offset
+                for (end, acked, entry) in self.entries:
+                    if not acked:
+                        pending += end - start
+                    start = end
+                if 2 * pending < self.entries[-1][0]:
+                    self._rewrite()
+            self._write_ack()
+
+    def _rewrite(self):
+        # replaces the spool file with its pending entries, the old
+        # acknowledgements no longer match the inode of the new file
+        self.entries = [item for item in self.entries if not item[1]]
+        lines = [json.dumps(item[2], separators=(',', ':'), sort_keys=True) + '\n' for item in self.entries]
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.path)
+        self.file.close()
+        self.file = open(self.path, 'a+b')
+        end = 0
+        for (item, line) in zip(self.entries, lines):
+            end += len(line)
+            item[0] = end
+        self.ends = [item[0] for item in self.entries]
+        self.offset = 0
+
+    def close(self):
+        self.file.close()
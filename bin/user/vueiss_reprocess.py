@@ -0,0 +1,221 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Regenerates the archive records of the VueISS driver from the raw frames
+
+The sensor history is split into chunks of a day. The packets of each chunk
+are regenerated by a PacketReplay of the driver in a pool of worker
+processes. The warm-up before each chunk makes them the same as from one
+parser running over the whole history.
+
+The packets are written back to the archive as records, the columns the
+driver provides are updated in one executemany per chunk and missing
+records are inserted. With dry_run nothing is written and the records are
+compared with the archive instead.
+
+The months pruned by wee_vueiss --prune are reprocessed from their frames
+in sensor_rollup, except for the stations of a registry.
+"""
+
+from __future__ import with_statement
+import multiprocessing
+import syslog
+import time
+
+import weedb
+import weewx
+import weewx.manager
+
+import user.drivers.vueiss as vueiss
+import user.vueiss_store as vueiss_store
+
+def logmsg(msg):
+    syslog.syslog(syslog.LOG_INFO, 'vueiss: %s' % msg)
+
+# the archive columns of the packets
+_COLUMNS = ('barometer', 'windSpeed', 'windDir', 'windGust', 'rain', 'rainRate',
+            'outTemp', 'outHumidity', 'dewpoint')
+
+# state of a worker process, set by _init_worker
+_worker = {}
+
+def _init_worker(config_dict, binding, binary, receiver_column, windows, altitude, station):
+    _worker['store'] = vueiss_store.SensorStore(config_dict, binding, binary=binary,
+                                                receiver_column=receiver_column)
+    _worker['rollup'] = vueiss_store.SensorStore(config_dict, binding, table='sensor_rollup')
+    _worker['replay'] = (windows, altitude, station)
+
+def _reprocess_chunk(chunk):
+    # parses the chunk (start, stop, oldest) in ms, oldest being the oldest
+    # frame, returns the chunk, the number of frames and its records
+    (start, stop, oldest) = chunk
+    replay = vueiss.PacketReplay(_worker['store'], *_worker['replay'], rollup=_worker['rollup'])
+    records = list(replay.packets(start, stop, oldest))
+    for record in records:
+        record['usUnits'] = weewx.METRICWX
+        record['interval'] = 1
+    return chunk, replay.frames, records
+
+class ArchiveWriter(object):
+    """Writes records into the archive table of a binding, or with dry_run
+    compares them with the archive table.
+
+    diffs counts the records per result: 'new' records are missing in the
+    archive, 'changed' records differ in at least one column, 'same' ones
+    are unchanged. changes holds the number of changed values and the
+    largest difference per column.
+    """
+
+    def __init__(self, config_dict, binding='wx_binding', dry_run=False):
+        self.manager = weewx.manager.open_manager_with_config(config_dict, binding)
+        self.mysql = self.manager.connection.dbtype == 'mysql'
+        self.dry_run = dry_run
+        self.columns = [column for column in _COLUMNS if column in self.manager.sqlkeys]
+        self.diffs = {'new': 0, 'changed': 0, 'same': 0}
+        self.changes = {}
+
+        table = self.manager.table_name
+        self._select = "SELECT dateTime,%s FROM %s WHERE dateTime>=? AND dateTime<?" % \
+            (','.join(self.columns), table)
+        self._update = "UPDATE %s SET %s WHERE dateTime=?" % \
+            (table, ','.join('%s=?' % column for column in self.columns))
+        insert_columns = ['dateTime', 'usUnits', 'interval'] + self.columns
+        self._insert = "INSERT INTO %s (%s) VALUES (%s)" % \
+            (table, ','.join('`%s`' % c if self.mysql else c for c in insert_columns),
+             ','.join('?' * len(insert_columns)))
+        self._insert_columns = insert_columns
+
+    def close(self):
+        self.manager.close()
+
+    def _existing(self, start, stop):
+        # the archive values of the records start..stop (in seconds)
+        existing = {}
+        for row in self.manager.genSql(self._select, (start, stop)):
+            existing[row[0]] = row[1:]
+        return existing
+
+    def write(self, start, stop, records):
+        # replaces the records of the chunk start..stop (in seconds)
+        existing = self._existing(start, stop)
+        updates = []
+        inserts = []
+        for record in records:
+            values = [record.get(column) for column in self.columns]
+            old = existing.get(record['dateTime'])
+            if old is None:
+                self.diffs['new'] += 1
+                inserts.append([record.get(column) for column in self._insert_columns])
+                continue
+            changed = False
+            for (column, value, old_value) in zip(self.columns, values, old):
+                if not _same(value, old_value):
+                    changed = True
+                    count, delta = self.changes.get(column, (0, 0.0))
+                    if value is not None and old_value is not None:
+                        delta = max(delta, abs(value - old_value))
+                    self.changes[column] = (count + 1, delta)
+            if changed:
+                self.diffs['changed'] += 1
+                updates.append(values + [record['dateTime']])
+            else:
+                self.diffs['same'] += 1
+
+        if self.dry_run or not (updates or inserts):
+            return
+        connection = self.manager.connection
+        with weedb.Transaction(connection):
+            cursor = connection.connection.cursor()
+            try:
+                for (sql, rows) in ((self._update, updates), (self._insert, inserts)):
+                    if rows:
+                        cursor.executemany(sql.replace('?', '%s') if self.mysql else sql, rows)
+            finally:
+                cursor.close()
+
+    def rebuild_summaries(self, start, stop):
+        # rebuilds the daily summaries of the days start..stop (in seconds)
+        if hasattr(self.manager, 'backfill_day_summary'):
+            self.manager.backfill_day_summary(start_ts=start, stop_ts=stop)
+
+# values of a column are equal within the precision of the database
+def _same(value, old_value):
+    if value is None or old_value is None:
+        return value is None and old_value is None
+    return abs(value - old_value) < 1e-6
+
+def chunk_range(start, stop, span):
+    # the chunks of span ms each from the minute of start up to stop
+    chunks = []
+    chunk = start - start % 60000
+    while chunk < stop:
+        chunks.append((chunk, min(chunk + span, stop)))
+        chunk += span
+    return chunks
+
+def reprocess(config_dict, binding='wx_binding', start=None, stop=None, span=86400,
+              processes=None, dry_run=False, progress=None):
+    """Regenerates the archive records from the sensor frames start..stop
+    (in seconds, default the whole history) in chunks of span seconds.
+
+    processes is the size of the worker pool, by default the number of
+    cpus. progress is called with the number of done and of all chunks,
+    the frames parsed and the seconds passed. Returns the ArchiveWriter,
+    whose diffs and changes describe the records.
+    """
+    stn_dict = config_dict.get('VueISS', {})
+    windows = tuple(int(stn_dict.get(option, default)) for (option, default) in vueiss.WINDOW_OPTIONS)
+    altitude = float(stn_dict.get('altitude', vueiss.ALTITUDE))
+    binary = stn_dict.get('sensor_format', 'text') == 'binary'
+    receiver_column = stn_dict.get('receiver_column')
+    # the records of the driver are those of the first station
+    stations = vueiss.get_stations(stn_dict)
+    station = stations[0] if stations else None
+
+    store = vueiss_store.SensorStore(config_dict, binding, binary=binary)
+    rollup = vueiss_store.SensorStore(config_dict, binding, table='sensor_rollup')
+    try:
+        oldest = vueiss.PacketReplay(store, windows, altitude, station, rollup).get_first()
+        head = store.get_head()
+        if head is None:
+            head = rollup.get_head()
+    finally:
+        store.close()
+        rollup.close()
+    if oldest is None:
+        return None
+    first = oldest if start is None else max(1000 * start, oldest)
+    last = head + 1 if stop is None else min(1000 * stop, head + 1)
+    if first >= last:
+        return None
+    chunks = [chunk + (oldest,) for chunk in chunk_range(first, last, 1000 * span)]
+
+    writer = ArchiveWriter(config_dict, binding, dry_run)
+    pool = multiprocessing.Pool(processes, _init_worker,
+                                (config_dict, binding, binary, receiver_column, windows, altitude, station))
+    started = time.time()
+    frames = 0
+    try:
+        for done, (chunk, count, records) in enumerate(pool.imap_unordered(_reprocess_chunk, chunks)):
+            writer.write(chunk[0] / 1000, chunk[1] / 1000, records)
+            frames += count
+            if progress is not None:
+                progress(done + 1, len(chunks), frames, time.time() - started)
+        pool.close()
+        if not dry_run:
+            writer.rebuild_summaries(first / 1000, last / 1000)
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        writer.close()
+    logmsg("Reprocessed %d chunks, %d frames in %.0f seconds" % (len(chunks), frames, time.time() - started))
+    return writer
@@ -0,0 +1,375 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Monthly partitions, retention and minute rollups of the VueISS sensor tables
+
+On MySQL the sensor table is partitioned by RANGE on dateTime, one partition
+per UTC month plus the catch-all partition pmax. SQLite has no partitions,
+there the sensor table becomes a view over one table per month and the
+catch-all table <table>_max, and INSTEAD OF INSERT triggers route the
+inserts of the datalogger into them. In both
+cases an expired month is removed by dropping its partition or table, which
+is a cheap DDL statement instead of a DELETE that locks the table.
+
+Before a month is dropped its frames can be rolled up into the table
+sensor_rollup: per minute packet of the parser one I frame per sensor with
+the mean, maximum or last value and one A frame with the mean sea level
+pressure. The parser reads these frames like raw frames: the archive
+records the driver replays and wee_vueiss --reprocess parse them before the
+oldest frame of the sensor table.
+"""
+
+import calendar
+import re
+import syslog
+import time
+
+import user.drivers.vueiss as vueiss
+import user.vueiss_store as vueiss_store
+
+def logmsg(msg):
+    syslog.syslog(syslog.LOG_INFO, 'vueiss: %s' % msg)
+
+# first millisecond of a (year, month)
+def month_start(month):
+    return 1000 * calendar.timegm((month[0], month[1], 1, 0, 0, 0))
+
+# the (year, month) of a timestamp in ms
+def month_of(data_time):
+    t = time.gmtime(data_time / 1000)
+    return t.tm_year, t.tm_mon
+
+def next_month(month):
+    return (month[0] + month[1] // 12, month[1] % 12 + 1)
+
+def add_months(month, count):
+    index = month[0] * 12 + month[1] - 1 + count
+    return (index // 12, index % 12 + 1)
+
+# the months from first to last, both included
+def month_range(first, last):
+    months = []
+    while first <= last:
+        months.append(first)
+        first = next_month(first)
+    return months
+
+class MySQLPartitions(object):
+    """RANGE partitions of a MySQL table, named pYYYYMM"""
+
+    def __init__(self, store):
+        self.store = store
+        self.table = store.table
+
+    def months(self):
+        rows = self.store.execute([("SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+                                    "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=?", (self.table,))])
+        months = []
+        for (name,) in rows:
+            match = re.match(r'p(\d{4})(\d{2})$', name or '')
+            if match:
+                months.append((int(match.group(1)), int(match.group(2))))
+        return sorted(months)
+
+    @staticmethod
+    def _definitions(months):
+        return ["PARTITION p%04d%02d VALUES LESS THAN (%d)" % (month + (month_start(next_month(month)),))
+                for month in months] + ["PARTITION pmax VALUES LESS THAN MAXVALUE"]
+
+    def partition(self, months):
+        self.store.execute([("ALTER TABLE %s PARTITION BY RANGE (dateTime) (%s)" %
+                             (self.table, ', '.join(self._definitions(months))), ())])
+
+    def add(self, months):
+        self.store.execute([("ALTER TABLE %s REORGANIZE PARTITION pmax INTO (%s)" %
+                             (self.table, ', '.join(self._definitions(months))), ())])
+
+    def drop(self, month):
+        self.store.execute([("ALTER TABLE %s DROP PARTITION p%04d%02d" % ((self.table,) + month), ())])
+
+class SQLitePartitions(object):
+    """Tables named <table>_YYYYMM and <table>_max behind the view <table>
+
+    As the partitions in MySQL, the first month also takes the older frames
+    and <table>_max, like pmax, the frames after the last month.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.table = store.table
+        self.maximum = self.table + '_max'
+
+    def _name(self, month):
+        return "%s_%04d%02d" % ((self.table,) + month)
+
+    def months(self):
+        rows = self.store.execute([("SELECT name FROM sqlite_master WHERE type='table' AND name GLOB ?",
+                                    (self.table + '_[0-9][0-9][0-9][0-9][0-9][0-9]',))])
+        return sorted((int(name[-6:-2]), int(name[-2:])) for (name,) in rows)
+
+    def _create(self, names, template):
+        statements = []
+        for name in names:
+            statements.append(("CREATE TABLE IF NOT EXISTS %s AS SELECT * FROM %s WHERE 0" % (name, template), ()))
+            statements.append(("CREATE INDEX IF NOT EXISTS %s_dateTime ON %s (dateTime)" % (name, name), ()))
+        return statements
+
+    def _ranges(self, months):
+        # the (table, start, stop) of the months and the catch-all table,
+        # None where a range is open
+        ranges = [(self._name(month), month_start(month) if i else None, month_start(next_month(month)))
+                  for (i, month) in enumerate(months)]
+        return ranges + [(self.maximum, month_start(next_month(months[-1])), None)]
+
+    @staticmethod
+    def _where(column, start, stop):
+        conditions = []
+        if start is not None:
+            conditions.append("%s>=%d" % (column, start))
+        if stop is not None:
+            conditions.append("%s<%d" % (column, stop))
+        return ' AND '.join(conditions)
+
+    def _view(self, months, columns):
+        # the view and its insert triggers, dropping the view drops them too
+        ranges = self._ranges(months)
+        statements = [("DROP VIEW IF EXISTS %s" % self.table, ()),
+                      ("CREATE VIEW %s AS %s" % (self.table, ' UNION ALL '.join(
+                          "SELECT * FROM %s" % name for (name, start, stop) in ranges)), ())]
+        for (name, start, stop) in ranges:
+            statements.append(("CREATE TRIGGER %s_insert INSTEAD OF INSERT ON %s "
+                               "WHEN %s BEGIN INSERT INTO %s (%s) VALUES (%s); END" %
+                               (name, self.table, self._where('NEW.dateTime', start, stop), name,
+                                ','.join(columns), ','.join('NEW.' + column for column in columns)), ()))
+        return statements
+
+    def partition(self, months):
+        # one transaction, the columns are those of the table before
+        template = self.table + '_unpartitioned'
+        columns = self.store._connect().columnsOf(self.table)
+        statements = [("ALTER TABLE %s RENAME TO %s" % (self.table, template), ())]
+        statements += self._create([self._name(month) for month in months] + [self.maximum], template)
+        for (name, start, stop) in self._ranges(months):
+            statements.append(("INSERT INTO %s SELECT * FROM %s WHERE %s" %
+                               (name, template, self._where('dateTime', start, stop)), ()))
+        statements += self._view(months, columns)
+        statements.append(("DROP TABLE %s" % template, ()))
+        self.store.execute(statements)
+
+    def add(self, months):
+        # moves the frames of the new months out of the catch-all table,
+        # which tables partitioned by older versions get here
+        existing = self.months()
+        template = self._name(existing[-1])
+        columns = self.store._connect().columnsOf(template)
+        statements = self._create([self._name(month) for month in months] + [self.maximum], template)
+        for (name, start, stop) in self._ranges(existing + months)[len(existing):-1]:
+            statements.append(("INSERT INTO %s SELECT * FROM %s WHERE %s" %
+                               (name, self.maximum, self._where('dateTime', start, stop)), ()))
+        statements.append(("DELETE FROM %s WHERE dateTime<%d" %
+                           (self.maximum, month_start(next_month(months[-1]))), ()))
+        self.store.execute(statements + self._view(existing + months, columns))
+
+    def drop(self, month):
+        months = [m for m in self.months() if m != month]
+        columns = self.store._connect().columnsOf(self._name(months[0]))
+        self.store.execute(self._create([self.maximum], self._name(months[0])) +
+                           self._view(months, columns) + [("DROP TABLE %s" % self._name(month), ())])
+
+def get_partitions(store):
+    if store.mysql:
+        return MySQLPartitions(store)
+    return SQLitePartitions(store)
+
+class MinuteRollup(object):
+    """Condenses the frames of a packet into frames the parser can read.
+
+    A packet of the parser holds the frames from one minute's first A or B
+    frame up to the next minute's first one. The values of these frames
+    are averaged with the parser's own 1-min accumulators and encoded back
+    into one I frame per sensor, followed by an A frame with the mean sea
+    level pressure at the time of the frame that completed the packet.
+    Gusts keep their maximum and rain the last tick counter, so the gusts
+    and the rain totals stay exact.
+    """
+
+    def __init__(self, height):
+        self.height = height
+        self.start = None
+        self.minute = None
+        self.reset()
+
+    def reset(self):
+        self.barometer_data = vueiss.BarometerData(self.height)
+        self.wind_data = vueiss.WindData()
+        self.temp_data = vueiss.TemperatureData()
+        self.humidy_data = vueiss.HumityData()
+        self.gust_data = vueiss.WindGustData()
+        self.rain_byte = None
+        self.headers = {}
+        self.last_pressure = None
+
+    def add(self, data_time, kind, frame, pressure):
+        # adds a decoded frame, returns the rollup rows of the packet it
+        # completes
+        if self.start is None:
+            self.start = data_time
+
+        if kind == 'A' or kind == 'B':
+            self.barometer_data.add(kind, pressure)
+            self.last_pressure = data_time
+            minute = data_time - data_time % 60000
+            if minute != self.minute:
+                self.minute = minute
+                return self.flush()
+        elif kind == 'I' and frame is not None and vueiss.crc_frame(frame) == 0:
+            self.wind_data.add(frame)
+            sensor = frame[0] >> 4
+            self.headers[sensor] = frame[0]
+            if sensor == 0x8:
+                self.temp_data.add(frame)
+            elif sensor == 0xA:
+                self.humidy_data.add(frame)
+            elif sensor == 0x9:
+                self.gust_data.add(frame)
+            elif sensor == 0xE:
+                self.rain_byte = frame[3]
+        return []
+
+    def flush(self):
+        # returns the rollup rows of the frames added so far and starts over
+        rows = []
+        if self.start is None:
+            return rows
+
+        wind = self.wind_data.get() or [0.0, None]
+        speed = min(int(round(wind[0] / 0.44704)), 0xff)
+        direction = int(round(wind[1] * 1024.0 / 360.0)) % 1024 if wind[1] is not None else 0
+
+        values = {}
+        temperature = self.temp_data.get()
+        if temperature is not None:
+            raw = int(round((temperature * 9.0 / 5.0 + 32.0) * 160.0)) & 0xffff
+            values[0x8] = (raw >> 8, raw & 0xff)
+        humidity = self.humidy_data.get()
+        if humidity is not None:
+            raw = min(int(round(humidity * 10.0 / 1.01)), 0xfff)
+            values[0xA] = (raw & 0xff, (raw >> 8) << 4)
+        gust = self.gust_data.get()
+        if gust is not None:
+            values[0x9] = (min(int(round(gust / 0.44704)), 0xff), 0)
+        if self.rain_byte is not None:
+            values[0xE] = (self.rain_byte, 0)
+        if not values and self.headers:
+            # a frame of another sensor still carries the wind
+            sensor = min(self.headers)
+            values[sensor] = (0, 0)
+
+        offset = 1
+        for sensor in sorted(values):
+            frame = [self.headers[sensor], speed, direction >> 2, values[sensor][0], values[sensor][1], 0]
+            crc = vueiss.crc_frame(frame)
+            frame += [crc >> 8, crc & 0xff, 0xff, 0xff]
+            rows.append((self.start + offset, 'I 0 ' + ' '.join('%02X' % x for x in frame), 'rollup'))
+            offset += 1
+
+        barometer = self.barometer_data.get()
+        if barometer is not None:
+            # A frames carry the sea level pressure
+            rows.append((self.last_pressure, 'A 0 0 0 %d' % int(round(barometer * 100.0)), 'rollup'))
+
+        self.start = self.last_pressure
+        self.reset()
+        return rows
+
+# the (dateTime, kind, frame, pressure) of a row in either table format
+def _decode_row(row, binary):
+    if binary:
+        (data_time, kind, frame, pressure) = row
+        if kind == 'I':
+            frame = vueiss._FRAME_BYTES.unpack_from(frame) if frame is not None and len(frame) >= 8 else None
+        return data_time, kind, frame, float(pressure) if pressure is not None else None
+    data = row[1].split() if row[1] else None
+    if not data:
+        return row[0], None, None, None
+    if data[0] == 'A' or data[0] == 'B':
+        return row[0], data[0], None, float(data[4])
+    return row[0], data[0], vueiss.decode_hex(data) if data[0] == 'I' else None, None
+
+def rollup_month(store, writer, month, height):
+    """Rolls the frames of month up into the table of writer, replacing the
+    rollup rows of an earlier run. Returns the number of rollup rows."""
+    start, stop = month_start(month), month_start(next_month(month))
+    writer.execute([("DELETE FROM %s WHERE dateTime>=? AND dateTime<?" % writer.table, (start, stop))])
+    insert = "INSERT INTO %s (dateTime,data,description) VALUES (?,?,?)" % writer.table
+
+    rollup = MinuteRollup(height)
+    count = 0
+    day = start
+    while day < stop:
+        # one transaction per day of rollup rows
+        rows = []
+        for row in store.stream_frames(day - 1, min(day + 86400000, stop) - 1):
+            rows += rollup.add(*_decode_row(row, store.binary))
+        day += 86400000
+        if day >= stop:
+            rows += rollup.flush()
+        writer.executemany(insert, rows)
+        count += len(rows)
+    return count
+
+def partition_table(config_dict, binding='wx_binding', binary=False, future=2):
+    """Converts the sensor table into monthly partitions, from its oldest
+    frame up to future months ahead."""
+    store = vueiss_store.SensorStore(config_dict, binding, binary=binary)
+    try:
+        first = store.get_first()
+        current = month_of(int(time.time() * 1000))
+        months = month_range(month_of(first) if first is not None else current, add_months(current, future))
+        get_partitions(store).partition(months)
+        logmsg("Partitioned %s into %d months" % (store.table, len(months)))
+    finally:
+        store.close()
+
+def maintain_partitions(config_dict, binding='wx_binding', binary=False,
+                        retention=12, rollup=True, future=2):
+    """Adds the partitions of the next future months and drops the months
+    older than retention months, rolling them up first if rollup is set.
+    Returns the list of dropped months."""
+    store = vueiss_store.SensorStore(config_dict, binding, binary=binary)
+    writer = vueiss_store.SensorStore(config_dict, binding, table='sensor_rollup')
+    height = float(config_dict.get('VueISS', {}).get('altitude', vueiss.ALTITUDE))
+    dropped = []
+    try:
+        partitions = get_partitions(store)
+        months = partitions.months()
+        if not months:
+            raise ValueError("table %s is not partitioned" % store.table)
+
+        current = month_of(int(time.time() * 1000))
+        missing = month_range(next_month(months[-1]), add_months(current, future))
+        if missing:
+            partitions.add(missing)
+            logmsg("Added partitions %s" % ', '.join('%04d%02d' % month for month in missing))
+
+        cutoff = add_months(current, -retention)
+        for month in months:
+            if month >= cutoff:
+                break
+            if rollup:
+                count = rollup_month(store, writer, month, height)
+                logmsg("Rolled up %04d%02d into %d frames" % (month + (count,)))
+            partitions.drop(month)
+            logmsg("Dropped partition %04d%02d" % month)
+            dropped.append(month)
+    finally:
+        store.close()
+        writer.close()
+    return dropped
@@ -0,0 +1,449 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""The sensor tables of the VueISS driver
+
+A SensorStore reads and writes the raw frames of the datalogger in the text
+table sensor or the binary table sensor_frame, and the checkpoint of the
+driver in last_sensor. The datalogger ingest stores the frames with a
+SensorIngest and signals the driver with notify_sensor. migrate_frames
+copies the text table into the binary one.
+"""
+
+from __future__ import with_statement
+import socket
+import struct
+import syslog
+import time
+try:
+    import MySQLdb
+    import MySQLdb.cursors
+    # the errors of a lost connection on a raw MySQLdb cursor
+    _MYSQL_ERRORS = (MySQLdb.OperationalError, MySQLdb.InterfaceError)
+except ImportError:
+    # only needed for the sensor tables in MySQL
+    MySQLdb = None
+    _MYSQL_ERRORS = ()
+
+import weedb
+import weewx.manager
+
+def logmsg(msg):
+    syslog.syslog(syslog.LOG_INFO, 'vueiss: %s' % msg)
+
+# the bytes of an I frame in sensor_frame
+_FRAME_SIZE = 10
+
+# signals a driver listening on path that new sensor rows were stored, data
+# is the stored frame; meant to be called by the datalogger ingest
+def notify_sensor(path, data='I'):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(data[:80], path)
+    except socket.error:
+        # the driver is not running
+        pass
+    finally:
+        sock.close()
+
+class SensorStore(object):
+    """Long-lived connection to the sensor tables of a database binding.
+
+    The connection is opened on first use and reopened once if the server
+    dropped it. The statements are constant and parameterized, so they are
+    built once and the server sees the same statement text every cycle.
+    connects and queries count the connection setups and round trips,
+    metrics gets the seconds of each query as query_seconds.
+
+    The frames are read from the text table sensor, or another table with
+    the same columns, with binary=True from the packed table sensor_frame,
+    whose rows are (dateTime, type, frame, pressure). receiver_column adds
+    the column with the receiver of a frame to the end of the rows.
+
+    In SQLite the writer connection creates the database and the sensor
+    tables and switches them to WAL mode; the queries run on a reader
+    connection of their own, which cannot write, so the driver reads while
+    the ingest writes.
+    """
+
+    _SELECT_CHECKPOINT = "SELECT dateTime,state FROM last_sensor"
+    _UPDATE_CHECKPOINT = "UPDATE last_sensor SET dateTime=?,state=?"
+    # the snapshot of a registry holds all stations, in MySQL more than the
+    # 64 KB of TEXT
+    _ADD_STATE = "ALTER TABLE last_sensor ADD COLUMN state %s"
+    _WIDEN_STATE = "ALTER TABLE last_sensor MODIFY state MEDIUMTEXT"
+    _SELECT_FRAMES = "SELECT %(columns)s FROM %(table)s WHERE dateTime>? ORDER BY dateTime ASC LIMIT ?"
+    _SELECT_WINDOW = "SELECT %(columns)s FROM %(table)s WHERE dateTime>? AND dateTime<=? ORDER BY dateTime ASC"
+    _SELECT_HEAD = "SELECT MAX(dateTime) FROM %(table)s"
+    _SELECT_FIRST = "SELECT MIN(dateTime) FROM %(table)s"
+    _INSERT_ROWS = "INSERT INTO %(table)s (%(columns)s) VALUES (%(values)s)"
+
+    # the tables of db/init.sql in SQLite, by the table they create or alter
+    _SQLITE_SCHEMA = (
+        ('sensor', "CREATE TABLE IF NOT EXISTS sensor (dateTime BIGINT NOT NULL, data VARCHAR(80), "
+         "description VARCHAR(80)%(receiver)s)"),
+        ('sensor', "CREATE INDEX IF NOT EXISTS sensor_dateTime ON sensor (dateTime)"),
+        ('sensor_frame', "CREATE TABLE IF NOT EXISTS sensor_frame (dateTime BIGINT NOT NULL, "
+         "type CHAR(1) NOT NULL, frame BLOB, pressure INT%(receiver)s)"),
+        ('sensor_frame', "CREATE INDEX IF NOT EXISTS sensor_frame_dateTime ON sensor_frame (dateTime)"),
+        ('sensor_rollup', "CREATE TABLE IF NOT EXISTS sensor_rollup (dateTime BIGINT NOT NULL, "
+         "data VARCHAR(80), description VARCHAR(80))"),
+        ('sensor_rollup', "CREATE INDEX IF NOT EXISTS sensor_rollup_dateTime ON sensor_rollup (dateTime)"),
+        ('last_sensor', "CREATE TABLE IF NOT EXISTS last_sensor (dateTime BIGINT NOT NULL, state TEXT)"),
+        ('last_sensor', "INSERT INTO last_sensor (dateTime) SELECT 0 WHERE NOT EXISTS "
+         "(SELECT 1 FROM last_sensor)"))
+
+    def __init__(self, config_dict, binding='wx_binding', binary=False, table=None, metrics=None,
+                 receiver_column=None):
+        manager_dict = weewx.manager.get_manager_dict_from_config(config_dict, binding)
+        self.database_dict = manager_dict['database_dict']
+        self.mysql = self.database_dict.get('driver') == 'weedb.mysql'
+        self.sqlite = self.database_dict.get('driver') == 'weedb.sqlite'
+        self.binary = binary
+        self.connection = None
+        self.reader = None
+        self.connects = 0
+        self.queries = 0
+        self.metrics = metrics
+
+        if binary:
+            names = {'columns': 'dateTime,type,frame,pressure', 'table': table or 'sensor_frame'}
+        else:
+            names = {'columns': 'dateTime,data', 'table': table or 'sensor'}
+        if receiver_column:
+            names['columns'] += ',' + receiver_column
+        self.receiver_column = receiver_column
+        self.table = names['table']
+        self._select_frames = self._SELECT_FRAMES % names
+        self._select_window = self._SELECT_WINDOW % names
+        self._select_head = self._SELECT_HEAD % names
+        self._select_first = self._SELECT_FIRST % names
+        names['values'] = ','.join('?' * len(names['columns'].split(',')))
+        self._insert_rows = self._INSERT_ROWS % names
+
+    def _connect(self, write=True):
+        # the connection for writes, in SQLite the reader for queries only
+        if self.sqlite and not write:
+            if self.reader is None:
+                self.reader = weedb.connect(self.database_dict)
+                self.reader.connection.execute("PRAGMA query_only=1")
+                self.connects += 1
+            return self.reader
+        if self.connection is None:
+            if self.sqlite:
+                self.connection = self._connect_sqlite()
+            else:
+                self.connection = weedb.connect(self.database_dict)
+            self.connects += 1
+        return self.connection
+
+    def _connect_sqlite(self):
+        # the writer connection in WAL mode, creates the database and the
+        # sensor tables if they do not exist
+        try:
+            connection = weedb.connect(self.database_dict)
+        except weedb.OperationalError:
+            weedb.create(self.database_dict)
+            connection = weedb.connect(self.database_dict)
+        connection.connection.execute("PRAGMA journal_mode=WAL")
+        connection.connection.execute("PRAGMA synchronous=NORMAL")
+        receiver = ', %s VARCHAR(16)' % self.receiver_column if self.receiver_column else ''
+        with weedb.Transaction(connection) as cursor:
+            # a table partitioned by wee_vueiss --partition is a view over
+            # its indexed month tables, see user.vueiss_retention
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='view'")
+            views = set(row[0] for row in cursor.fetchall())
+            for (table, sql) in self._SQLITE_SCHEMA:
+                if table not in views:
+                    cursor.execute(sql % {'receiver': receiver})
+        return connection
+
+    def close(self):
+        for connection in (self.connection, self.reader):
+            if connection is not None:
+                try:
+                    connection.close()
+                except weedb.DatabaseError:
+                    pass
+        self.connection = None
+        self.reader = None
+
+    def execute(self, statements):
+        # runs the (sql, args) statements in one transaction and returns the
+        # rows of the last one, reconnects once if the connection is lost
+        write = any(not sql.startswith('SELECT') for (sql, args) in statements)
+        for attempt in range(2):
+            connection = self._connect(write)
+            start = time.time()
+            try:
+                with weedb.Transaction(connection) as cursor:
+                    for (sql, args) in statements:
+                        cursor.execute(sql, args)
+                        self.queries += 1
+                    rows = list(cursor) if sql.startswith('SELECT') else None
+                if self.metrics is not None:
+                    self.metrics.observe('query_seconds', time.time() - start)
+                return rows
+            except weedb.OperationalError, e:
+                self.close()
+                if attempt:
+                    raise
+                logmsg("Reconnecting to sensor database: %s" % e)
+
+    def get_checkpoint(self):
+        # returns the checkpoint (in ms) and the parser state snapshot stored
+        # with it, adds the state column to tables of older versions and
+        # widens a MySQL TEXT column
+        connection = self._connect()
+        columns = dict((column[1], column[2]) for column in connection.genSchemaOf('last_sensor'))
+        if 'state' not in columns:
+            logmsg("Adding column state to table last_sensor")
+            self.execute([(self._ADD_STATE % ('MEDIUMTEXT' if self.mysql else 'TEXT'), ())])
+        elif self.mysql and columns['state'] == 'TEXT':
+            logmsg("Changing column state of table last_sensor to MEDIUMTEXT")
+            self.execute([(self._WIDEN_STATE, ())])
+        rows = self.execute([(self._SELECT_CHECKPOINT, ())])
+        if not rows:
+            return 0, None
+        return int(rows[-1][0]), rows[-1][1]
+
+    def set_checkpoint(self, checkpoint, state=None):
+        self.execute([(self._UPDATE_CHECKPOINT, (checkpoint, state))])
+
+    def get_frames(self, after, limit):
+        # the next rows after the timestamp after (in ms)
+        return self.execute([(self._select_frames, (after, limit))])
+
+    def get_head(self):
+        # the timestamp of the newest row (in ms)
+        rows = self.execute([(self._select_head, ())])
+        return int(rows[0][0]) if rows and rows[0][0] is not None else None
+
+    def get_first(self):
+        # the timestamp of the oldest row (in ms)
+        rows = self.execute([(self._select_first, ())])
+        return int(rows[0][0]) if rows and rows[0][0] is not None else None
+
+    def insert_frames(self, rows):
+        # inserts (dateTime, type, frame, pressure) rows, with the receiver
+        # last if the store has a receiver_column, into the binary table of
+        # this store in one transaction, with a single multi-row statement
+        # on MySQL
+        if not rows:
+            return
+        binary = MySQLdb.Binary if self.mysql else buffer
+        rows = [row[:2] + (binary(row[2]) if row[2] is not None else None,) + row[3:] for row in rows]
+        self.executemany(self._insert_rows, rows)
+
+    def insert_rows(self, rows):
+        # inserts rows of the columns of this store in one transaction
+        if rows:
+            self.executemany(self._insert_rows, rows)
+
+    def executemany(self, sql, rows, statements=()):
+        # runs the (sql, args) statements and then sql for all rows in one
+        # transaction, through the driver's executemany
+        connection = self._connect()
+        with weedb.Transaction(connection) as cursor:
+            for (statement, args) in statements:
+                cursor.execute(statement, args)
+                self.queries += 1
+            if rows:
+                cursor = connection.connection.cursor()
+                try:
+                    cursor.executemany(sql.replace('?', '%s') if self.mysql else sql, rows)
+                    self.queries += 1
+                finally:
+                    cursor.close()
+
+    def stream_frames(self, after, stop, block=1000):
+        # yields the rows after..stop (in ms) without loading them all, MySQL
+        # keeps the result on the server and hands it out block by block;
+        # the errors of the raw MySQL cursor are raised as those of weedb
+        connection = self._connect(False)
+        with weedb.Transaction(connection) as cursor:
+            sql = self._select_window
+            if self.mysql:
+                cursor = connection.connection.cursor(MySQLdb.cursors.SSCursor)
+                sql = sql.replace('?', '%s')
+            # the database time of the query and of all blocks, without
+            # the time the rows are processed
+            elapsed = 0.0
+            try:
+                start = time.time()
+                self._stream_execute(cursor, sql, (after, stop))
+                self.queries += 1
+                while True:
+                    rows = self._stream_fetch(cursor, block)
+                    elapsed += time.time() - start
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row
+                    start = time.time()
+            finally:
+                cursor.close()
+                if self.metrics is not None:
+                    self.metrics.observe('query_seconds', elapsed)
+
+    def _stream_execute(self, cursor, sql, args):
+        try:
+            cursor.execute(sql, args)
+        except _MYSQL_ERRORS, e:
+            raise weedb.OperationalError(e)
+
+    def _stream_fetch(self, cursor, block):
+        try:
+            return cursor.fetchmany(block)
+        except _MYSQL_ERRORS, e:
+            raise weedb.OperationalError(e)
+
+# Returns the (type, frame, pressure) columns of the sensor_frame table for a
+# split text frame, None if the frame cannot be stored
+def encode_frame(data):
+    if not data:
+        return None
+
+    if data[0] == 'A' or data[0] == 'B':
+        try:
+            return data[0], None, int(round(float(data[4])))
+        except (IndexError, ValueError):
+            return None
+
+    if data[0] == 'I':
+        try:
+            values = [int(x, 16) for x in data[2:2 + _FRAME_SIZE]]
+        except ValueError:
+            return None
+        if len(values) < 8 or min(values) < 0 or max(values) > 0xff:
+            return None
+        values += [0] * (_FRAME_SIZE - len(values))
+        return 'I', struct.pack('%dB' % _FRAME_SIZE, *values), None
+
+    return None
+
+def migrate_frames(config_dict, binding='wx_binding', span=86400):
+    """Copies the text table sensor into the binary table sensor_frame.
+
+    The frames are streamed in windows of span seconds, each window is
+    inserted in one transaction. An interrupted migration continues after
+    the newest frame already copied. Returns the number of copied and of
+    skipped frames.
+    """
+    reader = SensorStore(config_dict, binding)
+    writer = SensorStore(config_dict, binding, binary=True)
+    copied = skipped = 0
+    try:
+        head = reader.get_head()
+        after = writer.get_head()
+        if after is None:
+            first = reader.get_first()
+            after = first - 1 if first is not None else None
+        while head is not None and after < head:
+            stop = min(after + 1000 * span, head)
+            rows = []
+            for (data_time, strdata) in reader.stream_frames(after, stop):
+                columns = encode_frame(strdata.split() if strdata else None)
+                if columns is None:
+                    skipped += 1
+                else:
+                    rows.append((data_time,) + columns)
+            writer.insert_frames(rows)
+            copied += len(rows)
+            after = stop
+            logmsg("Migrated frames up to %d (%d copied, %d skipped)" % (stop/1000, copied, skipped))
+    finally:
+        reader.close()
+        writer.close()
+    return copied, skipped
+
+class SensorIngest(object):
+    """Stores the frames of the datalogger in the table the driver reads,
+    sensor or with sensor_format = binary sensor_frame.
+
+    The frames are buffered and inserted with one executemany, once
+    batch_size frames are buffered, the oldest one waited flush_interval
+    seconds or an A or B frame completes a minute of the driver; poll()
+    flushes a due batch while no frames arrive. After each batch the driver
+    is signalled on notify_socket. With a receiver_column in [VueISS] the
+    rows carry receiver. Frames the binary table cannot hold are skipped
+    and counted, as by migrate_frames.
+    """
+
+    def __init__(self, config_dict, binding='wx_binding', batch_size=100, flush_interval=1.0,
+                 receiver='0'):
+        stn_dict = config_dict.get('VueISS', {})
+        self.store = SensorStore(config_dict, binding,
+                                 binary=stn_dict.get('sensor_format', 'text') == 'binary',
+                                 receiver_column=stn_dict.get('receiver_column'))
+        self.notify_socket = stn_dict.get('notify_socket')
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.receiver = receiver
+        self.rows = []
+        self.first_time = None
+        self.last_time = 0
+        self.frames = 0
+        self.skipped = 0
+
+    def add(self, data, data_time=None):
+        # buffers a frame, data_time in ms defaults to now; the driver reads
+        # after the time of the last frame, so the default times are unique
+        now = time.time()
+        if data_time is None:
+            data_time = max(int(now * 1000), self.last_time + 1)
+        self.last_time = data_time
+        if self.store.binary:
+            columns = encode_frame(data.split())
+            if columns is None:
+                self.skipped += 1
+                return
+            row = (data_time,) + columns
+        else:
+            row = (data_time, data)
+        if self.store.receiver_column:
+            row += (self.receiver,)
+        if not self.rows:
+            self.first_time = now
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size or data[:1] in ('A', 'B'):
+            self.flush()
+        else:
+            self.poll(now)
+
+    def poll(self, now):
+        # flushes the buffered frames if the oldest one waited long enough,
+        # returns the seconds until the next flush is due, None if nothing is
+        # buffered
+        if not self.rows:
+            return None
+        if now - self.first_time >= self.flush_interval:
+            self.flush()
+            return None
+        return self.first_time + self.flush_interval - now
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.store.binary:
+            self.store.insert_frames(self.rows)
+        else:
+            self.store.insert_rows(self.rows)
+        self.frames += len(self.rows)
+        if self.notify_socket:
+            # the text frame or the type of the binary frame
+            notify_sensor(self.notify_socket, self.rows[-1][1] or 'I')
+        self.rows = []
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.store.close()
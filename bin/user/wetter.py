@@ -7,18 +7,48 @@ Upload data to wetter.com
         enable = true | false
         username = STATION ID
         password = STATION PASSWORD
+        # records of a backlog posted at the same time, each post keeps its
+        # connection open for the next one
+        concurrency = 4
+        # of the records of a backlog only the newest one per
+        # coalesce_interval seconds is posted, 0 posts all
+        coalesce_interval = 0
+        # upload counters and latency, logged every stats_interval seconds
+        # and written in the Prometheus text format to stats_file
+        stats_interval = 300
+        stats_file = /var/lib/prometheus/node-exporter/wetter.prom
+        # the records to post are kept in spool_file until the server took
+        # them, after a restart the uploader resumes with them
+        spool_file = /var/lib/weewx/wetter.spool
+        # after a failed post the uploads pause for backoff seconds, doubled
+        # with each further failure up to max_backoff; the records of the
+        # pause stay in the spool
+        backoff = 60
+        max_backoff = 3600
+
+The uploader may also run as a target of user.restfanout.FanOut, which
+shares the converted records and the posting threads with other uploaders.
 """
 
+import httplib
+import itertools
 import Queue
+import socket
 import sys
 import syslog
+import threading
 import time
 import urllib
 import urllib2
+import urlparse
 
 import weewx.restx
 import weewx.units
-from weeutil.weeutil import to_bool
+from weeutil.weeutil import to_bool, timestamp_to_string
+
+import user.metrics
+import user.restfanout
+import user.spool
 
 API_VERSION = "5.0.2 - 2015/06/01"
 
@@ -79,12 +109,19 @@ class WetterThread(weewx.restx.RESTThread):
                  'teo': ('extraTemp1',  '%.1f'), # C
                  'tes': ('soilTemp1',   '%.1f')  # C
                  }
+    _ENCODER = user.restfanout.FieldEncoder(_DATA_MAP)
+
+    # the units of the records of get_data and encode
+    unit_system = weewx.METRICWX
 
     def __init__(self, queue, username, password, manager_dict,
                  server_url=_SERVER_URL, skip_upload=False,
                  post_interval=None, max_backlog=sys.maxint, stale=None,
                  log_success=True, log_failure=True,
-                 timeout=60, max_tries=3, retry_wait=5):
+                 timeout=60, max_tries=3, retry_wait=5,
+                 concurrency=4, coalesce_interval=0,
+                 stats_interval=300, stats_file=None, spool_file=None,
+                 backoff=60, max_backoff=3600):
         super(WetterThread, self).__init__(queue,
                                            protocol_name='Wetter',
                                            manager_dict=manager_dict,
@@ -100,17 +137,264 @@ class WetterThread(weewx.restx.RESTThread):
         self.password = password
         self.server_url = server_url
         self.skip_upload = to_bool(skip_upload)
+        self.concurrency = max(int(concurrency), 1)
+        self.coalesce_interval = int(coalesce_interval)
+        # the keep-alive connection of each posting thread
+        self.connections = threading.local()
+        # the failed posts in a row and the time until which the uploads
+        # pause after the last one
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.failures = 0
+        self.retry_time = 0
+        self.lock = threading.Lock()
+        # a post succeeded since the last commit
+        self.posted = False
+        # the keys of the entries of enqueue without a spool
+        self.keys = itertools.count()
+        self.metrics = user.metrics.Metrics('wetter', interval=float(stats_interval), path=stats_file)
+        self.spool = user.spool.Spool(spool_file) if spool_file else None
+        if self.spool is not None and len(self.spool):
+            loginf("Resuming with %d spooled records" % len(self.spool))
+
+    def run_loop(self, dbmanager=None):
+        # posts the records of the queue, a backlog is posted concurrently,
+        # the spooled records of the last run first
+        records = []
+        try:
+            while True:
+                done = records and records[-1] is None
+                try:
+                    self.post_records([record for record in records if record is not None], dbmanager)
+                except weewx.restx.BadLogin, e:
+                    logerr("Bad login: %s; waiting 60 minutes then retrying" % e)
+                    time.sleep(3600)
+                if done:
+                    return
+                records = self.get_backlog()
+        finally:
+            self.close()
+
+    def get_backlog(self):
+        return user.restfanout.get_backlog(self.queue)
+
+    def post_records(self, records, dbmanager):
+        # enriches, converts and posts the records
+        records = [weewx.units.to_std_system(self.get_record(record, dbmanager), self.unit_system)
+                   for record in self.select(records)]
+        entries = self.enqueue(records)
+        if not entries:
+            return
+        if self.backing_off(time.time()):
+            if self.spool is None:
+                loginf("Dropping %d records during the pause" % len(entries))
+                self.metrics.add('records_dropped_total', len(entries))
+            return
+
+        if len(entries) > 1:
+            loginf("Posting a backlog of %d records" % len(entries))
+        work = Queue.Queue()
+        for item in entries:
+            work.put(item)
+        errors = []
+        threads = [threading.Thread(target=self.post_queue, args=(work, errors, True))
+                   for _ in range(min(self.concurrency, len(entries)) - 1)]
+        try:
+            for thread in threads:
+                thread.start()
+            self.post_queue(work, errors, False)
+        finally:
+            for thread in threads:
+                thread.join()
+            self.commit()
+        for e in errors:
+            if isinstance(e, weewx.restx.BadLogin):
+                raise e
+
+    def select(self, records):
+        # the records to post, trimmed to max_backlog and coalesced
+        if len(records) > self.max_backlog + 1:
+            records = records[-(self.max_backlog + 1):]
+        if self.coalesce_interval and len(records) > 1:
+            newest = {}
+            for record in records:
+                newest[record['dateTime'] // self.coalesce_interval] = record
+            self.metrics.add('records_coalesced_total', len(records) - len(newest))
+            records = sorted(newest.values(), key=lambda record: record['dateTime'])
+        return [record for record in records if not self.skip_this_post(record['dateTime'])]
+
+    def enqueue(self, records):
+        # the (key, entry) items to post of the converted records, with the
+        # spooled ones; the spool keeps the encoded records, so they are not
+        # read again after a restart
+        entries = []
+        for record in records:
+            data = self.encode(record)
+            if data is not None:
+                entries.append({'dateTime': record['dateTime'], 'data': data})
+        if self.spool is None:
+            return [(next(self.keys), entry) for entry in entries]
+        self.spool.append(entries)
+        return self.get_spooled()
+
+    def commit(self):
+        # ends the posts of enqueue; the spool is only drained after a
+        # successful post, a failed batch leaves the file as it is
+        if self.spool is not None:
+            if self.posted:
+                self.posted = False
+                self.spool.commit()
+            self.metrics.set('spool_depth', len(self.spool))
+
+    def close(self):
+        if self.spool is not None:
+            self.spool.close()
+
+    def get_spooled(self):
+        # the spooled entries to post, the stale ones and the ones beyond
+        # max_backlog are dropped
+        entries = self.spool.pending()
+        dropped = []
+        if len(entries) > self.max_backlog + 1:
+            dropped = entries[:-(self.max_backlog + 1)]
+            entries = entries[-(self.max_backlog + 1):]
+        if self.stale:
+            now = time.time()
+            dropped += [item for item in entries if now - item[1]['dateTime'] > self.stale]
+            entries = [item for item in entries if now - item[1]['dateTime'] <= self.stale]
+        if dropped:
+            loginf("Dropping %d spooled records" % len(dropped))
+            self.metrics.add('records_dropped_total', len(dropped))
+            for (key, entry) in dropped:
+                self.spool.ack(key)
+        return entries
+
+    def backing_off(self, now):
+        # True while the uploads pause after a failed post
+        return now < self.retry_time
+
+    def post_queue(self, work, errors, close):
+        # posts the entries of work until it is empty or a post failed, the
+        # entries left stay in the spool; close closes the connection of a
+        # helper thread at the end
+        try:
+            while not errors:
+                try:
+                    (key, entry) = work.get_nowait()
+                except Queue.Empty:
+                    break
+                self.post_item(key, entry)
+        except (weewx.restx.BadLogin, weewx.restx.FailedPost), e:
+            errors.append(e)
+        finally:
+            if close:
+                self.close_connection()
+
+    def post_item(self, key, entry):
+        # posts an entry of enqueue, raises FailedPost if the server did not
+        # take it; the entry then stays in the spool
+        self.post_record(entry)
+        if self.spool is not None:
+            self.spool.ack(key)
+
+    def post_record(self, entry):
+        # posts the encoded record; a failed post pauses the uploads
+        try:
+            self.post_with_retries(self.get_request(entry['data']))
+            self.metrics.add('records_total')
+            with self.lock:
+                self.failures = 0
+                self.retry_time = 0
+                self.posted = True
+            if self.log_success:
+                loginf("Published record %s" % timestamp_to_string(entry['dateTime']))
+        except weewx.restx.FailedPost, e:
+            self.metrics.add('records_failed_total')
+            if self.log_failure:
+                logerr("Failed to publish record %s: %s" % (timestamp_to_string(entry['dateTime']), e))
+            self.pause()
+            raise
+        finally:
+            self.metrics.set('lag_seconds', time.time() - entry['dateTime'])
+            self.metrics.report(time.time(), loginf)
+
+    def pause(self):
+        # pauses the uploads for backoff seconds, doubled with each failed
+        # post in a row up to max_backoff
+        with self.lock:
+            wait = min(self.backoff * 2 ** min(self.failures, 16), self.max_backoff)
+            self.failures += 1
+            self.retry_time = time.time() + wait
+        loginf("Pausing the uploads for %.0f seconds" % wait)
 
     def process_record(self, record, dbmanager):
-        r = self.get_record(record, dbmanager)
-        data = self.get_data(r)
-        url = urllib.urlencode(data)
+        data = self.encode(weewx.units.to_std_system(self.get_record(record, dbmanager), self.unit_system))
+        if data is not None:
+            self.post_with_retries(self.get_request(data))
+
+    def encode(self, record):
+        # the url encoded data of the converted record, None with skip_upload
+        url = urllib.urlencode(self.get_values(record))
         if self.skip_upload:
             loginf("skipping upload")
-            return
-        req = urllib2.Request(self.server_url, url)
+            return None
+        return url
+
+    def get_request(self, data):
+        req = urllib2.Request(self.server_url, str(data))
         req.add_header("User-Agent", "weewx/%s" % weewx.__version__)
-        self.post_with_retries(req)
+        return req
+
+    def post_request(self, request, *args):
+        # one attempt of post_with_retries on the keep-alive connection of
+        # the thread, the attempts beyond the records are the retries
+        start = time.time()
+        self.metrics.add('attempts_total')
+        try:
+            connection = getattr(self.connections, 'connection', None)
+            if connection is not None:
+                try:
+                    return self.send(connection, request)
+                except socket.timeout:
+                    raise
+                except (httplib.HTTPException, socket.error):
+                    # the server closed the idle connection, post again on a
+                    # new one
+                    pass
+            return self.send(self.open_connection(request), request)
+        except Exception:
+            self.metrics.add('attempts_failed_total')
+            raise
+        finally:
+            self.metrics.observe('upload_seconds', time.time() - start)
+
+    def open_connection(self, request):
+        url = urlparse.urlsplit(request.get_full_url())
+        if url.scheme == 'https':
+            connection = httplib.HTTPSConnection(url.hostname, url.port, timeout=self.timeout)
+        else:
+            connection = httplib.HTTPConnection(url.hostname, url.port, timeout=self.timeout)
+        self.connections.connection = connection
+        self.metrics.add('connects_total')
+        return connection
+
+    def send(self, connection, request):
+        headers = dict(request.header_items())
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            connection.request('POST', request.get_selector(), request.get_data(), headers)
+            response = connection.getresponse()
+            # the body is read at once, so the connection can be used again
+            return Response(response.status, response.read())
+        except:
+            self.close_connection()
+            raise
+
+    def close_connection(self):
+        connection = getattr(self.connections, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.connections.connection = None
 
     def check_response(self, response):
         txt = response.read().lower()
@@ -123,8 +407,9 @@ class WetterThread(weewx.restx.RESTThread):
 
     def get_data(self, in_record):
         # put everything into the right units
-        record = weewx.units.to_METRICWX(in_record)
+        return self.get_values(weewx.units.to_METRICWX(in_record))
 
+    def get_values(self, record):
         # put data into expected scaling, structure, and format
         values = {}
         values['id'] = self.username
@@ -132,9 +417,14 @@ class WetterThread(weewx.restx.RESTThread):
         values['sid'] = 'weewx'
         values['ver'] = weewx.__version__
         values['dtutc'] = time.strftime('%Y%m%d%H%M', time.gmtime(record['dateTime']))
-        for key in self._DATA_MAP:
-            rkey = self._DATA_MAP[key][0]
-            if record.has_key(rkey) and record[rkey] is not None:
-                values[key] = self._DATA_MAP[key][1] % record[rkey]
+        return self._ENCODER.encode(record, values)
+
+class Response(object):
+    """The status and the body of a response, as post_with_retries expects"""
+
+    def __init__(self, code, body):
+        self.code = code
+        self.body = body
 
-        return values
+    def read(self):
+        return self.body
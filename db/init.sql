@@ -5,8 +5,24 @@ CREATE TABLE sensor (
   INDEX (dateTime)
 );
 
+CREATE TABLE sensor_frame (
+  dateTime BIGINT NOT NULL,
+  type     CHAR(1) NOT NULL,
+  frame    BINARY(10),
+  pressure INT,
+  INDEX (dateTime)
+);
+
+CREATE TABLE sensor_rollup (
+  dateTime    BIGINT NOT NULL,
+  data        VARCHAR(80),
+  description VARCHAR(80),
+  INDEX (dateTime)
+);
+
 CREATE TABLE last_sensor (
-  dateTime BIGINT NOT NULL
+  dateTime BIGINT NOT NULL,
+  state    MEDIUMTEXT
 );
 
 INSERT INTO last_sensor VALUES(0);
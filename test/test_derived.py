@@ -0,0 +1,85 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Tests of the derived quantities"""
+
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+
+# user.derived from this working tree
+import bench_vueiss
+import user.derived
+
+# temperatures around the limits of the formulas, with 0 C
+TEMPERATURES = [-30.0, -10.5, -0.1, 0.0, 0.1, 9.9, 10.0, 10.1, 20.0, 26.6, 26.7, 35.0, 45.0]
+HUMIDITIES = [1.0, 15.0, 39.9, 40.0, 65.0, 99.0, 100.0]
+WIND_SPEEDS = [0.0, 1.3, 1.4, 3.0, 15.0, 40.0]
+
+class DerivedTest(unittest.TestCase):
+
+    def assertAgree(self, scalar, array, *columns):
+        # the array function agrees with the scalar one for all values
+        expected = [scalar(*values) for values in zip(*columns)]
+        actual = array(*[numpy.array(column) for column in columns]).tolist()
+        for (values, x, y) in zip(zip(*columns), expected, actual):
+            if x is None:
+                self.assertTrue(numpy.isnan(y), values)
+            else:
+                self.assertAlmostEqual(x, y, places=9, msg=str(values))
+
+    def grid(self, first, second):
+        pairs = [(x, y) for x in first for y in second]
+        return ([x for (x, y) in pairs], [y for (x, y) in pairs])
+
+    def test_svp(self):
+        self.assertAgree(user.derived.svp, user.derived.svp_array, TEMPERATURES)
+        self.assertAlmostEqual(user.derived.svp(0.0), user.derived.C1)
+        self.assertEqual(user.derived.svp(None), None)
+
+    def test_dewpoint(self):
+        self.assertAgree(user.derived.dewpoint, user.derived.dewpoint_array,
+                         *self.grid(TEMPERATURES, HUMIDITIES + [0.0]))
+        # 0 C is a temperature, not a missing value
+        self.assertAlmostEqual(user.derived.dewpoint(0.0, 100.0), 0.0)
+        self.assertTrue(user.derived.dewpoint(0.0, 50.0) < 0.0)
+        self.assertEqual(user.derived.dewpoint(None, 50.0), None)
+
+    def test_absolute_humidity(self):
+        self.assertAgree(user.derived.absolute_humidity, user.derived.absolute_humidity_array,
+                         *self.grid(TEMPERATURES, HUMIDITIES))
+
+    def test_wind_chill(self):
+        self.assertAgree(user.derived.wind_chill, user.derived.wind_chill_array,
+                         *self.grid(TEMPERATURES, WIND_SPEEDS))
+        # JAG/TI at 0 C and 20 km/h
+        self.assertAlmostEqual(user.derived.wind_chill(0.0, 20 / 3.6), -5.2, places=1)
+        self.assertEqual(user.derived.wind_chill(0.0, 1.0), 0.0)
+
+    def test_heat_index(self):
+        self.assertAgree(user.derived.heat_index, user.derived.heat_index_array,
+                         *self.grid(TEMPERATURES, HUMIDITIES))
+        # Rothfusz at 32 C and 70 percent
+        self.assertAlmostEqual(user.derived.heat_index(32.0, 70.0), 40.4, places=1)
+        self.assertEqual(user.derived.heat_index(20.0, 70.0), 20.0)
+
+    def test_missing(self):
+        # None of the scalar functions is NaN of the array functions
+        self.assertAgree(user.derived.wind_chill, user.derived.wind_chill_array,
+                         [0.0, None], [None, 5.0])
+        self.assertAgree(user.derived.heat_index, user.derived.heat_index_array,
+                         [30.0, None], [None, 50.0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Tests of the notifications of the sensor ingest to the driver"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+
+# user.drivers.vueiss and user.vueiss_store from this working tree
+from bench_vueiss import vueiss, vueiss_store
+
+class Clock(object):
+    """time of the driver module, sleep advances it without sleeping"""
+
+    def __init__(self, now):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class NotifierTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'sensor.sock')
+
+    def tearDown(self):
+        vueiss.time = time
+        shutil.rmtree(self.tmp)
+
+    def wait(self, notifier, packet_time):
+        start = time.time()
+        woken = notifier.wait(packet_time)
+        return (woken, time.time() - start)
+
+    def test_wakes_on_complete_frames(self):
+        # the packet of this minute is out, so without a notification the
+        # next poll is after the next minute boundary
+        notifier = vueiss.SensorNotifier(self.path)
+        minute = int(time.time()) // 60 * 60
+        try:
+            for data in ('A1234', 'B5678'):
+                vueiss_store.notify_sensor(self.path, data)
+                self.assertEqual(self.wait(notifier, minute)[0], True)
+            # a notification while the driver waits wakes it up
+            timer = threading.Timer(0.2, vueiss_store.notify_sensor, (self.path, 'A'))
+            timer.start()
+            (woken, seconds) = self.wait(notifier, minute)
+            timer.join()
+            self.assertEqual(woken, True)
+            self.assertTrue(seconds < 5)
+        finally:
+            notifier.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_ignores_other_frames(self):
+        # I frames do not complete a packet, the driver waits for the poll
+        notifier = vueiss.SensorNotifier(self.path, poll_interval=0.5, poll_delay=0.2)
+        try:
+            vueiss_store.notify_sensor(self.path, 'I1234')
+            timer = threading.Timer(0.05, vueiss_store.notify_sensor, (self.path, 'I'))
+            timer.start()
+            (woken, seconds) = self.wait(notifier, None)
+            timer.join()
+            self.assertEqual(woken, False)
+            self.assertTrue(seconds >= 0.15)
+            # A among other frames wakes it up
+            for data in ('I', 'A', 'I'):
+                vueiss_store.notify_sensor(self.path, data)
+            self.assertEqual(self.wait(notifier, None)[0], True)
+        finally:
+            notifier.close()
+
+    def test_poll_without_socket(self):
+        # without notifications the driver polls poll_delay after the minute
+        # of its last packet and backs off until the next packet is out
+        clock = vueiss.time = Clock(1500000010.0)
+        notifier = vueiss.SensorNotifier(poll_interval=15.0, poll_delay=2.0)
+        self.assertEqual(notifier.wait(1500000000), False)
+        self.assertEqual(clock.now, 1500000062.0)
+        for delay in (2.0, 4.0, 8.0, 15.0, 15.0):
+            self.assertEqual(notifier.wait(1500000000), False)
+            self.assertEqual(clock.sleeps[-1], delay)
+        self.assertEqual(notifier.wait(1500000060), False)
+        self.assertEqual(clock.now, 1500000122.0)
+        # the back-off starts again after a packet
+        self.assertEqual(notifier.wait(1500000060), False)
+        self.assertEqual(clock.sleeps[-1], 2.0)
+        notifier.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Tests of the durable upload spool"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+
+# user.spool from this working tree
+import bench_vueiss
+import user.spool
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'test.spool')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_ack_out_of_order(self):
+        spool = user.spool.Spool(self.path)
+        spool.append([{'n': n} for n in range(100)])
+        keys = [key for (key, entry) in spool.pending()]
+        for key in keys[50:] + keys[:10]:
+            spool.ack(key)
+        # an unknown or repeated key changes nothing
+        spool.ack(keys[0])
+        spool.ack(keys[-1] + 1)
+        self.assertEqual(len(spool), 40)
+        self.assertEqual([entry['n'] for (key, entry) in spool.pending()], range(10, 50))
+        spool.commit()
+        spool.close()
+
+        # after a restart the acknowledgements out of order still hold
+        spool = user.spool.Spool(self.path)
+        self.assertEqual([entry['n'] for (key, entry) in spool.pending()], range(10, 50))
+        for (key, entry) in spool.pending():
+            spool.ack(key)
+        spool.commit()
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(os.path.getsize(self.path), 0)
+        spool.close()
+
+    def test_rewrite(self):
+        # a large spool that is mostly acknowledged keeps its pending
+        # entries with their new keys
+        spool = user.spool.Spool(self.path)
+        spool.append([{'n': n, 'data': 'x' * 1000} for n in range(2000)])
+        keys = [key for (key, entry) in spool.pending()]
+        for key in keys[1:1500]:
+            spool.ack(key)
+        spool.commit()
+        self.assertTrue(os.path.getsize(self.path) < 600 * 1024)
+        pending = spool.pending()
+        self.assertEqual([entry['n'] for (key, entry) in pending], [0] + range(1500, 2000))
+        for (key, entry) in pending[1:]:
+            spool.ack(key)
+        self.assertEqual([entry['n'] for (key, entry) in spool.pending()], [0])
+        spool.close()
+
+if __name__ == '__main__':
+    unittest.main()
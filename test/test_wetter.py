@@ -0,0 +1,184 @@
+##
+##This program is free software; you can redistribute it and/or modify it under
+##the terms of the GNU General Public License as published by the Free Software
+##Foundation; either version 2 of the License, or (at your option) any later
+##version.
+##
+##This program is distributed in the hope that it will be useful, but WITHOUT
+##ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+##FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+##details.
+"""Tests of the Wetter uploader against a local HTTP server
+
+Like the benchmarks the tests use the modules of this working tree and
+need weewx on the PYTHONPATH, e.g.
+
+    PYTHONPATH=/home/weewx/bin python -m unittest discover test
+"""
+
+import BaseHTTPServer
+import os
+import Queue
+import shutil
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+
+# user.wetter from this working tree
+import bench_vueiss
+import weewx
+import user.wetter
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers the posts as interface.wetterarchiv.de, on keep-alive
+    connections unless the server closes them"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        with server.lock:
+            server.posts.append((self.client_address, body))
+            status = server.status
+        reply = '{"status":"success"}' if status == 200 else 'error'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+        # without a Connection header, the client finds out on its next post
+        self.close_connection = server.close
+
+    def log_message(self, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves each connection in a thread of its own, so the concurrent
+    keep-alive connections of a backlog do not wait for each other"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.lock = threading.Lock()
+        self.posts = []
+        self.status = 200
+        self.close = False
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/weather' % self.server_address[1]
+
+    @property
+    def connections(self):
+        return len(set(address for (address, body) in self.posts))
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def make_record(ts):
+    return {'dateTime': ts, 'usUnits': weewx.METRICWX, 'interval': 1,
+            'outTemp': 12.5, 'outHumidity': 80.0, 'barometer': 1013.2,
+            'hourRain': 0.0, 'rain24': 0.0, 'dayRain': 0.0}
+
+class WetterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server()
+        self.tmp = tempfile.mkdtemp()
+        self.threads = []
+
+    def tearDown(self):
+        for thread in self.threads:
+            thread.close()
+            thread.close_connection()
+        self.server.stop()
+        shutil.rmtree(self.tmp)
+
+    def make_thread(self, **kwargs):
+        options = {'server_url': self.server.url, 'log_success': False, 'log_failure': False,
+                   'timeout': 5, 'max_tries': 1, 'retry_wait': 0,
+                   'stats_file': os.path.join(self.tmp, 'wetter.prom')}
+        options.update(kwargs)
+        thread = user.wetter.WetterThread(Queue.Queue(), 'test', 'secret', None, **options)
+        self.threads.append(thread)
+        return thread
+
+    def test_keep_alive(self):
+        # the posts of a thread reuse its connection
+        thread = self.make_thread(concurrency=1)
+        now = int(time.time())
+        for i in range(3):
+            thread.post_records([make_record(now + i)], None)
+        self.assertEqual(len(self.server.posts), 3)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_reconnect(self):
+        # a connection the server closed is replaced, the record is posted
+        # once
+        self.server.close = True
+        thread = self.make_thread(concurrency=1)
+        now = int(time.time())
+        for i in range(3):
+            thread.post_records([make_record(now + i)], None)
+        self.assertEqual(len(self.server.posts), 3)
+        self.assertEqual(self.server.connections, 3)
+        self.assertFalse(thread.backing_off(time.time()))
+
+    def test_backlog(self):
+        # a backlog is posted on at most concurrency connections and
+        # leaves the spool empty
+        thread = self.make_thread(concurrency=3, spool_file=os.path.join(self.tmp, 'wetter.spool'))
+        now = int(time.time()) - 600
+        thread.post_records([make_record(now + 60 * i) for i in range(10)], None)
+        self.assertEqual(len(self.server.posts), 10)
+        self.assertEqual(len(set(body for (address, body) in self.server.posts)), 10)
+        self.assertTrue(self.server.connections <= 3)
+        self.assertEqual(len(thread.spool), 0)
+
+    def test_failed_post(self):
+        # the first failed post ends the backlog, the records stay in the
+        # spool and are posted after the pause
+        self.server.status = 500
+        thread = self.make_thread(concurrency=1, spool_file=os.path.join(self.tmp, 'wetter.spool'))
+        now = int(time.time()) - 600
+        thread.post_records([make_record(now + 60 * i) for i in range(5)], None)
+        self.assertEqual(len(self.server.posts), 1)
+        self.assertEqual(len(thread.spool), 5)
+        self.assertTrue(thread.backing_off(time.time()))
+        # the spool is not drained without a successful post
+        self.assertFalse(os.path.exists(thread.spool.ack_path))
+
+        # during the pause the records are spooled only
+        thread.post_records([make_record(now + 300)], None)
+        self.assertEqual(len(self.server.posts), 1)
+        self.assertEqual(len(thread.spool), 6)
+
+        self.server.status = 200
+        thread.retry_time = 0
+        thread.post_records([], None)
+        self.assertEqual(len(self.server.posts), 7)
+        self.assertEqual(len(thread.spool), 0)
+        self.assertEqual(thread.failures, 0)
+
+    def test_backoff(self):
+        # the pause doubles with each failure in a row up to max_backoff
+        thread = self.make_thread(backoff=10, max_backoff=30)
+        waits = []
+        for i in range(4):
+            start = time.time()
+            thread.pause()
+            waits.append(round(thread.retry_time - start))
+        self.assertEqual(waits, [10, 20, 30, 30])
+
+if __name__ == '__main__':
+    unittest.main()